@@ -0,0 +1,38 @@
+"""
+ETags for tasks and task lists, for conditional requests. A task's ETag is derived
+from its id and version, which is incremented each time the task changes. A task
+list's ETag is a digest of the ETags of the tasks on the page, and of the rest of
+the response, so checking it only needs the ids and versions and not a serialization
+of the list.
+"""
+
+import hashlib
+
+
+def task_etag(task) -> str:
+    return f'"{task.id}-{task.version}"'
+
+
+def list_etag(tasks, next_cursor: str | None = None, revision: str = "") -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for task in tasks:
+        digest.update(f"{task.id}-{task.version}\n".encode())
+    digest.update(f"{next_cursor or ''}\n{revision}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(header: str | None, etag: str, weak: bool = False) -> bool:
+    """Whether an If-Match or If-None-Match header value matches etag. If-None-Match
+    uses the weak comparison, which ignores the W/ prefix. If-Match uses the strong one.
+    """
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    for value in header.split(","):
+        value = value.strip()
+        if weak:
+            value = value.removeprefix("W/")
+        if value == etag:
+            return True
+    return False
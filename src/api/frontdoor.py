@@ -0,0 +1,41 @@
+"""
+Routing requests around the browser-only middleware. Programmatic clients send an
+access token in an Authorization: Bearer header and no cookies, so they have no
+session to decode and nothing for CSRF protection to do, yet would otherwise pay
+for both, including signing a fresh CSRF cookie for every response.
+"""
+from starlette.middleware import Middleware
+
+
+def is_bearer_only(scope) -> bool:
+    """Whether the request has a Bearer token and no cookies. Requests with both go
+    the browser way, so a session cookie is never used without CSRF protection.
+    """
+    bearer = False
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            return False
+        if name == b"authorization":
+            bearer = value[:7].lower() == b"bearer "
+    return bearer
+
+
+class BearerFastPath:
+    """Sends HTTP requests that are bearer-only straight to app, and everything else
+    through the browser middleware first. The browser middleware is given as a list
+    of starlette Middleware, outermost first, as for a Starlette app.
+
+    Anything behind this must not assume that there is a session in the scope.
+    """
+
+    def __init__(self, app, browser_middleware: list[Middleware]):
+        self.app = app
+        self.browser = app
+        for middleware in reversed(browser_middleware):
+            self.browser = middleware.cls(self.browser, **middleware.options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and is_bearer_only(scope):
+            await self.app(scope, receive, send)
+        else:
+            await self.browser(scope, receive, send)
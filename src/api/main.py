@@ -1,34 +1,50 @@
+import asyncio
 import datetime
+import json
 from asgi_csrf import asgi_csrf
-from fastapi import Body, Depends, FastAPI, HTTPException
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from starlette.authentication import requires
+from starlette.middleware import Middleware
 from starlette.middleware.authentication import AuthenticationMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
 from starlette.requests import Request
 from common.backends import SessionAuthBackend
+from common import ratelimit
 from common.config import settings
+from common.events import hub as task_events
+from common.metrics import HandlerLabelMiddleware, MetricsMiddleware, registry
 from common.models import OAuth2Client, OAuth2Token, Task
+from common.reaper import reap_tokens, sync_denied_tokens
+from common.sessions import session_middleware
+from common.tokens import denied
+from .conditional import etag_matches, list_etag, task_etag
 from .forms import OAuth2ClientTokenRequestForm, OAuth2ClientRefreshTokenRequestForm
+from .frontdoor import BearerFastPath
+from .pagination import decode_cursor, encode_cursor
+from .serialization import FastJSONResponse, task_fields
 from .validation import (
     Message,
     OAuth2TokenResponse,
+    TaskBatchCreate,
+    TaskBatchResponse,
+    TaskBatchUpdate,
+    TaskChanges,
     TaskCreate,
     TaskUpdate,
     TaskResponse,
     TaskList,
 )
 
-
 app = FastAPI(debug=True)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+if settings.METRICS_ENABLED:
+    app.add_middleware(HandlerLabelMiddleware)
 
 
 def bypass_csrf(scope):
@@ -42,27 +58,55 @@ def bypass_csrf(scope):
     return settings.BYPASS_API_CSRF
 
 
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(ratelimit.RateLimitMiddleware)
+
+# CORS wraps the rate limiter, so that browsers can read its 429 responses
 app.add_middleware(
-    asgi_csrf,  # Thanks @simonw!
-    signing_secret=settings.CSRF_KEY,
-    always_set_cookie=True,
-    skip_if_scope=bypass_csrf,
+    CORSMiddleware,
+    allow_origins=settings.CORS_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
 )
 
-
 app.add_middleware(AuthenticationMiddleware, backend=SessionAuthBackend())
 
 
+# Sessions and CSRF protection only apply to browser requests, see api.frontdoor
 app.add_middleware(
-    SessionMiddleware,
-    secret_key=settings.SECRET_KEY,
-    session_cookie=settings.SESSION_COOKIE,
-    max_age=settings.SESSION_EXPIRE_SECONDS,
-    same_site=settings.SESSION_SAME_SITE,
-    https_only=False,
+    BearerFastPath,
+    browser_middleware=[
+        session_middleware(),
+        Middleware(
+            asgi_csrf,  # Thanks @simonw!
+            signing_secret=settings.CSRF_KEY,
+            always_set_cookie=True,
+            skip_if_scope=bypass_csrf,
+        ),
+    ],
 )
 
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, name="api")
+
+
+@app.on_event("startup")
+async def start_token_reaper():
+    app.state.token_reaper = asyncio.create_task(reap_tokens())
+    app.state.deny_list_sync = None
+    if denied.repository is not None:
+        app.state.deny_list_sync = asyncio.create_task(sync_denied_tokens())
+
+
+@app.on_event("shutdown")
+async def stop_token_reaper():
+    app.state.token_reaper.cancel()
+    if app.state.deny_list_sync is not None:
+        app.state.deny_list_sync.cancel()
+
+
 @app.get("/", include_in_schema=False)
 async def home():
     return {
@@ -79,43 +123,309 @@ async def clients(request: Request):
 
     I find it questionable to expose these in the API via client credential/token
     authentication, thus I have marked the required scope to be app_auth, and have
-    removed this from the docs.
+    removed this from the docs. Only the ids are returned, since the client objects
+    carry the secret hash and the user.
+    """
+    clients = await OAuth2Client.aget_for_user(request.user)
+    return {"clients": [{"client_id": client.client_id} for client in clients]}
+
+
+def ndjson_tasks(tasks):
+    for task in tasks:
+        yield json.dumps(
+            {"id": task.id, "description": task.description, "done": task.done}
+        ) + "\n"
+
+
+@app.get("/stats", include_in_schema=False)
+@requires("admin_auth")
+async def stats(request: Request):
+    """Internal counters for the in-process caches. Superusers only, via the console
+    session.
     """
-    clients = OAuth2Client.get_for_user(request.user)
-    return {clients: clients}
+    return {
+        "client_cache": OAuth2Client.cache_stats(),
+        "tokens": await OAuth2Token.astore_stats(),
+        "denied_tokens": len(denied),
+        "task_events": task_events.stats,
+        "rate_limits": {
+            "clients": ratelimit.clients.stats,
+            "users": ratelimit.users.stats,
+            "token_requests": ratelimit.token_requests.stats,
+        },
+    }
 
 
-@app.get("/tasks", response_model=TaskList)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Request and model call metrics in the Prometheus text format."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get(
+    "/tasks",
+    response_model=TaskList,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}},
+        304: {"description": "The list has not changed since the given ETag"},
+        400: {
+            "model": Message,
+            "description": "The cursor or since is not valid, or since is given "
+            "with a cursor, limit or ndjson format",
+        },
+        410: {
+            "model": Message,
+            "description": "since is from before the server's tasks were replaced",
+        },
+    },
+)
 @requires("api_auth")
-async def get_tasks(request: Request):
+async def get_tasks(
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: str | None = None,
+    format: str = Query("json", regex="^(json|ndjson)$"),
+    since: str | None = None,
+    if_none_match: str | None = Header(None),
+):
     """Get the list of tasks. Returns all tasks for the user associated with the
     client credentials, or the currently authenticated user in the UI.
+
+    Tasks are listed in creation order. If a limit is given, at most that many tasks
+    are returned along with a next_cursor, which may be passed as the cursor
+    parameter to fetch the following page. next_cursor is null on the last page.
+
+    With format=ndjson, tasks are streamed as newline-delimited JSON objects, one
+    per task, instead of being returned as a single document.
+
+    JSON responses carry an ETag. Pass it back in If-None-Match to get an empty 304
+    response if the page has not changed.
+
+    JSON responses also carry the user's task revision, taken before the tasks were
+    read. Pass it back as since to get only the tasks created or changed after it,
+    in creation order, all at once. The revision names the server's store of tasks
+    as well as a point in it. If that store has been replaced since, e.g. on restart
+    with in-memory storage, the response is a 410 and the client should start over.
+    A since that is not a revision at all is a 400.
+    """
+    after = decode_cursor(cursor)
+    if since is not None and (cursor or limit or format == "ndjson"):
+        raise HTTPException(
+            status_code=400,
+            detail="since can't be combined with a cursor, limit or ndjson format",
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            ndjson_tasks(Task.iter_for_user(request.user, after, limit)),
+            media_type="application/x-ndjson",
+        )
+    revision = await Task.alatest_revision(request.user)
+    next_cursor = None
+    if since is not None:
+        try:
+            tasks = await Task.achanged_since(request.user, since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid revision")
+        if tasks is None:
+            raise HTTPException(
+                status_code=410,
+                detail="The tasks have been replaced since this revision, get them all",
+            )
+    else:
+        tasks, next_after = await Task.apage_for_user(request.user, after, limit)
+        if next_after is not None:
+            next_cursor = encode_cursor(next_after)
+    etag = list_etag(tasks, next_cursor, revision)
+    if etag_matches(if_none_match, etag, weak=True):
+        return Response(status_code=304, headers={"ETag": etag})
+    if settings.FAST_JSON_ENABLED:
+        return FastJSONResponse(
+            {
+                "tasks": [task_fields(task) for task in tasks],
+                "next_cursor": next_cursor,
+                "revision": revision,
+            },
+            headers={"ETag": etag},
+        )
+    response.headers["ETag"] = etag
+    return {"tasks": tasks, "next_cursor": next_cursor, "revision": revision}
+
+
+def sse(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+async def task_event_stream(user_id, last_event_id):
+    """Subscribes once the response starts, so that a client that is gone before
+    then leaves no subscription behind.
+    """
+    subscription = None
+    try:
+        subscription, missed = task_events.subscribe(user_id, last_event_id)
+        for event in missed:
+            yield sse(event.id(task_events.epoch), event.kind, event.task)
+        while True:
+            try:
+                event = await subscription.get(settings.EVENT_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield sse(event.id(task_events.epoch), event.kind, event.task)
+    finally:
+        if subscription is not None:
+            task_events.unsubscribe(subscription)
+
+
+@app.get(
+    "/tasks/events",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+@requires("api_auth")
+async def get_task_events(
+    request: Request,
+    last_event_id: str | None = Header(None),
+):
+    """A Server-Sent Events stream of changes to the user's tasks. Each event is
+    "created" or "updated", with the task as its data.
+
+    Reconnecting clients should send the id of the last event they received as the
+    Last-Event-ID header, as browsers' EventSource does, to be sent the events they
+    missed. If those can no longer be replayed, e.g. after a restart of the api, the
+    stream starts with a "reset" event, after which the client should refetch
+    /tasks. The stream ends if the client falls too far behind, in which case it
+    should reconnect the same way.
     """
-    return {"tasks": Task.for_user(request.user)}
+    return StreamingResponse(
+        task_event_stream(request.user.id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @app.post("/tasks", response_model=TaskResponse, status_code=201)
 @requires("api_auth")
 async def create_task(request: Request, task: TaskCreate):
     """Create a new task."""
-    return Task.create(request.user, task.description)
+    task = await Task.acreate(request.user, task.description)
+    if settings.FAST_JSON_ENABLED:
+        return FastJSONResponse(task_fields(task), status_code=201)
+    return task
+
+
+@app.post("/tasks/batch", response_model=TaskBatchResponse, status_code=201)
+@requires("api_auth")
+async def create_tasks(request: Request, data: TaskBatchCreate):
+    """Create several tasks at once. Either all of the tasks are created, or none are.
+    Results are in the order of the submitted tasks.
+    """
+    tasks = await Task.acreate_many(
+        request.user, [task.description for task in data.tasks]
+    )
+    return {"results": [{"id": task.id, "status": 201, "task": task} for task in tasks]}
 
 
-@app.put(
-    "/tasks/{task_id}",
-    response_model=TaskResponse,
-    responses={404: {"model": Message, "description": "The item was not found"}},
+@app.patch(
+    "/tasks/batch",
+    response_model=TaskBatchResponse,
+    responses={
+        404: {
+            "model": TaskBatchResponse,
+            "description": "Some of the items were not found. No changes were made.",
+        }
+    },
 )
 @requires("api_auth")
-async def update_task(request: Request, task_id: str, data: TaskUpdate):
-    """Update the given tasks. Only superusers may update other users' tasks."""
-    task = Task.table.get(task_id)
-    if task is None:
-        raise HTTPException(status_code=404)
-    if task.user == request.user or request.user.superuser:
-        return task.update(**data.dict())
-    else:
-        raise HTTPException(status_code=404)
+async def update_tasks(request: Request, data: TaskBatchUpdate):
+    """Update several tasks at once. Only the fields given for each task are changed.
+    Either all of the updates are applied, or none are. Results are in the order of
+    the submitted updates.
+
+    If any of the tasks is not found, the response is a 404 with per-item results:
+    404 for the missing tasks and 424 for the rest, none of which were applied. Only
+    superusers may update other users' tasks.
+    """
+    changes = [
+        (patch.id, patch.dict(exclude={"id"}, exclude_none=True))
+        for patch in data.tasks
+    ]
+    tasks, missing = await Task.aupdate_many(request.user, changes)
+    if missing:
+        results = [
+            {"id": task_id, "status": 404 if task_id in missing else 424}
+            for task_id, _ in changes
+        ]
+        return JSONResponse({"results": results}, status_code=404)
+    return {"results": [{"id": task.id, "status": 200, "task": task} for task in tasks]}
+
+
+async def update_owned_task(request, response, task_id, data, if_match):
+    """If the task is saved by someone else between reading and saving it here, it is
+    read again, so that If-Match is checked against the saved task.
+    """
+    while True:
+        task = await Task.aget(task_id)
+        if task is None:
+            raise HTTPException(status_code=404)
+        if not (task.user_id == request.user.id or request.user.superuser):
+            raise HTTPException(status_code=404)
+        if if_match is not None and not etag_matches(if_match, task_etag(task)):
+            raise HTTPException(status_code=412)
+        task = await task.aupdate(**data)
+        if task is not None:
+            break
+    etag = task_etag(task)
+    if settings.FAST_JSON_ENABLED:
+        return FastJSONResponse(task_fields(task), headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return task
+
+
+UPDATE_RESPONSES = {
+    404: {"model": Message, "description": "The item was not found"},
+    412: {"model": Message, "description": "The item has changed since If-Match"},
+}
+
+
+@app.put("/tasks/{task_id}", response_model=TaskResponse, responses=UPDATE_RESPONSES)
+@requires("api_auth")
+async def update_task(
+    request: Request,
+    response: Response,
+    task_id: str,
+    data: TaskUpdate,
+    if_match: str | None = Header(None),
+):
+    """Update the given tasks. Only superusers may update other users' tasks.
+
+    The response carries the task's new ETag. If If-Match is given and does not
+    match the task's current ETag, the task is not changed and the response is 412.
+    """
+    return await update_owned_task(
+        request, response, task_id, data.dict(exclude={"id"}), if_match
+    )
+
+
+@app.patch("/tasks/{task_id}", response_model=TaskResponse, responses=UPDATE_RESPONSES)
+@requires("api_auth")
+async def patch_task(
+    request: Request,
+    response: Response,
+    task_id: str,
+    data: TaskChanges,
+    if_match: str | None = Header(None),
+):
+    """Change only the given fields of a task, e.g. {"done": true}. Otherwise the
+    same as PUT.
+    """
+    return await update_owned_task(
+        request, response, task_id, data.dict(exclude_none=True), if_match
+    )
 
 
 @app.post("/token", response_model=OAuth2TokenResponse)
@@ -138,14 +448,18 @@ async def token(form_data: OAuth2ClientTokenRequestForm = Depends()):
     errors, e.g. if the application is restarted. Deleting the client's .key file
     should fix this (or run the command `tasks.py reset`).
     """
-    client = OAuth2Client.get(form_data.client_id)
+    if settings.RATE_LIMIT_ENABLED:
+        wait = ratelimit.token_requests.take(form_data.client_id)
+        if wait:
+            raise HTTPException(status_code=429, headers=ratelimit.retry_after(wait))
+    client = await OAuth2Client.aget(form_data.client_id)
     if client is None:
         raise HTTPException(status_code=401)
-    if (
-        client.client_secret != form_data.client_secret
-    ):  # TODO: secret should probably be hashed
+    if not await client.averify_secret(form_data.client_secret):
         raise HTTPException(status_code=401)
-    token = OAuth2Token.create_for_client(client, form_data.grant_type, scope="api")
+    token = await OAuth2Token.acreate_for_client(
+        client, form_data.grant_type, scope="api"
+    )
     expires = (token.access_token_expires_at - datetime.datetime.utcnow()).seconds
     return OAuth2TokenResponse(
         access_token=token.access_token,
@@ -160,8 +474,8 @@ async def refresh_token(form_data: OAuth2ClientRefreshTokenRequestForm = Depends
      * grant_type (must be set to "refresh_token")d
      * refresh_token (the refresh token of your active credentials)
 
-    Due to ephemeral storage of tokens in this implementation, you may get a KeyError,
-    e.g. if the application is restarted. This is analagous to a refresh token being
+    Due to ephemeral storage of tokens in this implementation, you may get a 401, e.g.
+    if the application is restarted. This is analagous to a refresh token being
     revoked with client credentials left intact, thus clients should simply retry with
     the original ID/secret credentials.
 
@@ -169,10 +483,14 @@ async def refresh_token(form_data: OAuth2ClientRefreshTokenRequestForm = Depends
     serves the purpose of avoiding passing the primary credentials around any more
     than necessary.
 
-    As implemented, refresh tokens do not expire. It is not clear to me if there is
-    a concept of refresh-token timeout in the spec.
+    As implemented, refresh tokens are evicted REFRESH_TOKEN_GRACE_SECONDS after
+    their access token expires. It is not clear to me if there is a concept of
+    refresh-token timeout in the spec.
     """
-    token = OAuth2Token.refresh(form_data.refresh_token)
+    try:
+        token = await OAuth2Token.arefresh(form_data.refresh_token)
+    except KeyError:
+        raise HTTPException(status_code=401)
     expires = (token.access_token_expires_at - datetime.datetime.utcnow()).seconds
     return OAuth2TokenResponse(
         access_token=token.access_token,
@@ -0,0 +1,28 @@
+"""
+Opaque cursors for paging through list endpoints. A cursor encodes the position
+after the last item of the page in the user's task ordering, see
+TaskRepository.page_for_user. Clients should treat cursors as opaque strings and
+simply pass back the next_cursor value from the previous page.
+"""
+import base64
+import binascii
+import json
+from fastapi import HTTPException
+
+
+def encode_cursor(after: int) -> str:
+    data = json.dumps({"after": after}).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> int:
+    if not cursor:
+        return 0
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        after = json.loads(data)["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(after, int) or after < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after
@@ -0,0 +1,44 @@
+"""
+Fast JSON responses for the task endpoints, enabled by setting FAST_JSON_ENABLED.
+
+FastAPI validates whatever an endpoint returns against its response_model, and then
+converts it with jsonable_encoder, before encoding it. For a list of tasks that is
+most of the time spent on the request. Endpoints can skip all of that by returning
+a Response themselves. They keep their response_model, so the OpenAPI schema is the
+same either way, and the serializers here are built from those models, so that they
+emit exactly the models' fields.
+
+The responses are encoded with orjson if it is installed, otherwise with json.
+"""
+import json
+import operator
+from starlette.responses import JSONResponse
+from .validation import TaskResponse
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def serializer(model):
+    """A function returning a dict of the fields of model, a pydantic model, taken
+    from the attributes of an object. The values are not validated or converted, so
+    they must already be of the types the model declares.
+    """
+    fields = tuple(model.__fields__)
+    if len(fields) == 1:
+        return lambda obj: {fields[0]: getattr(obj, fields[0])}
+    values = operator.attrgetter(*fields)
+    return lambda obj: dict(zip(fields, values(obj)))
+
+
+task_fields = serializer(TaskResponse)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+BATCH_MAX_ITEMS = 1000
 
 
 class Message(BaseModel):
@@ -38,3 +40,43 @@ class TaskResponse(BaseModel):
 class TaskList(BaseModel):
 
     tasks: list[TaskResponse]
+    next_cursor: str | None = None
+    revision: str
+
+
+class TaskBatchCreate(BaseModel):
+
+    tasks: list[TaskCreate] = Field(..., min_items=1, max_items=BATCH_MAX_ITEMS)
+
+
+class TaskChanges(BaseModel):
+    """A partial update. Fields that are not given are left unchanged."""
+
+    description: str | None = None
+    done: bool | None = None
+
+
+class TaskPatch(TaskChanges):
+    """A partial update of one task in a batch."""
+
+    id: str
+
+
+class TaskBatchUpdate(BaseModel):
+
+    tasks: list[TaskPatch] = Field(..., min_items=1, max_items=BATCH_MAX_ITEMS)
+
+
+class TaskBatchResult(BaseModel):
+    """The outcome for one item of a batch, with an HTTP status code. Items that were
+    not applied because another item in the batch failed have status 424.
+    """
+
+    id: str
+    status: int
+    task: TaskResponse | None = None
+
+
+class TaskBatchResponse(BaseModel):
+
+    results: list[TaskBatchResult]
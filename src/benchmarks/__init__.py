@@ -0,0 +1,15 @@
+"""
+Benchmarks for the hot paths of the api and console. Run these from the src
+directory, like the applications themselves, e.g.:
+
+  python -m benchmarks.task_listing
+
+The settings required by common.config are defaulted here so that the benchmarks
+can be run without a .env file.
+"""
+import os
+
+os.environ.setdefault("CSRF_KEY", "benchmark-csrf")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+# Most benchmarks drive one client far past any sensible rate limit.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
@@ -0,0 +1,76 @@
+"""
+Minimal in-process ASGI client for driving the applications concurrently from a
+single event loop, without sockets or an HTTP client library.
+"""
+import json
+import time
+from urllib.parse import urlencode
+
+
+class Response:
+    def __init__(self, status, headers, body, seconds):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.seconds = seconds
+
+    def json(self):
+        return json.loads(self.body)
+
+
+async def request(app, method, path, headers=None, body=b"", form=None, json_=None):
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    if form is not None:
+        body = urlencode(form).encode()
+        headers["content-type"] = "application/x-www-form-urlencoded"
+    elif json_ is not None:
+        body = json.dumps(json_).encode()
+        headers["content-type"] = "application/json"
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in headers.items()]
+        + [(b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    status = None
+    response_headers = {}
+    chunks = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for key, value in message.get("headers", []):
+                response_headers[key.decode()] = value.decode()
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return Response(
+        status, response_headers, b"".join(chunks), time.perf_counter() - started
+    )
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
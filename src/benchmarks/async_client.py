@@ -0,0 +1,101 @@
+"""
+Creating tasks one POST /tasks at a time from tasks.py, against the api served by
+uvicorn: APIClient, which makes one call at a time, against AsyncAPIClient with a
+few levels of concurrency over its keep-alive connection pool. Then the token of an
+AsyncAPIClient is revoked under a burst of concurrent requests, which should renew
+it once.
+
+  python -m benchmarks.async_client
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+import requests
+from .multi_worker import wait_for
+
+PORT = 5098
+TASKS = 1000
+CONCURRENCY = [1, 8, 32]
+BURST = 50
+
+
+async def create_tasks(api, count):
+    responses = await asyncio.gather(
+        *[api.post("/tasks", {"description": f"task {i}"}) for i in range(count)]
+    )
+    assert all(r.status_code == 201 for r in responses), responses[0].text
+
+
+async def async_runs(tasks):
+    for concurrency in CONCURRENCY:
+        async with tasks.AsyncAPIClient(
+            os.environ["CLIENT_ID"],
+            os.environ["CLIENT_SECRET"],
+            concurrency=concurrency,
+        ) as api:
+            started = time.perf_counter()
+            await create_tasks(api, TASKS)
+            rate = TASKS / (time.perf_counter() - started)
+        print(f"{'AsyncAPIClient':>15} {concurrency:>12} {rate:>8.0f}")
+
+
+async def burst(tasks):
+    async with tasks.AsyncAPIClient(
+        os.environ["CLIENT_ID"], os.environ["CLIENT_SECRET"]
+    ) as api:
+        await create_tasks(api, 1)
+        r = requests.post(
+            tasks.APIClient.REFRESH_URL,
+            data={
+                "grant_type": "refresh_token",
+                "refresh_token": api.token["refresh_token"],
+            },
+        )
+        assert r.status_code == 200, r.text  # api.token is now revoked
+        renewals = []
+        save = api.saved_token.save
+        api.saved_token.save = lambda token: renewals.append(token) or save(token)
+        await create_tasks(api, BURST)
+        print(f"{BURST} requests with a revoked token: {len(renewals)} renewal(s)")
+
+
+def main():
+    src = Path(__file__).parents[1]
+    sys.path.insert(0, str(src.parent))  # for tasks.py
+    os.environ.update(
+        API_ROOT=f"http://127.0.0.1:{PORT}", OAUTHLIB_INSECURE_TRANSPORT="1"
+    )
+    from common.models import OAuth2Client, User
+
+    client, secret = OAuth2Client.create(User.get(1))
+    os.environ.update(CLIENT_ID=client.client_id, CLIENT_SECRET=secret)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(PORT)]
+        + ["--no-access-log", "--log-level", "warning"],
+    )
+    try:
+        wait_for(lambda: socket.create_connection(("127.0.0.1", PORT)))
+        import tasks
+
+        print(f"{TASKS} x POST /tasks")
+        print(f"{'client':>15} {'concurrency':>12} {'tasks/s':>8}")
+        started = time.perf_counter()
+        for i in range(TASKS):
+            r = tasks.api().post("/tasks", {"description": f"task {i}"})
+            assert r.status_code == 201, r.text
+        rate = TASKS / (time.perf_counter() - started)
+        print(f"{'APIClient':>15} {1:>12} {rate:>8.0f}")
+        asyncio.run(async_runs(tasks))
+        asyncio.run(burst(tasks))
+    finally:
+        api.terminate()
+        api.wait()
+
+
+if __name__ == "__main__":
+    main()
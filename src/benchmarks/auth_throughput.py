@@ -0,0 +1,63 @@
+"""
+Bearer authentication throughput of SessionAuthBackend for opaque access tokens,
+which are looked up in the token store, and signed access tokens, which are
+verified without it. Runs against both storage backends:
+
+  python -m benchmarks.auth_throughput
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+
+ITERATIONS = 20_000
+
+
+async def run():
+    from starlette.requests import Request
+    from common.backends import SessionAuthBackend
+    from common.config import settings
+    from common.models import OAuth2Client, OAuth2Token, User
+
+    backend = SessionAuthBackend()
+    client, _ = OAuth2Client.create(User.get(1))
+    settings.TOKEN_REUSE_ENABLED = False  # a new token in each format
+    for token_format in ("opaque", "signed"):
+        settings.ACCESS_TOKEN_FORMAT = token_format
+        token = OAuth2Token.create_for_client(client, "client_credentials")
+        request = Request(
+            {
+                "type": "http",
+                "headers": [
+                    (b"authorization", f"Bearer {token.access_token}".encode())
+                ],
+                "session": {},
+            }
+        )
+        assert await backend.authenticate(request) is not None
+        started = time.perf_counter()
+        for _ in range(ITERATIONS):
+            await backend.authenticate(request)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{settings.STORAGE_BACKEND:>8} {token_format:>8}: "
+            f"{ITERATIONS / elapsed:>9.0f} auth/s  {elapsed / ITERATIONS * 1e6:.1f}us"
+        )
+
+
+def main():
+    for backend in ("memory", "sqlite"):
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.auth_throughput", "--run"],
+            env={**os.environ, "STORAGE_BACKEND": backend},
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    if "--run" in sys.argv:
+        asyncio.run(run())
+    else:
+        main()
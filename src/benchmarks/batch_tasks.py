@@ -0,0 +1,65 @@
+"""
+Creating and completing tasks one request at a time versus with the batch
+endpoints. This runs the app in-process, so it measures the work done by the
+middleware stack and handlers per request, not network round trips.
+
+  python -m benchmarks.batch_tasks
+  STORAGE_BACKEND=sqlite python -m benchmarks.batch_tasks
+"""
+import asyncio
+import time
+from api.main import app
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, User
+from .asgi import request
+
+
+TASKS = 500
+
+
+async def one_at_a_time(headers):
+    ids = []
+    for i in range(TASKS):
+        r = await request(
+            app, "POST", "/tasks", headers=headers, json_={"description": f"task {i}"}
+        )
+        assert r.status == 201, r.body
+        ids.append(r.json()["id"])
+    for task_id in ids:
+        r = await request(
+            app,
+            "PUT",
+            f"/tasks/{task_id}",
+            headers=headers,
+            json_={"id": task_id, "description": "done", "done": True},
+        )
+        assert r.status == 200, r.body
+
+
+async def batched(headers):
+    tasks = [{"description": f"task {i}"} for i in range(TASKS)]
+    r = await request(
+        app, "POST", "/tasks/batch", headers=headers, json_={"tasks": tasks}
+    )
+    assert r.status == 201, r.body
+    patches = [{"id": result["id"], "done": True} for result in r.json()["results"]]
+    r = await request(
+        app, "PATCH", "/tasks/batch", headers=headers, json_={"tasks": patches}
+    )
+    assert r.status == 200, r.body
+
+
+async def main():
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    headers = {"Authorization": f"Bearer {token.access_token}"}
+    print(f"backend={settings.STORAGE_BACKEND}, {TASKS} tasks created then completed")
+    for name, func in [("one at a time", one_at_a_time), ("batched", batched)]:
+        started = time.perf_counter()
+        await func(headers)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>14}: {elapsed * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Wall-clock time of tasks.py invocations, from process start to exit: --help, which
+needs no client, and list, which fetches a page of tasks from the api served by
+uvicorn.
+
+  python -m benchmarks.cli_startup
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from .multi_worker import wait_for
+
+
+PORT = 5097
+RUNS = 10
+
+
+def timed_runs(script, args, env):
+    times = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(script)] + args,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main():
+    script = Path(__file__).parents[2] / "tasks.py"
+    from common.models import OAuth2Client, User
+
+    user = User.get(1)
+    client, secret = OAuth2Client.create(user)
+    env = dict(
+        os.environ,
+        API_ROOT=f"http://127.0.0.1:{PORT}",
+        OAUTHLIB_INSECURE_TRANSPORT="1",
+        CLIENT_ID=client.client_id,
+        CLIENT_SECRET=secret,
+    )
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(PORT)]
+        + ["--no-access-log", "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_for(lambda: socket.create_connection(("127.0.0.1", PORT)))
+        subprocess.run(
+            [sys.executable, str(script), "new", "a task"],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )  # gets and saves a token
+        print(f"median of {RUNS} runs")
+        for args in [["--help"], ["list"]]:
+            seconds = timed_runs(script, args, env)
+            print(f"tasks.py {' '.join(args):<8} {seconds * 1000:>6.0f}ms")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+if __name__ == "__main__":
+    main()
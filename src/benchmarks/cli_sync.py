@@ -0,0 +1,67 @@
+"""
+tasks.py commands against a user with many tasks, served by uvicorn with sqlite
+storage. The first list downloads every task into the CLI's cache; after that,
+commands only fetch the tasks that changed since the last sync, and do finds tasks
+by number in the cache.
+
+  python -m benchmarks.cli_sync
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .multi_worker import wait_for
+
+
+PORT = 5096
+TASKS = 5000
+
+
+def run(script, args, env):
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(script)] + args,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def main():
+    script = Path(__file__).parents[2] / "tasks.py"
+    tmp = tempfile.mkdtemp()
+    os.environ.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(tmp, "db"))
+    from common.models import OAuth2Client, Task, User
+
+    user = User.get(1)
+    client, secret = OAuth2Client.create(user)
+    Task.create_many(user, [f"task {i}" for i in range(TASKS)])
+    env = dict(
+        os.environ,
+        API_ROOT=f"http://127.0.0.1:{PORT}",
+        OAUTHLIB_INSECURE_TRANSPORT="1",
+        CLIENT_ID=client.client_id,
+        CLIENT_SECRET=secret,
+    )
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(PORT)]
+        + ["--no-access-log", "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_for(lambda: socket.create_connection(("127.0.0.1", PORT)))
+        print(f"{TASKS} tasks")
+        for args in [["list"], ["list"], ["do", "1"], ["undo", str(TASKS)]]:
+            seconds = run(script, args, env)
+            print(f"tasks.py {' '.join(args):<10} {seconds * 1000:>6.0f}ms")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+GET /tasks latency for a client polling an unchanged list, with and without
+revalidating via If-None-Match. A 304 skips validating and serializing the list.
+
+  python -m benchmarks.conditional_get
+"""
+import asyncio
+from api.main import app
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from .asgi import percentile, request
+
+
+SIZES = [10, 100, 1000]
+POLLS = 200
+
+
+async def poll(headers):
+    latencies = []
+    for _ in range(POLLS):
+        r = await request(app, "GET", "/tasks", headers=headers)
+        assert r.status in (200, 304), r.body
+        latencies.append(r.seconds)
+    return percentile(latencies, 50)
+
+
+async def main():
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    headers = {"Authorization": f"Bearer {token.access_token}"}
+    print(f"backend={settings.STORAGE_BACKEND}")
+    print(f"{'tasks':>6} {'200 p50 (ms)':>13} {'304 p50 (ms)':>13}")
+    created = 0
+    for size in SIZES:
+        Task.create_many(User.get(1), [f"task {i}" for i in range(size - created)])
+        created = size
+        r = await request(app, "GET", "/tasks", headers=headers)
+        etag = r.headers["etag"]
+        full = await poll(headers)
+        revalidated = await poll({**headers, "If-None-Match": etag})
+        print(f"{size:>6} {full * 1000:>13.2f} {revalidated * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
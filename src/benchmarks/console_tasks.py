@@ -0,0 +1,62 @@
+"""
+Time to first task on the console's task page: the page, which comes with the tasks
+rendered when the console shares the api's storage, and the api's GET /tasks that
+the page makes for them once loaded otherwise. Both are requested as the browser
+does, with the session cookie. Over a network, the api request also costs a round
+trip.
+
+The console and the api run in this one process, so they would share even memory
+storage, which they don't when deployed. This needs a shared backend:
+
+  STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/console-benchmark.db python -m benchmarks.console_tasks
+"""
+import asyncio
+import base64
+import json
+import sys
+from itsdangerous import TimestampSigner
+from api.main import app as api_app
+from common.config import settings
+from common.models import Task, User
+from console.main import app as console_app
+from .asgi import percentile, request
+
+
+REQUESTS = 2000
+TASKS = [10, 100]
+
+
+def session_cookie(session):
+    """A session cookie as signed by starlette's SessionMiddleware."""
+    data = base64.b64encode(json.dumps(session).encode())
+    value = TimestampSigner(str(settings.SECRET_KEY)).sign(data).decode()
+    return f"{settings.SESSION_COOKIE}={value}"
+
+
+async def measure(app, path, headers):
+    latencies = []
+    for _ in range(REQUESTS):
+        r = await request(app, "GET", path, headers=headers)
+        assert r.status == 200, r.body
+        latencies.append(r.seconds)
+    return percentile(latencies, 50)
+
+
+async def main():
+    if settings.STORAGE_BACKEND == "memory":
+        sys.exit("The page is only rendered with tasks on a shared storage backend.")
+    user = User.get(1)
+    headers = {"Cookie": session_cookie({"user_id": user.id})}
+    print(f"p50 of {REQUESTS} requests")
+    print(f"{'tasks':>6} {'page (us)':>10} {'api (us)':>9}")
+    created = 0
+    for count in TASKS:
+        Task.create_many(user, [f"task {i}" for i in range(created, count)])
+        created = count
+        page = await measure(console_app, "/tasks", headers)
+        api = await measure(api_app, "/tasks", headers)
+        print(f"{count:>6} {page * 1e6:>10.0f} {api * 1e6:>9.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
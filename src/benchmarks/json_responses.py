@@ -0,0 +1,59 @@
+"""
+Token-authenticated GET /tasks as the list grows, with FastAPI validating and
+encoding the response, and with FAST_JSON_ENABLED, encoding with orjson and, as
+when it is not installed, with json.
+
+  python -m benchmarks.json_responses
+"""
+import asyncio
+import time
+from api import serialization
+from api.main import app
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from .asgi import percentile, request
+
+
+SIZES = [10, 100, 1000]
+TASKS_PER_SIZE = 200_000  # tasks serialized per measurement
+
+
+async def measure(stack, headers, size):
+    requests = max(TASKS_PER_SIZE // size, 50)
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        r = await request(stack, "GET", f"/tasks?limit={size}", headers=headers)
+        assert r.status == 200, r.body
+        latencies.append(r.seconds)
+    elapsed = time.perf_counter() - started
+    return requests * size / elapsed, percentile(latencies, 50)
+
+
+async def main():
+    user = User.get(1)
+    client, _ = OAuth2Client.create(user)
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    Task.create_many(user, [f"task number {i}" for i in range(max(SIZES))])
+    headers = {"Authorization": f"Bearer {token.access_token}"}
+    stack = app.build_middleware_stack()
+    orjson = serialization.orjson
+    modes = [
+        ("validated", False, orjson),
+        ("fast, orjson", True, orjson),
+        ("fast, json", True, None),
+    ]
+    if orjson is None:
+        print("orjson is not installed, skipping it")
+        del modes[1]
+    print(f"{'tasks':>6} {'':>13} {'tasks/s':>9} {'p50 (us)':>9}")
+    for size in SIZES:
+        for name, fast, encoder in modes:
+            settings.FAST_JSON_ENABLED = fast
+            serialization.orjson = encoder
+            rate, p50 = await measure(stack, headers, size)
+            print(f"{size:>6} {name:>13} {rate:>9.0f} {p50 * 1e6:>9.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
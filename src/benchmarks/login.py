@@ -0,0 +1,55 @@
+"""
+The console login lookup, User.get_by_username, as the user directory grows, with
+the full scan it used to do timed alongside for comparison. Users are bulk loaded
+from a JSON Lines file, as with the USERS_FILE setting, and the load time is shown.
+
+  python -m benchmarks.login
+  STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/login-benchmark.db python -m benchmarks.login
+"""
+import json
+import os
+import tempfile
+import time
+import timeit
+from common.config import settings
+from common.models import User
+
+
+SIZES = [1_000, 100_000, 500_000]
+
+
+def scan(username):
+    for user in User.repository.all():
+        if user.username == username:
+            return user
+
+
+def main():
+    print(f"backend={settings.STORAGE_BACKEND}")
+    print(f"{'users':>8} {'load (s)':>9} {'lookup (us)':>12} {'scan (us)':>12}")
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    for size in SIZES:
+        with os.fdopen(os.dup(fd), "w") as f:
+            f.seek(0)
+            for i in range(size):
+                user = {"id": 1000 + i, "username": f"user{i}", "password": "x"}
+                f.write(json.dumps(user) + "\n")
+        started = time.perf_counter()
+        User.load_file(path)
+        loaded = time.perf_counter() - started
+        username = f"user{size - 1}"  # the last user, the worst case for a scan
+        assert User.get_by_username(username).id == 1000 + size - 1
+        lookup = min(
+            timeit.repeat(lambda: User.get_by_username(username), number=1000, repeat=5)
+        )
+        scanned = min(timeit.repeat(lambda: scan(username), number=1, repeat=3))
+        print(
+            f"{size:>8} {loaded:>9.2f} {lookup / 1000 * 1e6:>12.1f} "
+            f"{scanned * 1e6:>12.1f}"
+        )
+    os.close(fd)
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+The cost of recording metrics: token-authenticated GET /tasks through the api with
+and without the metrics middleware, and Task.for_user with and without its timing
+wrapper.
+
+  python -m benchmarks.metrics_overhead
+"""
+import asyncio
+import time
+from api.main import app
+from common.metrics import MetricsMiddleware
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from .asgi import percentile, request
+
+
+REQUESTS = 5000
+CALLS = 100000
+TASKS = 10
+
+
+async def measure(stack, headers):
+    latencies = []
+    for _ in range(REQUESTS):
+        r = await request(stack, "GET", "/tasks", headers=headers)
+        assert r.status == 200, r.body
+        latencies.append(r.seconds)
+    return percentile(latencies, 50)
+
+
+def per_call(func, user):
+    started = time.perf_counter()
+    for _ in range(CALLS):
+        func(user, limit=TASKS)
+    return (time.perf_counter() - started) / CALLS
+
+
+async def main():
+    user = User.get(1)
+    client, _ = OAuth2Client.create(user)
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    Task.create_many(user, [f"task {i}" for i in range(TASKS)])
+    headers = {"Authorization": f"Bearer {token.access_token}"}
+    stack = app.build_middleware_stack().app
+    assert isinstance(stack, MetricsMiddleware)
+    print(f"GET /tasks with {TASKS} tasks, p50 of {REQUESTS} requests")
+    for name, app_ in [("without metrics", stack.app), ("with metrics", stack)]:
+        await measure(app_, headers)  # warm up
+        p50 = await measure(app_, headers)
+        print(f"{name:>16}: {p50 * 1e6:>6.0f}us")
+    print(f"Task.for_user, {CALLS} calls")
+    for name, func in [
+        ("without metrics", Task.for_user.__wrapped__.__get__(Task)),
+        ("with metrics", Task.for_user),
+    ]:
+        print(f"{name:>16}: {per_call(func, user) * 1e6:>6.2f}us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""
+Latency of /token and GET /tasks requests issued concurrently against the api in
+one event loop. Storage calls either run on the storage thread pool or, with
+STORAGE_THREADS=0, inline on the event loop as they used to. The difference shows
+up with a storage backend that does I/O, e.g.:
+
+  STORAGE_BACKEND=sqlite STORAGE_THREADS=0 python -m benchmarks.mixed_load
+  STORAGE_BACKEND=sqlite STORAGE_THREADS=8 python -m benchmarks.mixed_load
+"""
+import asyncio
+import time
+from api.main import app
+from common.config import settings
+from common.models import OAuth2Client, User
+from .asgi import percentile, request
+
+
+CLIENTS = 50
+ROUNDS = 20
+TASKS_PER_TOKEN = 4
+
+
+async def client_session(client, secret, latencies):
+    for _ in range(ROUNDS):
+        r = await request(
+            app,
+            "POST",
+            "/token",
+            form={
+                "grant_type": "client_credentials",
+                "client_id": client.client_id,
+                "client_secret": secret,
+            },
+        )
+        assert r.status == 200, r.body
+        latencies["/token"].append(r.seconds)
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        for _ in range(TASKS_PER_TOKEN):
+            r = await request(app, "GET", "/tasks", headers=headers)
+            assert r.status == 200, r.body
+            latencies["/tasks"].append(r.seconds)
+
+
+async def main():
+    user = User.get(1)
+    client, secret = OAuth2Client.create(user)
+    latencies = {"/token": [], "/tasks": []}
+    started = time.perf_counter()
+    await asyncio.gather(
+        *[client_session(client, secret, latencies) for _ in range(CLIENTS)]
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(len(values) for values in latencies.values())
+    print(
+        f"backend={settings.STORAGE_BACKEND} threads={settings.STORAGE_THREADS} "
+        f"concurrency={CLIENTS}: {total / elapsed:.0f} req/s"
+    )
+    for path, values in latencies.items():
+        print(
+            f"{path:>8}: p50 {percentile(values, 50) * 1000:.2f}ms "
+            f"p99 {percentile(values, 99) * 1000:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+GET /tasks throughput of the api served by 1, 2 and 4 uvicorn worker processes
+sharing state through the broker (STORAGE_BACKEND=broker). One access token, issued
+by whichever worker answers /token, is used for every request, so each worker
+validates tokens that another worker issued.
+
+Load is generated by a process per worker, each with several keep-alive
+connections. Throughput should scale with the number of workers up to the number
+of cpus, less the share of cpu taken by the load generators and the broker.
+
+  python -m benchmarks.multi_worker
+"""
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+WORKERS = [1, 2, 4]
+PORT = 5099
+TASKS = 50
+CONNECTIONS = 8  # per load generating process
+SECONDS = 5
+
+
+def wait_for(check, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError
+
+
+def load(token, counts):
+    """Runs in a load generating process."""
+    total = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + SECONDS
+
+    def connection():
+        conn = http.client.HTTPConnection("127.0.0.1", PORT)
+        done = 0
+        while time.monotonic() < deadline:
+            conn.request("GET", "/tasks", headers={"Authorization": f"Bearer {token}"})
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+            done += 1
+        with lock:
+            total[0] += done
+
+    threads = [threading.Thread(target=connection) for _ in range(CONNECTIONS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts.put(total[0])
+
+
+def run(workers, env, client_id, secret):
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(PORT)]
+        + ["--workers", str(workers), "--no-access-log", "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_for(lambda: http.client.HTTPConnection("127.0.0.1", PORT).connect() or 1)
+        conn = http.client.HTTPConnection("127.0.0.1", PORT)
+        form = {
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "client_secret": secret,
+        }
+        conn.request(
+            "POST",
+            "/token",
+            urllib.parse.urlencode(form),
+            {"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        token = json.loads(conn.getresponse().read())["access_token"]
+        counts = multiprocessing.Queue()
+        generators = [
+            multiprocessing.Process(target=load, args=(token, counts))
+            for _ in range(workers)
+        ]
+        for generator in generators:
+            generator.start()
+        total = sum(counts.get() for _ in generators)
+        for generator in generators:
+            generator.join()
+        print(f"{workers:>8} {total / SECONDS:>10.0f}")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND="broker",
+        BROKER_SOCKET=os.path.join(tmp, "broker.sock"),
+    )
+    os.environ.update(env)
+    broker = subprocess.Popen([sys.executable, "-m", "common.broker"], env=env)
+    try:
+        wait_for(lambda: os.path.exists(env["BROKER_SOCKET"]))
+        from common.models import OAuth2Client, Task, User
+
+        user = User.get(1)
+        client, secret = OAuth2Client.create(user)
+        Task.create_many(user, [f"task {i}" for i in range(TASKS)])
+        print(f"{os.cpu_count()} cpus, {TASKS} tasks per GET /tasks")
+        print(f"{'workers':>8} {'req/s':>10}")
+        for workers in WORKERS:
+            run(workers, env, client.client_id, secret)
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+if __name__ == "__main__":
+    main()
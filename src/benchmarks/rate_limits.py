@@ -0,0 +1,50 @@
+"""
+The cost of the rate limiter: time to take a token with few and with many active
+clients, memory per active client, and how eviction bounds that memory once clients
+go idle.
+
+  python -m benchmarks.rate_limits
+"""
+import time
+import tracemalloc
+from common.ratelimit import TokenBuckets
+
+
+TAKES = 200_000
+CLIENTS = [1, 1000, 100_000]
+
+
+class Clock:
+    """A timer that can be moved forward, to make clients idle without waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def main():
+    print(f"{'clients':>8} {'ns/take':>8} {'bytes/client':>13}")
+    for count in CLIENTS:
+        clock = Clock()
+        keys = [f"client-{i}" for i in range(count)]
+        tracemalloc.start()
+        buckets = TokenBuckets(rate=50, burst=100, maxsize=1_000_000, timer=clock)
+        for key in keys:
+            buckets.take(key)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        started = time.perf_counter()
+        for i in range(TAKES):
+            clock.now += 1e-5
+            buckets.take(keys[i % count])
+        elapsed = time.perf_counter() - started
+        print(f"{count:>8} {elapsed / TAKES * 1e9:>8.0f} {size / count:>13.0f}")
+        clock.now += buckets.idle + 1
+        buckets.take("another client")
+        print(f"{'':>8} {len(buckets)} left after {buckets.idle + 1:.0f}s idle")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Memory per task and per token held by the in-memory repositories, at a million of
+each: the record objects alone, and everything the repository holds for them,
+including ids, descriptions and indexes. Measured with tracemalloc.
+
+  python -m benchmarks.record_memory
+"""
+
+import datetime
+import gc
+import secrets
+import sys
+import tracemalloc
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from common.repositories import MemoryTaskRepository, MemoryTokenRepository
+
+RECORDS = 1_000_000
+USERS = 1000
+BATCH = 10_000
+
+
+def traced(build):
+    """The memory allocated by build() and still held, and its result."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held, result
+
+
+def tasks():
+    """Added to the repository directly, as creating them publishes events, which
+    the event hub would hold on to.
+    """
+    Task.repository = MemoryTaskRepository()
+    for i in range(0, RECORDS, BATCH):
+        Task.repository.add_many(
+            [
+                Task(id=_id, user_id=n % USERS, description=f"task number {n}")
+                for n, _id in enumerate(Task.new_ids(BATCH), i)
+            ]
+        )
+    return Task.repository
+
+
+def tokens():
+    OAuth2Token.repository = MemoryTokenRepository()
+    clients = [
+        OAuth2Client(
+            user=User(id=i, username="", password=""),
+            client_id=f"client{i}",
+            client_secret_hash="",
+        )
+        for i in range(USERS)
+    ]
+    expires = datetime.datetime.utcnow()
+    for i in range(RECORDS):
+        OAuth2Token.repository.add(
+            OAuth2Token(
+                client_id=sys.intern(clients[i % USERS].client_id),
+                access_token=secrets.token_urlsafe(32),
+                refresh_token=secrets.token_urlsafe(32),
+                access_token_expires_at=expires,
+            )
+        )
+    return OAuth2Token.repository
+
+
+def size(record):
+    if hasattr(record, "__dict__"):
+        return sys.getsizeof(record) + sys.getsizeof(record.__dict__)
+    return sys.getsizeof(record)
+
+
+def main():
+    print(f"{RECORDS} records, bytes per record")
+    print(f"{'':>6} {'record':>7} {'repository':>11}")
+    held, repository = traced(tasks)
+    record = size(next(iter(repository.table.values())))
+    print(f"{'task':>6} {record:>7} {held / RECORDS:>11.0f}")
+    del repository
+    Task.repository = None
+    held, repository = traced(tokens)
+    record = size(next(iter(repository.access_tokens.values())))
+    print(f"{'token':>6} {record:>7} {held / RECORDS:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+A browser request through the session middleware, with cookie sessions and with
+server-side sessions, as the session holds more queued console messages. Shows the
+size of the cookie sent with every request, and the time taken by the middleware
+for a request that only reads the session, as the api's do. Cookie sessions are
+decoded, then signed and set again in every response.
+
+Server-side sessions are kept in the configured store with SESSION_BACKEND=server,
+otherwise in memory, as in the broker:
+
+  python -m benchmarks.sessions
+  SESSION_BACKEND=server STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/sessions.db \
+    python -m benchmarks.sessions
+"""
+import asyncio
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from common.config import settings
+from common.models import Session
+from common.repositories import MemorySessionRepository
+from common.sessions import ServerSessionMiddleware
+from .asgi import percentile, request
+
+
+REQUESTS = 5000
+MESSAGES = [0, 5, 50]
+
+
+async def endpoint(scope, receive, send):
+    scope["session"].get("user_id")
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def session_data(messages):
+    return {
+        "user_id": 1,
+        "username": "ronnie",
+        "messages": [
+            {"text": f"Message number {i}", "class": "info"} for i in range(messages)
+        ],
+    }
+
+
+async def cookie_for(middleware, session):
+    """The cookie set by the middleware for a response after writing session."""
+
+    async def write(scope, receive, send):
+        scope["session"].update(session)
+        await endpoint(scope, receive, send)
+
+    r = await request(middleware.cls(write, **middleware.options), "GET", "/")
+    return r.headers["set-cookie"].split(";")[0]
+
+
+async def measure(app, cookie):
+    latencies = []
+    for _ in range(REQUESTS):
+        r = await request(app, "GET", "/", headers={"Cookie": cookie})
+        assert r.status == 200
+        latencies.append(r.seconds)
+    return percentile(latencies, 50)
+
+
+async def main():
+    if settings.SESSION_BACKEND != "server":
+        Session.repository = MemorySessionRepository(settings.SESSION_STORE_SIZE)
+    max_age = settings.SESSION_EXPIRE_SECONDS
+    backends = {
+        "cookie": Middleware(
+            SessionMiddleware, secret_key=settings.SECRET_KEY, max_age=max_age
+        ),
+        "server": Middleware(ServerSessionMiddleware, max_age=max_age),
+    }
+    print(f"store={type(Session.repository).__name__}, p50 of {REQUESTS} requests")
+    print(f"{'messages':>8} {'backend':>8} {'cookie (B)':>11} {'p50 (us)':>9}")
+    for messages in MESSAGES:
+        session = session_data(messages)
+        for name, middleware in backends.items():
+            cookie = await cookie_for(middleware, session)
+            app = middleware.cls(endpoint, **middleware.options)
+            p50 = await measure(app, cookie)
+            print(f"{messages:>8} {name:>8} {len(cookie):>11} {p50 * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
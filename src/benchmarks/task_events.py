@@ -0,0 +1,78 @@
+"""
+Fan-out of task events to many idle subscribers of one user in one event loop:
+memory per subscriber, and the time from publishing an event until every
+subscriber has received it. A subscriber that stops reading is dropped once its
+queue fills instead of buffering without bound.
+
+  python -m benchmarks.task_events
+"""
+import asyncio
+import time
+import tracemalloc
+from common.config import settings
+from common.events import TaskEventHub
+
+
+SUBSCRIBERS = [1_000, 10_000]
+EVENTS = 20
+
+
+async def consume(subscription, received, done):
+    while True:
+        event = await subscription.get(settings.EVENT_KEEPALIVE_SECONDS)
+        received[0] += 1
+        if received[0] == len(done.subscribers) * EVENTS:
+            done.set()
+        if event.seq == EVENTS:
+            return
+
+
+async def run(count):
+    hub = TaskEventHub(settings.EVENT_HISTORY_SIZE, settings.EVENT_QUEUE_SIZE)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subscriptions = [hub.subscribe(1)[0] for _ in range(count)]
+    received = [0]
+    done = asyncio.Event()
+    done.subscribers = subscriptions
+    consumers = [
+        asyncio.create_task(consume(subscription, received, done))
+        for subscription in subscriptions
+    ]
+    await asyncio.sleep(0.1)  # let every consumer start waiting
+    per_subscriber = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for i in range(EVENTS):
+        hub.publish(1, "updated", {"id": "bench", "description": "", "done": i % 2})
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*consumers)
+    print(
+        f"{count:>8} {per_subscriber / 1024:>12.1f} "
+        f"{elapsed / EVENTS * 1000:>14.2f} {count * EVENTS / elapsed:>14.0f}"
+    )
+
+
+async def slow_consumer():
+    hub = TaskEventHub(settings.EVENT_HISTORY_SIZE, settings.EVENT_QUEUE_SIZE)
+    subscription, _ = hub.subscribe(1)
+    for i in range(settings.EVENT_QUEUE_SIZE + 1):
+        hub.publish(1, "updated", {"id": "bench", "description": "", "done": False})
+    await asyncio.sleep(0)
+    assert await subscription.get() is None
+    print(f"slow consumer dropped after {settings.EVENT_QUEUE_SIZE} queued events")
+
+
+async def main():
+    print(
+        f"{'subscribers':>8} {'KiB/subscriber':>12} {'ms per event':>14} "
+        f"{'deliveries/s':>14}"
+    )
+    for count in SUBSCRIBERS:
+        await run(count)
+    await slow_consumer()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+"""
+Task.for_user latency as the total number of tasks in the system grows. The
+listing user always owns the same number of tasks, so latency should stay flat.
+The full scan that Task.for_user used to do is timed alongside for comparison.
+"""
+import timeit
+from common.models import Task, User
+from common.repositories import MemoryTaskRepository
+
+
+OWN_TASKS = 50
+TOTALS = [1_000, 10_000, 100_000, 500_000]
+
+
+def scan(user):
+    return [task for task in Task.repository.table.values() if task.user_id == user.id]
+
+
+def main():
+    user = User(id=0, username="benchmark", password="benchmark")
+    others = [User(id=i, username=f"user{i}", password="") for i in range(1, 1001)]
+    print(f"{'total tasks':>12} {'for_user (us)':>14} {'scan (us)':>12}")
+    for total in TOTALS:
+        Task.repository = MemoryTaskRepository()
+        for i in range(OWN_TASKS):
+            Task.create(user, f"task {i}")
+        for i in range(total - OWN_TASKS):
+            Task.create(others[i % len(others)], f"task {i}")
+        assert len(Task.for_user(user)) == OWN_TASKS
+        indexed = min(timeit.repeat(lambda: Task.for_user(user), number=100, repeat=5))
+        scanned = min(timeit.repeat(lambda: scan(user), number=1, repeat=3))
+        print(f"{total:>12} {indexed / 100 * 1e6:>14.1f} {scanned * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Rendering the console's pages, outside of the middleware, and loading all of the
+templates on startup, both from source and from the bytecode cache.
+
+  python -m benchmarks.templates
+"""
+import tempfile
+import timeit
+import jinja2
+from starlette.requests import Request
+from common.models import OAuth2Client, Task, User
+from console.main import app
+from console.templating import Templates, render
+
+
+RENDERS = 2000
+TASKS = 10
+
+
+def make_request(user):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [],
+        "query_string": b"",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "root_path": "",
+        "router": app.router,
+        "app": app,
+        "session": {"user_id": user.id},
+        "user": user,
+        "csrftoken": lambda: "token",
+    }
+    return Request(scope)
+
+
+def main():
+    user = User.get(1)
+    clients = [OAuth2Client.create(user)[0] for _ in range(3)]
+    tasks = Task.create_many(user, [f"task {i}" for i in range(TASKS)])
+    request = make_request(user)
+    pages = {
+        "home.html": {},
+        "apps.html": {"clients": clients, "new_client": None},
+        "tasks.html": {
+            "tasks": tasks,
+            "bootstrap": {"tasks": [], "revision": "0:0"},
+        },
+    }
+    print(f"render, best of 5 x {RENDERS}")
+    for name, context in pages.items():
+        seconds = min(
+            timeit.repeat(
+                lambda: render(request, name, context), number=RENDERS, repeat=5
+            )
+        )
+        print(f"{name:>12}: {seconds / RENDERS * 1e6:>6.1f}us")
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        def precompile(bytecode_cache=True):
+            cache = (
+                jinja2.FileSystemBytecodeCache(directory) if bytecode_cache else None
+            )
+            Templates(directory="templates", bytecode_cache=cache).precompile()
+
+        precompile()  # fill the cache
+        print("precompile, best of 5")
+        for name, bytecode_cache in [("from source", False), ("from cache", True)]:
+            seconds = min(
+                timeit.repeat(lambda: precompile(bytecode_cache), number=1, repeat=5)
+            )
+            print(f"{name:>12}: {seconds * 1e3:>6.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
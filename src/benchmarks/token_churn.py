@@ -0,0 +1,60 @@
+"""
+Churn a million tokens through the token store on a simulated clock, reaping as
+the API's background reaper would, and check that the store stays flat in size
+instead of growing with the number of tokens ever issued.
+"""
+import datetime
+import secrets
+import time
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, User
+from common.repositories import MemoryTokenRepository
+
+
+TOKENS = 1_000_000
+TOKENS_PER_SECOND = 1000  # simulated issue rate
+TIMEOUT_SECONDS = 60
+GRACE_SECONDS = 60
+REAP_INTERVAL_SECONDS = 5
+
+
+def main():
+    store = MemoryTokenRepository(grace_seconds=GRACE_SECONDS)
+    user = User(id=0, username="benchmark", password="benchmark")
+    client = OAuth2Client(user=user, client_id="benchmark", client_secret_hash="")
+    start = datetime.datetime.utcnow()
+    reap_every = TOKENS_PER_SECOND * REAP_INTERVAL_SECONDS
+    batch = settings.TOKEN_REAP_BATCH_SIZE
+    samples = []
+    started = time.perf_counter()
+    for i in range(1, TOKENS + 1):
+        now = start + datetime.timedelta(seconds=i / TOKENS_PER_SECOND)
+        store.add(
+            OAuth2Token(
+                client_id=client.client_id,
+                access_token=secrets.token_urlsafe(32),
+                refresh_token=secrets.token_urlsafe(32),
+                access_token_expires_at=now
+                + datetime.timedelta(seconds=TIMEOUT_SECONDS),
+            )
+        )
+        if i % reap_every == 0:
+            while store.reap(batch, now=now) == batch:
+                pass
+            samples.append(store.stats)
+    elapsed = time.perf_counter() - started
+
+    steady = samples[len(samples) // 10 :]
+    print(f"churned {TOKENS} tokens in {elapsed:.1f}s")
+    for key in ("access_tokens", "expiry_heap", "container_bytes"):
+        values = [sample[key] for sample in steady]
+        print(f"{key:>16}: min {min(values)} max {max(values)}")
+    print(f"{'evicted':>16}: {store.evicted}")
+    print(f"{'max reap batch':>16}: {store.max_reap_seconds * 1000:.2f}ms")
+    live = (TIMEOUT_SECONDS + GRACE_SECONDS + REAP_INTERVAL_SECONDS) * TOKENS_PER_SECOND
+    assert max(sample["access_tokens"] for sample in steady) <= live
+    assert steady[-1]["container_bytes"] <= steady[0]["container_bytes"] * 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+/token requests per second with hashed client secrets, under a few configurations.
+Each configuration runs in a subprocess since the settings are read at import:
+
+ * inline, uncached: every request hashes on the event loop
+ * pooled, uncached: hashing runs on SECRET_HASH_THREADS threads
+ * pooled, cached: repeat verifications within the cache TTL skip hashing
+
+  python -m benchmarks.token_issuance
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from .asgi import percentile, request
+
+
+CONCURRENCY = 16
+REQUESTS = 400
+CONFIGURATIONS = [
+    (
+        "inline, uncached",
+        {"SECRET_HASH_THREADS": "0", "CLIENT_SECRET_CACHE_TTL_SECONDS": "0"},
+    ),
+    ("pooled, uncached", {"CLIENT_SECRET_CACHE_TTL_SECONDS": "0"}),
+    ("pooled, cached", {}),
+]
+
+
+async def run():
+    from api.main import app
+    from common.models import OAuth2Client, User
+
+    client, secret = OAuth2Client.create(User.get(1))
+    form = {
+        "grant_type": "client_credentials",
+        "client_id": client.client_id,
+        "client_secret": secret,
+    }
+    latencies = []
+
+    async def worker():
+        for _ in range(REQUESTS // CONCURRENCY):
+            r = await request(app, "POST", "/token", form=form)
+            assert r.status == 200, r.body
+            latencies.append(r.seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(latencies) / elapsed:>8.0f} req/s  "
+        f"p50 {percentile(latencies, 50) * 1000:>7.1f}ms  "
+        f"p99 {percentile(latencies, 99) * 1000:>7.1f}ms"
+    )
+
+
+def main():
+    print(f"{os.cpu_count()} cpus, concurrency {CONCURRENCY}")
+    for name, env in CONFIGURATIONS:
+        print(f"{name:>18}: ", end="", flush=True)
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.token_issuance", "--run"],
+            env={**os.environ, **env},
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    if "--run" in sys.argv:
+        asyncio.run(run())
+    else:
+        main()
@@ -0,0 +1,34 @@
+"""
+A client that asks /token for a token per job, e.g. a cron job or the CLI after
+its .key file is deleted. With reuse, each request after the first gets the same
+token back. Without it, each request mints another, and only MAX_TOKENS_PER_CLIENT
+keeps them from piling up in the token store until they are reaped.
+
+  python -m benchmarks.token_reuse
+"""
+import time
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, User
+
+
+REQUESTS = 100_000
+
+
+def main():
+    print(f"{REQUESTS} token requests from one client")
+    print(f"{'':>9} {'us/request':>11} {'tokens stored':>14}")
+    for reuse in [False, True]:
+        settings.TOKEN_REUSE_ENABLED = reuse
+        client, _ = OAuth2Client.create(User.get(1))
+        before = OAuth2Token.repository.stats["access_tokens"]
+        started = time.perf_counter()
+        for _ in range(REQUESTS):
+            OAuth2Token.create_for_client(client, "client_credentials")
+        elapsed = time.perf_counter() - started
+        stored = OAuth2Token.repository.stats["access_tokens"] - before
+        name = "reuse" if reuse else "no reuse"
+        print(f"{name:>9} {elapsed / REQUESTS * 1e6:>11.2f} {stored:>14}")
+
+
+if __name__ == "__main__":
+    main()
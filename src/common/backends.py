@@ -1,13 +1,15 @@
 import datetime
 from starlette.authentication import AuthenticationBackend, AuthCredentials
-from .models import User, OAuth2Token
+from .config import settings
+from .models import OAuth2Client, OAuth2Token, User
+from .tokens import verify_access_token
 
 
 class SessionAuthBackend(AuthenticationBackend):
     async def authenticate(self, request):
-        if "user_id" in request.session:
+        if "session" in request.scope and "user_id" in request.session:
             user_id = request.session["user_id"]
-            user = User.table[user_id]
+            user = await User.aget(user_id)
             if user is None:  # something is wrong with the session data
                 del request.session["user_id"]
                 if "username" in request.session:
@@ -22,10 +24,15 @@ class SessionAuthBackend(AuthenticationBackend):
             if bearer[0] != "Bearer":
                 return
             bearer = bearer[1]
-            token = OAuth2Token.access_tokens.get(bearer)
+            if settings.ACCESS_TOKEN_FORMAT == "signed":
+                return await self.authenticate_signed(request, bearer)
+            token = await OAuth2Token.aget(bearer)
             if token is None:
                 return
-            user = token.client.user
+            client = await OAuth2Client.aget(token.client_id)  # normally a cache hit
+            if client is None:
+                return
+            user = client.user
             if not user.active:
                 return
             if token.access_token_expires_at < datetime.datetime.utcnow():
@@ -34,3 +41,13 @@ class SessionAuthBackend(AuthenticationBackend):
                 return
             request.scope["token"] = token
             return AuthCredentials(["api_auth"]), user
+
+    async def authenticate_signed(self, request, bearer):
+        claims = verify_access_token(bearer)
+        if claims is None:
+            return
+        client = await OAuth2Client.aget(claims["cid"])  # normally a cache hit
+        if client is None or not client.user.active:
+            return
+        request.scope["token"] = claims
+        return AuthCredentials(["api_auth"]), client.user
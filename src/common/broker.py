@@ -0,0 +1,267 @@
+"""
+A local broker for running the api as several worker processes, e.g.
+`uvicorn api.main:app --workers 4`, without a database. Enabled by setting
+STORAGE_BACKEND=broker and starting the broker before the api and console:
+
+  python -m common.broker
+
+The broker process holds the in-memory repositories, and the models in each worker
+call them over a Unix socket (BROKER_SOCKET), so tokens issued by one worker are
+valid on every other and task writes are seen by all of them. The broker also
+relays messages to every worker: task events for the /tasks/events streams, and
+revoked signed tokens for the deny-lists. It keeps the deny-list too, for workers
+that start later.
+
+Messages are length-prefixed pickles, so the socket must only be reachable by the
+user running the api. It is created with permissions 0600.
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import os
+import pickle
+import secrets
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+from common.config import settings
+from common.tokens import DenyList
+
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+
+
+def frame(message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(data)) + data
+
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+        return pickle.loads(await reader.readexactly(HEADER.unpack(header)[0]))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def recv_exactly(conn, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The broker closed the connection")
+        data += chunk
+    return data
+
+
+def recv_frame(conn):
+    (size,) = HEADER.unpack(recv_exactly(conn, HEADER.size))
+    return pickle.loads(recv_exactly(conn, size))
+
+
+class Broker:
+    """The broker side. Serves calls to the named objects, and relays published
+    messages to every subscribed connection.
+
+    Calls are handled one at a time on the event loop, so each call to a repository
+    is atomic with respect to calls from other workers.
+    """
+
+    def __init__(self, objects):
+        self.objects = dict(objects, broker=self)
+        self.subscribers = set()
+        self.epoch = secrets.token_hex(4)
+        self.sequences = defaultdict(lambda: itertools.count(1))  # user id -> seqs
+        self.denied = DenyList()
+
+    async def handle(self, reader, writer):
+        try:
+            while (message := await read_frame(reader)) is not None:
+                if message == ("subscribe",):
+                    self.subscribers.add(writer)
+                    continue
+                name, method, args, kwargs = message
+                try:
+                    attr = getattr(self.objects[name], method)
+                    result = ("ok", attr(*args, **kwargs) if callable(attr) else attr)
+                except Exception as e:
+                    result = ("error", e)
+                writer.write(frame(result))
+                await writer.drain()
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    def publish(self, channel, message):
+        data = frame(("message", channel, message))
+        for writer in self.subscribers:
+            writer.write(data)
+
+    def publish_task_event(self, user_id, kind, task):
+        """Task events are numbered here so that every worker's hub gives the same
+        event the same id.
+        """
+        seq = next(self.sequences[user_id])
+        self.publish("task_events", (self.epoch, user_id, seq, kind, task))
+
+    def deny(self, jti, exp):
+        self.denied.add(jti, exp)
+        self.publish("denied", (jti, exp))
+
+    def denied_tokens(self):
+        return list(self.denied.entries.items())
+
+    async def purge_denied(self):
+        while True:
+            await asyncio.sleep(settings.TOKEN_REAP_INTERVAL_SECONDS)
+            self.denied.purge()
+
+
+async def serve(path, objects):
+    if os.path.exists(path):
+        os.remove(path)
+    broker = Broker(objects)
+    server = await asyncio.start_unix_server(broker.handle, path)
+    os.chmod(path, 0o600)
+    logger.info("Broker listening on %s", path)
+    purger = asyncio.create_task(broker.purge_denied())
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            purger.cancel()
+
+
+class BrokerClient:
+    """The worker side. Each thread gets its own connection for calls, since they
+    are synchronous. Published messages arrive on a separate connection read by a
+    background thread, which passes them to the handler for their channel.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.handlers = {}
+        self.listener = None
+
+    def connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.path)
+        return conn
+
+    def call(self, name, method, *args, **kwargs):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        try:
+            conn.sendall(frame((name, method, args, kwargs)))
+            status, result = recv_frame(conn)
+        except OSError:
+            self.local.conn = None  # reconnect on the next call
+            conn.close()
+            raise
+        if status == "error":
+            raise result
+        return result
+
+    def subscribe(self, channel, handler):
+        self.handlers[channel] = handler
+        if self.listener is None:
+            self.listener = threading.Thread(
+                target=self.listen, name="broker-listener", daemon=True
+            )
+            self.listener.start()
+
+    def listen(self):
+        """Reconnects if the broker goes away. Messages published in the meantime are
+        lost, and task event streams will reset as the broker's epoch changes.
+        """
+        while True:
+            try:
+                conn = self.connect()
+                conn.sendall(frame(("subscribe",)))
+                while True:
+                    _, channel, message = recv_frame(conn)
+                    try:
+                        self.handlers[channel](message)
+                    except Exception:
+                        logger.exception("Error handling a %s message", channel)
+            except OSError:
+                logger.warning("Lost the broker connection, reconnecting")
+                time.sleep(1)
+
+
+class BrokerRepository:
+    """A repository held by the broker. Method calls, and the stats property, are
+    forwarded to it.
+    """
+
+    blocking = True
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return functools.partial(self.client.call, self.name, method)
+
+    @property
+    def stats(self):
+        return self.client.call(self.name, "stats")
+
+
+class BrokerTaskRepository(BrokerRepository):
+
+    chunk_size = 500
+
+    def iter_for_user(self, user_id, after=0, limit=None):
+        """Generators can't be sent over the socket, so this fetches in chunks."""
+        while limit is None or limit > 0:
+            size = self.chunk_size if limit is None else min(limit, self.chunk_size)
+            tasks, after = self.page_for_user(user_id, after, size)
+            yield from tasks
+            if after is None:
+                return
+            if limit is not None:
+                limit -= size
+
+
+def relay(client, hub, denied):
+    """Route task events and token denials through the broker, so that every worker
+    sees them, instead of only the worker where they happened. The deny-list starts
+    out with the broker's.
+    """
+    hub.epoch = client.call("broker", "epoch")
+    hub.relay = functools.partial(client.call, "broker", "publish_task_event")
+    client.subscribe("task_events", lambda message: hub.dispatch(*message))
+    denied.relay = functools.partial(client.call, "broker", "deny")
+    client.subscribe("denied", lambda message: denied.add(*message))
+    for jti, exp in client.call("broker", "denied_tokens"):
+        denied.add(jti, exp)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    settings.STORAGE_BACKEND = "memory"  # the broker holds the in-memory storage
+    from common.models import OAuth2Client, OAuth2Token, Task, User
+    from common.repositories import MemorySessionRepository
+
+    objects = {
+        "users": User.repository,
+        "tasks": Task.repository,
+        "clients": OAuth2Client.repository,
+        "tokens": OAuth2Token.repository,
+        "sessions": MemorySessionRepository(settings.SESSION_STORE_SIZE),
+    }
+    asyncio.run(serve(settings.BROKER_SOCKET, objects))
+
+
+if __name__ == "__main__":
+    main()
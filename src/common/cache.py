@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A bounded, least-recently-used cache whose entries expire after ttl seconds.
+
+    Hits and misses are counted for reporting via the stats property.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value, expires = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires <= self.timer():
+            del self.data[key]
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.data[key] = (value, self.timer() + self.ttl)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.data)}
@@ -0,0 +1,34 @@
+"""
+Running blocking storage calls from async code. Storage backends that do I/O (the
+dbm client store, SQLite) are called on a bounded thread pool so that a slow read
+does not stall every other request on the event loop. In-memory repositories are
+called directly since there is nothing to wait on.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from common.config import settings
+
+
+executor = None
+if settings.STORAGE_THREADS > 0:
+    executor = ThreadPoolExecutor(
+        max_workers=settings.STORAGE_THREADS, thread_name_prefix="storage"
+    )
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run func on the storage thread pool, or inline if STORAGE_THREADS is 0."""
+    if executor is None:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+async def offload(repository, func, *args, **kwargs):
+    """Call func, which uses repository, without blocking the event loop."""
+    if repository.blocking:
+        return await run_blocking(func, *args, **kwargs)
+    return func(*args, **kwargs)
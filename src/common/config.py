@@ -1,3 +1,4 @@
+import os
 import secrets
 from pydantic import BaseSettings
 
@@ -8,6 +9,11 @@ class Settings(BaseSettings):
     SECRET_KEY: str  # must be the same in the console and the api for sessions to work
     SESSION_COOKIE: str = "session"
     SESSION_EXPIRE_SECONDS: int = 60 * 60 * 24 * 10
+    # "cookie" keeps the whole session in the signed session cookie. "server" keeps it
+    # in storage, with only a random session id in the cookie, see common.sessions.
+    # The broker holds at most SESSION_STORE_SIZE sessions.
+    SESSION_BACKEND: str = "cookie"
+    SESSION_STORE_SIZE: int = 100_000
 
     # SESSION_SAME_SITE: str = 'lax' # lax, strict, or none
     # Starlette defaults to lax, but I'm not sure why. strict seems to be working for our purposes
@@ -15,6 +21,78 @@ class Settings(BaseSettings):
 
     CORS_ORIGINS: list[str] = []
     ACCESS_TOKEN_TIMEOUT_SECONDS: int = 60 * 60
+    # Refresh tokens remain usable this long after their access token expires, after
+    # which the pair is evicted by the token reaper.
+    REFRESH_TOKEN_GRACE_SECONDS: int = 60 * 60 * 24
+    TOKEN_REAP_INTERVAL_SECONDS: int = 60
+    TOKEN_REAP_BATCH_SIZE: int = 1000
+    # /token gives a client its newest access token again while it has at least
+    # TOKEN_REUSE_MIN_SECONDS left, instead of minting another. Clients with
+    # MAX_TOKENS_PER_CLIENT tokens have their oldest revoked to make room for more.
+    TOKEN_REUSE_ENABLED: bool = True
+    TOKEN_REUSE_MIN_SECONDS: int = 60 * 5
+    MAX_TOKENS_PER_CLIENT: int = 5
+    # "opaque" access tokens are random strings looked up in the token store. "signed"
+    # access tokens carry their own claims, signed with TOKEN_SIGNING_KEY (SECRET_KEY
+    # if not set), so authenticating them needs no token store lookup.
+    ACCESS_TOKEN_FORMAT: str = "opaque"
+    TOKEN_SIGNING_KEY: str | None = None
+    # With SQLite storage, each api process picks up signed tokens revoked by the
+    # others this often.
+    DENY_LIST_SYNC_SECONDS: float = 1
+
+    # "memory" keeps users, tasks and tokens in process, with client credentials in a
+    # dbm file. "sqlite" keeps everything in SQLITE_PATH, shared by all processes.
+    # "broker" keeps the memory storage in a broker process, shared by all processes
+    # that connect to BROKER_SOCKET, see common.broker.
+    STORAGE_BACKEND: str = "memory"
+    SQLITE_PATH: str = "api-first-example.db"
+    SQLITE_POOL_SIZE: int = 5
+    BROKER_SOCKET: str = "api-first-example.sock"
+    # Threads for running blocking storage calls off the event loop. 0 runs them inline.
+    STORAGE_THREADS: int = 8
+
+    # Users to load on startup, in addition to the demo users. Either a JSON Lines file
+    # with one user object per line, or an SQLite database with a users table.
+    USERS_FILE: str | None = None
+
+    # Task change events, see common.events. Recent events are kept per user for
+    # resuming streams. Subscribers more than EVENT_QUEUE_SIZE events behind are dropped.
+    EVENT_HISTORY_SIZE: int = 1000
+    EVENT_QUEUE_SIZE: int = 256
+    EVENT_KEEPALIVE_SECONDS: int = 15
+
+    # Compiled console templates, see console.templating. None uses a directory under
+    # the system's temporary directory.
+    TEMPLATE_CACHE_DIR: str | None = None
+
+    # Task responses built and encoded directly, skipping FastAPI's validation of
+    # them, see api.serialization.
+    FAST_JSON_ENABLED: bool = False
+
+    # Request and model call metrics on /metrics, see common.metrics.
+    METRICS_ENABLED: bool = True
+
+    # Token-bucket rate limits, see common.ratelimit. Requests per second, and the
+    # burst allowed above that, per client and per user, and for /token per client_id.
+    RATE_LIMIT_ENABLED: bool = True
+    CLIENT_RATE_LIMIT_PER_SECOND: float = 50
+    CLIENT_RATE_LIMIT_BURST: int = 100
+    USER_RATE_LIMIT_PER_SECOND: float = 100
+    USER_RATE_LIMIT_BURST: int = 200
+    TOKEN_RATE_LIMIT_PER_SECOND: float = 1
+    TOKEN_RATE_LIMIT_BURST: int = 10
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+
+    CLIENT_CACHE_SIZE: int = 1024
+    CLIENT_CACHE_TTL_SECONDS: int = 60
+
+    CLIENT_SECRET_HASH_ITERATIONS: int = 100_000
+    # Successful secret verifications are cached for this long. 0 disables the cache.
+    CLIENT_SECRET_CACHE_TTL_SECONDS: int = 300
+    CLIENT_SECRET_CACHE_SIZE: int = 1024
+    # Threads for secret hashing. 0 hashes inline on the event loop.
+    SECRET_HASH_THREADS: int = os.cpu_count() or 1
 
 
 settings = Settings()
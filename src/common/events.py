@@ -0,0 +1,192 @@
+"""
+In-process publish/subscribe of task changes, for the api's /tasks/events stream.
+
+The Task model publishes an event for each task it creates or updates. Subscribers
+are per user and each holds a bounded queue that is fed as events are published, so
+idle subscribers cost a queue and a waiting coroutine, and nothing is polled.
+
+Each user also has a short history of recent events so that a client reconnecting
+with the id of the last event it saw can be sent what it missed. Event ids are
+"<epoch>:<seq>", where seq counts up per user and epoch identifies this hub, so ids
+from before a restart are recognized as unresumable.
+
+A subscriber whose queue fills up, i.e. a consumer that is not keeping up, is
+dropped rather than allowed to hold events without bound. Its stream ends and the
+client can reconnect with the last event id it saw.
+
+With STORAGE_BACKEND=broker, events are published via the broker, which numbers
+them and relays them back to the hub in every worker.
+
+Events are published from whichever thread did the storage call. They are handed
+to subscribers directly when published on the subscribers' event loop, and
+otherwise with one call_soon_threadsafe per loop.
+"""
+import asyncio
+import itertools
+import secrets
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from common.config import settings
+
+
+@dataclass
+class Event:
+
+    seq: int
+    kind: str  # "created", "updated" or "reset"
+    task: dict
+
+    def id(self, epoch):
+        return f"{epoch}:{self.seq}"
+
+
+class Subscription:
+    """A user's view of the hub. Iterate over get() results until it returns None,
+    which means the subscription has been dropped for falling behind.
+
+    Events are buffered in a deque with a single waiter future rather than an
+    asyncio.Queue, so that waiting with a timeout does not need a task per wait.
+    """
+
+    def __init__(self, hub, user_id, maxsize):
+        self.hub = hub
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.maxsize = maxsize
+        self.events = deque()
+        self.waiter = None
+        self.dropped = False
+
+    def deliver(self, event):
+        """Runs on the subscriber's loop."""
+        if self.dropped:
+            return
+        if len(self.events) >= self.maxsize:
+            self.dropped = True
+            self.events.clear()
+            self.hub.dropped += 1
+            self.hub.unsubscribe(self)
+        else:
+            self.events.append(event)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def get(self, timeout=None):
+        """The next event, or None once dropped. Raises asyncio.TimeoutError if
+        there is no event within timeout seconds.
+        """
+        if not self.events and not self.dropped:
+            self.waiter = self.loop.create_future()
+            timer = None
+            if timeout is not None:
+                timer = self.loop.call_later(timeout, expire, self.waiter)
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+                if timer is not None:
+                    timer.cancel()
+        if self.dropped:
+            return None
+        return self.events.popleft()
+
+
+def expire(waiter):
+    if not waiter.done():
+        waiter.set_exception(asyncio.TimeoutError())
+
+
+def deliver(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.deliver(event)
+
+
+class TaskEventHub:
+    def __init__(self, history_size, queue_size):
+        self.epoch = secrets.token_hex(4)
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.sequences = defaultdict(lambda: itertools.count(1))  # user id -> seqs
+        self.history = defaultdict(lambda: deque(maxlen=self.history_size))
+        self.subscribers = defaultdict(set)  # user id -> subscriptions
+        self.published = 0
+        self.dropped = 0
+        self.relay = None  # publishes via a broker instead, see common.broker
+
+    def publish(self, user_id, kind, task):
+        if self.relay is not None:
+            self.relay(user_id, kind, task)
+            return
+        with self.lock:
+            seq = next(self.sequences[user_id])
+        self.dispatch(self.epoch, user_id, seq, kind, task)
+
+    def dispatch(self, epoch, user_id, seq, kind, task):
+        """Record an event and hand it to the user's subscribers. Events relayed from
+        a broker carry the broker's epoch, which changes if the broker restarts.
+        """
+        event = Event(seq, kind, task)
+        with self.lock:
+            if epoch != self.epoch:
+                self.epoch = epoch
+                self.history.clear()
+            self.history[user_id].append(event)
+            subscribers = list(self.subscribers.get(user_id, ()))
+            self.published += 1
+        by_loop = defaultdict(list)
+        for subscription in subscribers:
+            by_loop[subscription.loop].append(subscription)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for loop, subscriptions in by_loop.items():
+            if loop is running:
+                deliver(subscriptions, event)
+            else:
+                loop.call_soon_threadsafe(deliver, subscriptions, event)
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Returns the subscription and the events missed since last_event_id.
+
+        If the missed events can no longer be replayed, a single "reset" event is
+        returned in their place, after which the client should refetch its tasks.
+        """
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self.lock:
+            self.subscribers[user_id].add(subscription)
+            missed = self.missed(user_id, last_event_id)
+        return subscription, missed
+
+    def missed(self, user_id, last_event_id):
+        if last_event_id is None:
+            return []
+        history = self.history.get(user_id, ())
+        epoch, _, seq = last_event_id.partition(":")
+        if epoch == self.epoch and seq.isdigit():
+            seq = int(seq)
+            if not history or history[0].seq <= seq + 1:
+                return [event for event in history if event.seq > seq]
+        latest = history[-1].seq if history else 0
+        return [Event(latest, "reset", {})]
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.user_id]
+
+    @property
+    def stats(self):
+        return {
+            "subscribers": sum(len(s) for s in self.subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+hub = TaskEventHub(settings.EVENT_HISTORY_SIZE, settings.EVENT_QUEUE_SIZE)
@@ -0,0 +1,84 @@
+"""
+Hashing of client secrets. Secrets are stored as PBKDF2-SHA256 hashes in the format:
+
+  pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+The key derivation is deliberately slow, so verification runs on a thread pool
+(hashlib releases the GIL while hashing) and successful verifications are cached
+for CLIENT_SECRET_CACHE_TTL_SECONDS, keyed by a fast digest of the credentials.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from common.cache import TTLCache
+from common.config import settings
+
+ALGORITHM = "pbkdf2_sha256"
+
+
+def b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def hash_secret(secret: str, iterations: int = None) -> str:
+    iterations = iterations or settings.CLIENT_SECRET_HASH_ITERATIONS
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", secret.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${b64encode(salt)}${b64encode(digest)}"
+
+
+def verify_secret(secret: str, encoded: str) -> bool:
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+    except ValueError:
+        return False
+    if algorithm != ALGORITHM:
+        return False
+    digest = hashlib.pbkdf2_hmac(
+        "sha256", secret.encode(), b64decode(salt), int(iterations)
+    )
+    return hmac.compare_digest(digest, b64decode(expected))
+
+
+verified = TTLCache(
+    settings.CLIENT_SECRET_CACHE_SIZE, settings.CLIENT_SECRET_CACHE_TTL_SECONDS
+)
+
+executor = None
+if settings.SECRET_HASH_THREADS > 0:
+    executor = ThreadPoolExecutor(
+        max_workers=settings.SECRET_HASH_THREADS, thread_name_prefix="hashing"
+    )
+
+
+def cache_key(client_id: str, secret: str, encoded: str) -> bytes:
+    """The stored hash is part of the key so that changing a client's secret
+    invalidates earlier verifications.
+    """
+    return hashlib.sha256("\0".join((client_id, secret, encoded)).encode()).digest()
+
+
+async def averify_client_secret(client_id: str, secret: str, encoded: str) -> bool:
+    """Verify a client's secret without blocking the event loop, consulting the
+    cache of recent successful verifications first.
+    """
+    use_cache = settings.CLIENT_SECRET_CACHE_TTL_SECONDS > 0
+    if use_cache:
+        key = cache_key(client_id, secret, encoded)
+        if verified.get(key):
+            return True
+    if executor is None:
+        ok = verify_secret(secret, encoded)
+    else:
+        loop = asyncio.get_running_loop()
+        ok = await loop.run_in_executor(executor, verify_secret, secret, encoded)
+    if ok and use_cache:
+        verified.set(key, True)
+    return ok
@@ -0,0 +1,207 @@
+"""
+Request and model call metrics, exposed in the Prometheus text format on /metrics
+by the api and the console.
+
+Latencies are recorded in histograms with log-spaced buckets, two per doubling
+from about 8us to about 45s, in the manner of HDR histograms. Recording a value is a
+binary search and an increment, so it is cheap enough to do on every request.
+
+Each process keeps its own metrics. With several workers, scrape each one.
+"""
+import bisect
+import functools
+import threading
+import time
+from common.config import settings
+
+
+BOUNDS = [2 ** (exponent / 2) for exponent in range(-34, 12)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(BOUNDS, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Registry:
+    """Histograms and counters by metric name and label values. Counters are
+    incremented from storage threads as well as the event loop, so under a lock.
+    """
+
+    def __init__(self):
+        self.help = {}
+        self.labels = {}
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help, labels):
+        self.help[name] = help
+        self.labels[name] = labels
+        self.histograms[name] = {}
+
+    def counter(self, name, help, labels):
+        self.help[name] = help
+        self.labels[name] = labels
+        self.counters[name] = {}
+
+    def observe(self, name, values, seconds):
+        histograms = self.histograms[name]
+        histogram = histograms.get(values)
+        if histogram is None:
+            histogram = histograms.setdefault(values, Histogram())
+        histogram.observe(seconds)
+
+    def increment(self, name, values):
+        counters = self.counters[name]
+        with self.lock:
+            counters[values] = counters.get(values, 0) + 1
+
+    def render(self):
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            with self.lock:
+                series = list(series.items())
+            for values, count in series:
+                lines.append(f"{name}{{{self.format(name, values)}}} {count}")
+        for name, series in self.histograms.items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for values, histogram in list(series.items()):
+                labels = self.format(name, values)
+                with histogram.lock:
+                    counts = list(histogram.counts)
+                    total = histogram.sum
+                cumulative = 0
+                for bound, count in zip(BOUNDS + ["+Inf"], counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else f"{bound:.6g}"
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {total}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def format(self, name, values):
+        return ",".join(
+            f'{label}="{value}"' for label, value in zip(self.labels[name], values)
+        )
+
+
+registry = Registry()
+registry.counter(
+    "http_requests_total",
+    "HTTP requests by handler and status.",
+    ("app", "handler", "method", "status"),
+)
+registry.counter(
+    "oauth2_tokens_total",
+    "Access tokens given out by /token, by whether they were minted or reused, and "
+    "tokens revoked to keep clients under MAX_TOKENS_PER_CLIENT.",
+    ("outcome",),
+)
+registry.histogram(
+    "http_request_duration_seconds",
+    "Time to handle HTTP requests, including the response body.",
+    ("app", "handler", "method"),
+)
+registry.histogram(
+    "model_call_duration_seconds",
+    "Time spent in model calls, including storage.",
+    ("call",),
+)
+
+
+def timed(name):
+    """Decorator recording the duration of each call of a function as a model
+    call named name.
+    """
+
+    def decorator(func):
+        if not settings.METRICS_ENABLED:
+            return func
+        values = (name,)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(
+                    "model_call_duration_seconds",
+                    values,
+                    time.perf_counter() - started,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """Counts requests and records their durations by handler, i.e. the name of
+    the endpoint function the request was routed to. Requests that were not routed
+    are recorded under "none", so that arbitrary paths do not create new series.
+
+    This should be the outermost middleware, so that the time spent in the others
+    is included. Some middleware copies the scope, so the endpoint is not seen here.
+    It is recorded by HandlerLabelMiddleware, innermost, in a dict that the copies
+    share.
+    """
+
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        labels = scope["metrics"] = {"handler": "none"}
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            handler = labels["handler"]
+            method = scope["method"]
+            registry.observe(
+                "http_request_duration_seconds",
+                (self.name, handler, method),
+                time.perf_counter() - started,
+            )
+            registry.increment(
+                "http_requests_total", (self.name, handler, method, str(status))
+            )
+
+
+class HandlerLabelMiddleware:
+    """See MetricsMiddleware."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if "metrics" in scope and "endpoint" in scope:
+                name = getattr(scope["endpoint"], "__name__", "none")
+                scope["metrics"]["handler"] = name
@@ -1,10 +1,21 @@
 import datetime
-import dbm
-import json
-import os
+import sys
 import shortuuid
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
+from common.cache import TTLCache
+from common.concurrency import offload
 from common.config import settings
+from common.events import hub as task_events
+from common.hashing import averify_client_secret, hash_secret, verify_secret
+from common.metrics import registry, timed
+from common.repositories import (
+    DbmClientRepository,
+    MemoryTaskRepository,
+    MemoryTokenRepository,
+    MemoryUserRepository,
+)
+from common.tokens import denied, deny_access_token, sign_access_token
+from common.userfile import read_users
 
 
 @dataclass
@@ -17,50 +28,236 @@ class User:
     superuser: bool = False
 
     @classmethod
+    @timed("User.get")
+    def get(cls, user_id):
+        return cls.repository.get(user_id)
+
+    @classmethod
+    async def aget(cls, user_id):
+        return await offload(cls.repository, cls.get, user_id)
+
+    @classmethod
+    @timed("User.get_by_username")
     def get_by_username(cls, username):
-        for user in cls.table.values():
-            if user.username == username:
-                return user
+        return cls.repository.get_by_username(username)
+
+    @classmethod
+    def load_file(cls, path, batch_size=10_000):
+        """Add or replace the users in a user directory file, see common.userfile.
+        Users are added in batches, each of which is all or nothing. Returns the
+        number of users loaded.
+        """
+        count = 0
+        batch = []
+        for fields in read_users(path):
+            batch.append(cls(**fields))
+            if len(batch) == batch_size:
+                cls.repository.add_many(batch)
+                count += len(batch)
+                batch = []
+        cls.repository.add_many(batch)
+        return count + len(batch)
 
     @property
     def is_authenticated(self):
         return True
 
 
-User.table = {
-    1: User(id=1, username="ronnie", password="ronnie1"),
-    2: User(id=2, username="bobby", password="bobby2"),
-    3: User(id=3, username="ricky", password="ricky3", superuser=True),
-    4: User(id=4, username="mike", password="mike4", active=False),
-}
+DEMO_USERS = [
+    User(id=1, username="ronnie", password="ronnie1"),
+    User(id=2, username="bobby", password="bobby2"),
+    User(id=3, username="ricky", password="ricky3", superuser=True),
+    User(id=4, username="mike", password="mike4", active=False),
+]
 
 
-@dataclass
+UPDATABLE_TASK_FIELDS = {"description", "done"}
+
+
+@dataclass(slots=True)
 class Task:
+    """A task, with its owner by id so that tasks are small, and cheap to pickle."""
 
     id: str
-    user: User
+    user_id: int
     description: str
     done: bool = False
+    version: int = 0  # incremented on every update, see api.conditional
+    revision: int = 0  # set by the repository on every write, see latest_revision
 
     @classmethod
+    @timed("Task.create")
     def create(cls, user, description):
         _id = shortuuid.uuid()[:5]
-        task = cls(id=_id, user=user, description=description)
-        cls.table[_id] = task
+        while cls.repository.get(_id) is not None:  # short ids do collide at scale
+            _id = shortuuid.uuid()[:5]
+        task = cls(id=_id, user_id=user.id, description=description)
+        cls.repository.add(task)
+        task.publish("created")
         return task
 
+    @timed("Task.update")
     def update(self, **data):
-        self.__dict__.update(data)
-        return self
+        """Returns the updated task, a new object, or None if the task has been saved
+        since this one was read. Nothing is changed in that case.
+        """
+        task = replace(self, version=self.version + 1)
+        task.assign(data)
+        if not self.repository.save(task):
+            return None
+        task.publish("updated")
+        return task
+
+    def assign(self, data):
+        """Set the fields in data, which may only be those clients can change."""
+        for name, value in data.items():
+            if name not in UPDATABLE_TASK_FIELDS:
+                raise ValueError(f"Task field {name!r} can't be updated")
+            setattr(self, name, value)
+
+    def publish(self, kind):
+        """Notify subscribers to the owner's task events, see common.events."""
+        task_events.publish(
+            self.user_id,
+            kind,
+            {"id": self.id, "description": self.description, "done": self.done},
+        )
+
+    @classmethod
+    @timed("Task.create_many")
+    def create_many(cls, user, descriptions):
+        """Create a task for each description, all or nothing."""
+        ids = cls.new_ids(len(descriptions))
+        tasks = [
+            cls(id=_id, user_id=user.id, description=description)
+            for _id, description in zip(ids, descriptions)
+        ]
+        cls.repository.add_many(tasks)
+        for task in tasks:
+            task.publish("created")
+        return tasks
+
+    @classmethod
+    def new_ids(cls, count):
+        """count distinct short ids that are not in use, with one lookup for each
+        round of collisions rather than one per id.
+        """
+        ids = set()
+        while len(ids) < count:
+            candidates = {shortuuid.uuid()[:5] for _ in range(count - len(ids))}
+            candidates -= ids
+            ids |= candidates - cls.repository.get_many(candidates).keys()
+        return list(ids)
+
+    @classmethod
+    @timed("Task.update_many")
+    def update_many(cls, user, changes):
+        """Apply a list of (task_id, data) changes on behalf of user, all or nothing.
+
+        Returns the updated tasks in the order of changes, and the set of ids that do
+        not exist or that the user may not change. Nothing is changed if that set is
+        not empty. Only superusers may change other users' tasks.
+
+        If any of the tasks is saved by someone else in the meantime, the tasks are
+        read again and the changes applied to them afresh.
+        """
+        while True:
+            tasks = cls.repository.get_many({task_id for task_id, _ in changes})
+            missing = {
+                task_id
+                for task_id, _ in changes
+                if task_id not in tasks
+                or not (tasks[task_id].user_id == user.id or user.superuser)
+            }
+            if missing:
+                return [], missing
+            updated = {
+                task_id: replace(task, version=task.version + 1)
+                for task_id, task in tasks.items()
+            }
+            for task_id, data in changes:
+                updated[task_id].assign(data)
+            if cls.repository.save_many(list(updated.values())):
+                break
+        for task in updated.values():
+            task.publish("updated")
+        return [updated[task_id] for task_id, _ in changes], missing
+
+    @classmethod
+    async def acreate(cls, user, description):
+        return await offload(cls.repository, cls.create, user, description)
+
+    @classmethod
+    async def acreate_many(cls, user, descriptions):
+        return await offload(cls.repository, cls.create_many, user, descriptions)
+
+    async def aupdate(self, **data):
+        return await offload(self.repository, self.update, **data)
+
+    @classmethod
+    async def aupdate_many(cls, user, changes):
+        return await offload(cls.repository, cls.update_many, user, changes)
+
+    @classmethod
+    @timed("Task.get")
+    def get(cls, task_id):
+        return cls.repository.get(task_id)
+
+    @classmethod
+    async def aget(cls, task_id):
+        return await offload(cls.repository, cls.get, task_id)
+
+    @classmethod
+    @timed("Task.for_user")
+    def for_user(cls, user, after=0, limit=None):
+        return cls.repository.for_user(user.id, after, limit)
+
+    @classmethod
+    async def afor_user(cls, user, after=0, limit=None):
+        return await offload(cls.repository, cls.for_user, user, after, limit)
 
     @classmethod
-    def for_user(cls, user):
-        _ = []
-        for task in cls.table.values():
-            if task.user == user:
-                _.append(task)
-        return _
+    @timed("Task.page_for_user")
+    def page_for_user(cls, user, after=0, limit=None):
+        """See TaskRepository.page_for_user."""
+        return cls.repository.page_for_user(user.id, after, limit)
+
+    @classmethod
+    async def apage_for_user(cls, user, after=0, limit=None):
+        return await offload(cls.repository, cls.page_for_user, user, after, limit)
+
+    @classmethod
+    def iter_for_user(cls, user, after=0, limit=None):
+        return cls.repository.iter_for_user(user.id, after, limit)
+
+    @classmethod
+    def latest_revision(cls, user):
+        """The user's task revision as "epoch:revision", see TaskRepository.epoch
+        and TaskRepository.latest_revision.
+        """
+        return f"{cls.repository.epoch()}:{cls.repository.latest_revision(user.id)}"
+
+    @classmethod
+    async def alatest_revision(cls, user):
+        return await offload(cls.repository, cls.latest_revision, user)
+
+    @classmethod
+    @timed("Task.changed_since")
+    def changed_since(cls, user, since):
+        """The user's tasks written after since, a revision from latest_revision, or
+        None if it is from another epoch, in which case the tasks since can't be told
+        apart from the rest. Raises ValueError if since is not a revision.
+        """
+        epoch, _, revision = since.rpartition(":")
+        if not epoch or not (revision.isascii() and revision.isdigit()):
+            raise ValueError(f"Invalid revision {since!r}")
+        if epoch != cls.repository.epoch():
+            return None
+        return cls.repository.changed_since(user.id, int(revision))
+
+    @classmethod
+    async def achanged_since(cls, user, since):
+        return await offload(cls.repository, cls.changed_since, user, since)
 
     def asdict(self):
         """Super annoying that Python dataclasses make this a module function instead
@@ -69,8 +266,6 @@ class Task:
         return asdict(self)
 
 
-Task.table = {}
-
 ###
 
 import secrets
@@ -78,104 +273,362 @@ import secrets
 
 @dataclass
 class OAuth2Client:
-    """Client credentials object for managing programmatic access to the API."""
+    """Client credentials object for managing programmatic access to the API.
+
+    Lookups are cached in-process for CLIENT_CACHE_TTL_SECONDS so that bursts of
+    token requests do not each have to open the credentials store.
+    """
 
     user: User
     client_id: str
-    client_secret: str
+    client_secret_hash: str
+
+    @classmethod
+    @timed("OAuth2Client.create")
+    def create(cls, user):
+        """Returns the new client along with its secret. Only the hash of the secret
+        is stored, so this is the only chance to show the secret to the user.
+        """
+        secret = secrets.token_urlsafe(32)
+        client = cls(
+            user=user,
+            client_id=secrets.token_urlsafe(32),
+            client_secret_hash=hash_secret(secret),
+        )
+        cls.repository.add(client)
+        cls.invalidate(user_id=user.id)
+        return client, secret
+
+    def verify_secret(self, secret):
+        return verify_secret(secret, self.client_secret_hash)
+
+    async def averify_secret(self, secret):
+        return await averify_client_secret(
+            self.client_id, secret, self.client_secret_hash
+        )
 
     @classmethod
     def get_for_user(cls, user):
-        _ = []
-        with dbm.open("client_credentials", "r") as db:
-            for key in db.keys():
-                data = json.loads(db[key])
-                if data["user_id"] == user.id:
-                    _.append(
-                        cls(
-                            user=user,
-                            client_id=data["client_id"],
-                            client_secret=data["client_secret"],
-                        )
-                    )
-        return _
+        clients = cls.user_cache.get(user.id)
+        if clients is None:
+            clients = cls._load_for_user(user)
+        return clients
 
     @classmethod
+    async def aget_for_user(cls, user):
+        clients = cls.user_cache.get(user.id)
+        if clients is None:
+            clients = await offload(cls.repository, cls._load_for_user, user)
+        return clients
+
+    @classmethod
+    def _load_for_user(cls, user):
+        clients = cls.repository.for_user(user.id)
+        cls.user_cache.set(user.id, clients)
+        return clients
+
+    @classmethod
+    @timed("OAuth2Client.get")
     def get(cls, client_id):
-        with dbm.open("client_credentials", "r") as db:
-            data = json.loads(db.get(client_id))
-        user = User.table[data["user_id"]]
-        client = cls(
-            user=user, client_id=data["client_id"], client_secret=data["client_secret"]
-        )
+        client = cls.cache.get(client_id)
+        if client is None:
+            client = cls._load(client_id)
         return client
 
+    @classmethod
+    async def aget(cls, client_id):
+        """Cache hits are returned without a trip through the storage threads."""
+        client = cls.cache.get(client_id)
+        if client is None:
+            client = await offload(cls.repository, cls._load, client_id)
+        return client
 
-"""
-Here we bootstrap each user with a given client. Presumably, however, there would be
-a UI for creating and deleting client credentials. A given user might have multiple
-clients, but we create a single client for each user here.
-
-NOTE: This fairly crude shared persistence assumes that the console and api are co-located.
-This will not work otherwise, as the separate runtimes will have different credentials.
-For a distributed deployment, a real database is needed. This is simply for demo/proof-of-concept
-purposes.
-"""
-if not os.path.exists("client_credentials"):
-    with dbm.open("client_credentials", "c") as db:
-        for user in User.table.values():
-            data = {
-                "user_id": user.id,
-                "client_id": secrets.token_urlsafe(32),
-                "client_secret": secrets.token_urlsafe(32),
-            }
-            db[data["client_id"]] = json.dumps(data)
+    @classmethod
+    @timed("OAuth2Client._load")
+    def _load(cls, client_id):
+        client = cls.repository.get(client_id)
+        if client is not None:
+            cls.cache.set(client_id, client)
+        return client
 
+    @classmethod
+    def invalidate(cls, client_id=None, user_id=None):
+        """Drop cached lookups for the given client and/or user, or everything if
+        called without arguments. Call this after changing the credentials store.
+        """
+        if client_id is None and user_id is None:
+            cls.cache.clear()
+            cls.user_cache.clear()
+        if client_id is not None:
+            cls.cache.invalidate(client_id)
+        if user_id is not None:
+            cls.user_cache.invalidate(user_id)
 
-@dataclass
+    @classmethod
+    def cache_stats(cls):
+        return {"clients": cls.cache.stats, "user_clients": cls.user_cache.stats}
+
+
+OAuth2Client.cache = TTLCache(
+    settings.CLIENT_CACHE_SIZE, settings.CLIENT_CACHE_TTL_SECONDS
+)
+OAuth2Client.user_cache = TTLCache(
+    settings.CLIENT_CACHE_SIZE, settings.CLIENT_CACHE_TTL_SECONDS
+)
+
+
+@dataclass(slots=True)
 class OAuth2Token:
-    """An access token."""
+    """An access token. Its client is kept by id, interned, so that the client's
+    tokens share the one string.
+    """
 
-    client: OAuth2Client
+    client_id: str
     access_token: str
     refresh_token: str
     access_token_expires_at: datetime.datetime
     revoked: bool = False
+    shared: bool = False  # given out more than once, see create_for_client
 
     @classmethod
-    def _create(cls, client):
+    @timed("OAuth2Token._create")
+    def _create(cls, client, tokens=None):
+        """Mint a new token for client, first revoking its oldest tokens if it has
+        MAX_TOKENS_PER_CLIENT already. tokens, if given, are the client's tokens.
+        """
+        if tokens is None:
+            tokens = cls.repository.for_client(client.client_id)
+        excess = len(tokens) - settings.MAX_TOKENS_PER_CLIENT + 1
+        for token in tokens[: max(excess, 0)]:
+            token.revoke()
+            registry.increment("oauth2_tokens_total", ("evicted",))
         expires = datetime.datetime.utcnow() + datetime.timedelta(
             seconds=settings.ACCESS_TOKEN_TIMEOUT_SECONDS
         )
+        if settings.ACCESS_TOKEN_FORMAT == "signed":
+            access_token = sign_access_token(client, expires)
+        else:
+            access_token = secrets.token_urlsafe(32)
         token = cls(
-            client=client,
-            access_token=secrets.token_urlsafe(32),
+            client_id=sys.intern(client.client_id),
+            access_token=access_token,
             refresh_token=secrets.token_urlsafe(32),
             access_token_expires_at=expires,
         )
-        cls.access_tokens[token.access_token] = token
-        cls.refresh_tokens[token.refresh_token] = token
+        cls.repository.add(token)
         return token
 
+    @classmethod
+    @timed("OAuth2Token.get")
+    def get(cls, access_token):
+        return cls.repository.get(access_token)
+
+    @classmethod
+    async def aget(cls, access_token):
+        return await offload(cls.repository, cls.get, access_token)
+
     @classmethod
     def create_for_client(cls, client, grant_type, scope="api"):
+        """Reuses the client's newest token if it has long enough left to run, see
+        TOKEN_REUSE_MIN_SECONDS. Clients that share their credentials then share the
+        token, and its refresh token, so refreshing a token given out more than once
+        doesn't revoke it, see refresh.
+        """
         assert (
             grant_type == "client_credentials"
         )  # only client_credentials and api scope currently supported
         assert scope == "api"
-        return cls._create(client)
+        tokens = cls.repository.for_client(client.client_id)
+        if settings.TOKEN_REUSE_ENABLED and tokens:
+            newest = tokens[-1]
+            cutoff = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=settings.TOKEN_REUSE_MIN_SECONDS
+            )
+            if not newest.revoked and newest.access_token_expires_at >= cutoff:
+                if not newest.shared:
+                    newest.shared = True
+                    cls.repository.share(newest)
+                registry.increment("oauth2_tokens_total", ("reused",))
+                return newest
+        registry.increment("oauth2_tokens_total", ("minted",))
+        return cls._create(client, tokens)
 
     @classmethod
+    async def acreate_for_client(cls, client, grant_type, scope="api"):
+        return await offload(
+            cls.repository, cls.create_for_client, client, grant_type, scope
+        )
+
+    @classmethod
+    @timed("OAuth2Token.refresh")
     def refresh(cls, refresh_token):
         """See:
         https://requests-oauthlib.readthedocs.io/en/latest/oauth2_workflow.html#refreshing-tokens
+
+        Raises KeyError if the refresh token is unknown or has been reaped, or its
+        client no longer exists.
+
+        A token that was given out more than once is left for its other holders, and
+        the client's current token is given out instead, as by create_for_client.
         """
-        obj = cls.refresh_tokens[refresh_token]
-        client = obj.client
-        del cls.access_tokens[obj.access_token]
-        del cls.refresh_tokens[refresh_token]
+        obj = cls._redeem(refresh_token)
+        client = OAuth2Client.get(obj.client_id)
+        if client is None:
+            raise KeyError(refresh_token)
+        if obj.shared:
+            return cls.create_for_client(client, "client_credentials")
         return cls._create(client)
 
+    @classmethod
+    async def arefresh(cls, refresh_token):
+        """The client is looked up with OAuth2Client.aget, since a cache miss goes to
+        the credentials store, even when the token store is in memory.
+        """
+        obj = await offload(cls.repository, cls._redeem, refresh_token)
+        client = await OAuth2Client.aget(obj.client_id)
+        if client is None:
+            raise KeyError(refresh_token)
+        if obj.shared:
+            return await cls.acreate_for_client(client, "client_credentials")
+        return await offload(cls.repository, cls._create, client)
+
+    @classmethod
+    @timed("OAuth2Token._redeem")
+    def _redeem(cls, refresh_token):
+        """Get the token with refresh_token, revoking it unless it is shared."""
+        obj = cls.repository.get_by_refresh_token(refresh_token)
+        if obj is None:
+            raise KeyError(refresh_token)
+        if not obj.shared:
+            obj.revoke()
+        return obj
+
+    def revoke(self):
+        self.revoked = True
+        self.repository.remove(self)
+        if settings.ACCESS_TOKEN_FORMAT == "signed":
+            deny_access_token(self.access_token)
+
+    @classmethod
+    def reap(cls, limit=None):
+        """Evict expired tokens. See MemoryTokenRepository.reap."""
+        return cls.repository.reap(limit or settings.TOKEN_REAP_BATCH_SIZE)
+
+    @classmethod
+    def store_stats(cls):
+        """Counters of the token store, see MemoryTokenRepository.stats."""
+        return cls.repository.stats
+
+    @classmethod
+    async def astore_stats(cls):
+        return await offload(cls.repository, cls.store_stats)
+
+
+class Session:
+    """Server-side session data by session id, see common.sessions."""
+
+    @classmethod
+    @timed("Session.get")
+    def get(cls, session_id):
+        return cls.repository.get(session_id)
+
+    @classmethod
+    async def aget(cls, session_id):
+        return await offload(cls.repository, cls.get, session_id)
+
+    @classmethod
+    @timed("Session.save")
+    def save(cls, session_id, data, expires_at):
+        cls.repository.save(session_id, data, expires_at)
+
+    @classmethod
+    async def asave(cls, session_id, data, expires_at):
+        await offload(cls.repository, cls.save, session_id, data, expires_at)
+
+    @classmethod
+    def remove(cls, session_id):
+        cls.repository.remove(session_id)
+
+    @classmethod
+    async def aremove(cls, session_id):
+        await offload(cls.repository, cls.remove, session_id)
+
+    @classmethod
+    def reap(cls, limit=None):
+        """Evict expired sessions. See MemorySessionRepository.reap."""
+        return cls.repository.reap(limit or settings.TOKEN_REAP_BATCH_SIZE)
+
+
+if settings.STORAGE_BACKEND == "memory":
+    User.repository = MemoryUserRepository()
+    Task.repository = MemoryTaskRepository()
+    OAuth2Client.repository = DbmClientRepository(
+        "client_credentials", OAuth2Client, User.repository
+    )
+    OAuth2Token.repository = MemoryTokenRepository(
+        grace_seconds=settings.REFRESH_TOKEN_GRACE_SECONDS
+    )
+    if settings.SESSION_BACKEND == "server":
+        # Memory storage isn't shared by the console and the api, so their sessions
+        # are kept in SQLite instead.
+        from common.sqlite import SQLiteDatabase, SQLiteSessionRepository
+
+        Session.repository = SQLiteSessionRepository(
+            SQLiteDatabase(settings.SQLITE_PATH, pool_size=settings.SQLITE_POOL_SIZE)
+        )
+elif settings.STORAGE_BACKEND == "sqlite":
+    from common.sqlite import (
+        SQLiteDatabase,
+        SQLiteClientRepository,
+        SQLiteDeniedTokenRepository,
+        SQLiteSessionRepository,
+        SQLiteTaskRepository,
+        SQLiteTokenRepository,
+        SQLiteUserRepository,
+    )
+
+    db = SQLiteDatabase(settings.SQLITE_PATH, pool_size=settings.SQLITE_POOL_SIZE)
+    User.repository = SQLiteUserRepository(db, User)
+    Task.repository = SQLiteTaskRepository(db, Task)
+    OAuth2Client.repository = SQLiteClientRepository(db, OAuth2Client, User.repository)
+    OAuth2Token.repository = SQLiteTokenRepository(
+        db, OAuth2Token, grace_seconds=settings.REFRESH_TOKEN_GRACE_SECONDS
+    )
+    Session.repository = SQLiteSessionRepository(db)
+    denied.repository = SQLiteDeniedTokenRepository(db)
+elif settings.STORAGE_BACKEND == "broker":
+    from common.broker import (
+        BrokerClient,
+        BrokerRepository,
+        BrokerTaskRepository,
+        relay,
+    )
+
+    broker = BrokerClient(settings.BROKER_SOCKET)
+    User.repository = BrokerRepository(broker, "users")
+    Task.repository = BrokerTaskRepository(broker, "tasks")
+    OAuth2Client.repository = BrokerRepository(broker, "clients")
+    OAuth2Token.repository = BrokerRepository(broker, "tokens")
+    Session.repository = BrokerRepository(broker, "sessions")
+    relay(broker, task_events, denied)
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+
+for user in DEMO_USERS:
+    if User.get(user.id) is None:
+        User.repository.add(user)
+
+if settings.USERS_FILE:
+    User.load_file(settings.USERS_FILE)
 
-OAuth2Token.access_tokens = {}
-OAuth2Token.refresh_tokens = {}
+
+"""
+Client credentials are created by users in the console, which shows the secret once.
+Only secret hashes are stored.
+
+NOTE: With the default storage backend, this fairly crude shared persistence assumes
+that the console and api are co-located. This will not work otherwise, as the separate
+runtimes will not share credentials. For a distributed deployment, a real database is
+needed. This is simply for demo/proof-of-concept purposes.
+"""
@@ -0,0 +1,135 @@
+"""
+Token-bucket rate limiting of the api, per OAuth2 client and per user, so that one
+busy client can't take a worker's time from everyone else. Requests over the limit
+get a 429 with a Retry-After header.
+
+Each bucket is a pair of its token count and when that was last updated, refilled
+on use rather than by a timer. A bucket left alone for burst / rate seconds is full
+again, which is the same as having no bucket, so it is evicted. Memory is then
+proportional to the number of recently active keys, bounded by RATE_LIMIT_MAX_KEYS.
+
+The buckets are process-local, so with several workers a client can get up to the
+limit from each.
+"""
+import math
+import time
+from collections import OrderedDict
+from starlette.responses import JSONResponse
+from common.config import settings
+
+
+class TokenBuckets:
+    """Token buckets by key, holding up to burst tokens each and refilled at rate
+    tokens per second. The buckets are kept in order of last use, so that expired
+    ones are found at the front.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int, timer=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.timer = timer
+        self.idle = burst / rate  # seconds for an empty bucket to fill
+        self.buckets = OrderedDict()  # key -> (tokens, updated)
+        self.limited = 0
+
+    def take(self, key) -> float:
+        """Takes a token from the bucket for key. Returns 0 if there was one,
+        otherwise the seconds until there will be.
+        """
+        now = self.timer()
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+        self.buckets[key] = (tokens, now)
+        self.evict(now)
+        return wait
+
+    def evict(self, now):
+        buckets = self.buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if now - updated < self.idle and len(buckets) <= self.maxsize:
+                return
+            del buckets[key]
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @property
+    def stats(self):
+        return {"size": len(self.buckets), "limited": self.limited}
+
+
+clients = TokenBuckets(
+    settings.CLIENT_RATE_LIMIT_PER_SECOND,
+    settings.CLIENT_RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_MAX_KEYS,
+)
+users = TokenBuckets(
+    settings.USER_RATE_LIMIT_PER_SECOND,
+    settings.USER_RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_MAX_KEYS,
+)
+token_requests = TokenBuckets(  # by the client_id posted to /token, before lookup
+    settings.TOKEN_RATE_LIMIT_PER_SECOND,
+    settings.TOKEN_RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_MAX_KEYS,
+)
+
+
+def retry_after(wait: float) -> dict:
+    return {"Retry-After": str(math.ceil(wait))}
+
+
+def client_id(scope) -> str | None:
+    """The client of a token-authenticated request, set in the scope by
+    SessionAuthBackend as either the token or, for signed tokens, its claims.
+    """
+    token = scope.get("token")
+    if token is None:
+        return None
+    if isinstance(token, dict):
+        return token["cid"]
+    return token.client_id
+
+
+class RateLimitMiddleware:
+    """Limits authenticated requests by client and by user. Unauthenticated
+    requests are not limited here. This must be inside AuthenticationMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            wait = self.limit(scope)
+            if wait:
+                response = JSONResponse(
+                    {"detail": "Too Many Requests"},
+                    status_code=429,
+                    headers=retry_after(wait),
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    def limit(self, scope) -> float:
+        user = scope.get("user")
+        if user is None or not user.is_authenticated:
+            return 0.0
+        cid = client_id(scope)
+        if cid is not None:
+            wait = clients.take(cid)
+            if wait:
+                return wait
+        return users.take(user.id)
@@ -0,0 +1,56 @@
+"""
+Background eviction of expired OAuth2 tokens, and of expired server-side sessions.
+Started on application startup by the API, which is the only application that issues
+tokens. Also the syncing of the signed token deny-list when it is shared.
+"""
+import asyncio
+import logging
+import time
+from common.concurrency import offload
+from common.config import settings
+from common.models import OAuth2Token, Session
+from common.tokens import denied
+
+
+logger = logging.getLogger(__name__)
+
+
+async def reap_tokens():
+    """Periodically evict expired tokens. Eviction happens in batches of at most
+    TOKEN_REAP_BATCH_SIZE, yielding to the event loop between batches so that a large
+    backlog of expired tokens does not hold up request handling.
+
+    Expired entries are also purged from the signed token deny-list, and expired
+    sessions are evicted the same way as tokens.
+    """
+    while True:
+        await asyncio.sleep(settings.TOKEN_REAP_INTERVAL_SECONDS)
+        batch_size = settings.TOKEN_REAP_BATCH_SIZE
+        try:
+            while True:
+                reaped = await offload(
+                    OAuth2Token.repository, OAuth2Token.reap, batch_size
+                )
+                if reaped < batch_size:
+                    break
+                await asyncio.sleep(0)
+            denied.purge()
+            if denied.repository is not None:
+                await offload(denied.repository, denied.repository.purge, time.time())
+            while settings.SESSION_BACKEND == "server":
+                reaped = await offload(Session.repository, Session.reap, batch_size)
+                if reaped < batch_size:
+                    break
+                await asyncio.sleep(0)
+        except Exception:
+            logger.exception("Token reaping failed")
+
+
+async def sync_denied_tokens():
+    """Pick up the signed tokens revoked by other processes, see common.tokens."""
+    while True:
+        try:
+            await offload(denied.repository, denied.sync)
+        except Exception:
+            logger.exception("Deny-list sync failed")
+        await asyncio.sleep(settings.DENY_LIST_SYNC_SECONDS)
@@ -0,0 +1,550 @@
+"""
+Storage for the model classes in common.models.
+
+Models delegate their persistence to a repository object set as a class attribute
+(e.g. `Task.repository`). Repositories take and return model instances. Alternative
+storage implementations (see common.sqlite) provide the methods of the interface
+classes here.
+"""
+import datetime
+import dbm
+import heapq
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from common.hashing import hash_secret
+
+
+class UserRepository:
+    """Interface for user storage."""
+
+    blocking = False  # whether calls do I/O, see common.concurrency
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def get_by_username(self, username):
+        raise NotImplementedError
+
+    def add(self, user):
+        raise NotImplementedError
+
+    def add_many(self, users):
+        """Add or replace users by id, all or nothing. Raises ValueError if a username
+        would belong to more than one user.
+        """
+        raise NotImplementedError
+
+    def all(self):
+        raise NotImplementedError
+
+
+class MemoryUserRepository(UserRepository):
+    """Process-local user storage, indexed on id and on username."""
+
+    def __init__(self):
+        self.table = {}
+        self.usernames = {}  # username -> user
+
+    def get(self, user_id):
+        return self.table.get(user_id)
+
+    def get_by_username(self, username):
+        return self.usernames.get(username)
+
+    def add(self, user):
+        self.add_many([user])
+
+    def add_many(self, users):
+        users = {user.id: user for user in users}  # the last of repeated ids wins
+        claimed = {}
+        for user in users.values():
+            owner = self.usernames.get(user.username)
+            if owner is not None and owner.id not in users:
+                claimed[user.username] = owner.id
+            if claimed.setdefault(user.username, user.id) != user.id:
+                raise ValueError(f"Username {user.username!r} is already taken")
+        for user_id in users:
+            if user_id in self.table:
+                del self.usernames[self.table[user_id].username]
+        for user in users.values():
+            self.table[user.id] = user
+            self.usernames[user.username] = user
+
+    def all(self):
+        return list(self.table.values())
+
+
+class TaskRepository:
+    """Interface for task storage."""
+
+    blocking = False  # whether calls do I/O, see common.concurrency
+
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def get_many(self, task_ids):
+        """Returns a dict of task id -> task for the ids that exist."""
+        raise NotImplementedError
+
+    def add(self, task):
+        raise NotImplementedError
+
+    def add_many(self, tasks):
+        """Add all of the tasks, or none of them."""
+        raise NotImplementedError
+
+    def save(self, task):
+        """Save a changed task if the stored task is still the one it was changed
+        from, i.e. is one version behind it. Returns whether it was saved.
+        """
+        raise NotImplementedError
+
+    def save_many(self, tasks):
+        """Save all of the tasks, or none of them if any of them can't be saved, see
+        save. Returns whether they were saved.
+        """
+        raise NotImplementedError
+
+    def for_user(self, user_id, after=0, limit=None):
+        """The user's tasks in creation order, after the position after, see
+        page_for_user.
+        """
+        raise NotImplementedError
+
+    def page_for_user(self, user_id, after=0, limit=None):
+        """Up to limit of the user's tasks in creation order, after the position
+        after, and the position to pass as after for the next page, or None if
+        there are no more. 0 is the position before the first task. Positions are
+        keys into the user's tasks, so that a page is found without walking the
+        earlier ones.
+        """
+        raise NotImplementedError
+
+    def iter_for_user(self, user_id, after=0, limit=None):
+        raise NotImplementedError
+
+    def epoch(self):
+        """A string that names this store of tasks, and changes if it is replaced,
+        e.g. when in-memory tasks are lost on restart. Revisions only follow on from
+        each other within an epoch.
+        """
+        raise NotImplementedError
+
+    def latest_revision(self, user_id):
+        """The revision of the user's most recently written task, or 0.
+
+        Writing a task sets its revision to the next in a sequence per user, so a
+        client that has seen a user's tasks as of some revision only needs the tasks
+        with a later one to catch up.
+        """
+        raise NotImplementedError
+
+    def changed_since(self, user_id, revision):
+        """The user's tasks with a later revision, in creation order."""
+        raise NotImplementedError
+
+
+class MemoryTaskRepository(TaskRepository):
+    """Process-local task storage.
+
+    Tasks are kept in a dict keyed on task id, along with a secondary index of
+    user id -> task ids so that listing a user's tasks does not need to look at
+    every task in the system. The index lists are in creation order.
+
+    Writes are serialized by a lock, so that revisions are given out in order. A
+    task's revision is set before the user's latest revision moves past it. Saved
+    tasks replace the stored objects, which are not changed, see Task.update.
+    """
+
+    def __init__(self):
+        self.table = {}
+        self.user_index = defaultdict(list)
+        self.revisions = defaultdict(int)  # user id -> latest revision
+        self.lock = threading.Lock()
+        self._epoch = secrets.token_hex(8)
+
+    def stamp(self, tasks):
+        """Give each task the next revision of its owner. Call with the lock held."""
+        latest = {}
+        for task in tasks:
+            user_id = task.user_id
+            revision = latest.get(user_id, self.revisions[user_id]) + 1
+            task.revision = latest[user_id] = revision
+        return latest
+
+    def get(self, task_id):
+        return self.table.get(task_id)
+
+    def get_many(self, task_ids):
+        return {
+            task_id: self.table[task_id]
+            for task_id in task_ids
+            if task_id in self.table
+        }
+
+    def add(self, task):
+        self.add_many([task])
+
+    def add_many(self, tasks):
+        with self.lock:
+            latest = self.stamp(tasks)
+            for task in tasks:
+                self.table[task.id] = task
+                self.user_index[task.user_id].append(task.id)
+            self.revisions.update(latest)
+
+    def save(self, task):
+        return self.save_many([task])
+
+    def save_many(self, tasks):
+        """A task's owner can't be changed, see Task.assign, so the index needs no
+        attention here.
+        """
+        with self.lock:
+            if any(self.table[task.id].version != task.version - 1 for task in tasks):
+                return False
+            latest = self.stamp(tasks)
+            for task in tasks:
+                self.table[task.id] = task
+            self.revisions.update(latest)
+        return True
+
+    def for_user(self, user_id, after=0, limit=None):
+        return self.page_for_user(user_id, after, limit)[0]
+
+    def page_for_user(self, user_id, after=0, limit=None):
+        """Tasks are only ever appended to a user's index, so an index into it is a
+        stable position for paging, and slicing from it skips the earlier tasks.
+        """
+        task_ids = self.user_index.get(user_id, [])
+        if limit is None:
+            return [self.table[task_id] for task_id in task_ids[after:]], None
+        stop = after + limit
+        tasks = [self.table[task_id] for task_id in task_ids[after:stop]]
+        return tasks, stop if len(task_ids) > stop else None
+
+    def iter_for_user(self, user_id, after=0, limit=None):
+        return iter(self.for_user(user_id, after, limit))
+
+    def epoch(self):
+        """New for each process, since that is how long its tasks last."""
+        return self._epoch
+
+    def latest_revision(self, user_id):
+        return self.revisions.get(user_id, 0)
+
+    def changed_since(self, user_id, revision):
+        """A scan of the user's tasks, which in memory is quick next to sending them."""
+        return [
+            task for task in self.iter_for_user(user_id) if task.revision > revision
+        ]
+
+
+class ClientRepository:
+    """Interface for OAuth2 client credentials storage."""
+
+    blocking = False  # whether calls do I/O, see common.concurrency
+
+    def get(self, client_id):
+        raise NotImplementedError
+
+    def for_user(self, user_id):
+        raise NotImplementedError
+
+    def add(self, client):
+        raise NotImplementedError
+
+
+def user_index_key(user_id):
+    """dbm key of the list of client ids belonging to a user. Client ids are url-safe
+    tokens, so the colon keeps these keys distinct from client records.
+    """
+    return f"user:{user_id}"
+
+
+class DbmClientRepository(ClientRepository):
+    """Client credentials in a dbm file, as JSON records keyed on client id. Alongside
+    the client records, the store holds a user_id -> client_ids index for each user.
+
+    Stores from before the index and secret hashing existed are migrated on startup.
+    """
+
+    blocking = True
+
+    def __init__(self, path, model, users):
+        self.path = path
+        self.model = model
+        self.users = users
+        if dbm.whichdb(self.path):  # the file name on disk depends on the flavor
+            self.migrate()
+        else:
+            dbm.open(self.path, "c").close()
+
+    def load(self, data):
+        data = json.loads(data)
+        return self.model(
+            user=self.users.get(data["user_id"]),
+            client_id=data["client_id"],
+            client_secret_hash=data["client_secret_hash"],
+        )
+
+    def get(self, client_id):
+        with dbm.open(self.path, "r") as db:
+            data = db.get(client_id)
+        return None if data is None else self.load(data)
+
+    def for_user(self, user_id):
+        with dbm.open(self.path, "r") as db:
+            index = db.get(user_index_key(user_id))
+            client_ids = json.loads(index) if index is not None else []
+            return [self.load(db[client_id]) for client_id in client_ids]
+
+    def add(self, client):
+        data = {
+            "user_id": client.user.id,
+            "client_id": client.client_id,
+            "client_secret_hash": client.client_secret_hash,
+        }
+        key = user_index_key(client.user.id)
+        with dbm.open(self.path, "c") as db:
+            client_ids = json.loads(db[key]) if key in db else []
+            db[client.client_id] = json.dumps(data)
+            db[key] = json.dumps(client_ids + [client.client_id])
+
+    def migrate(self):
+        with dbm.open(self.path, "w") as db:
+            records = {}
+            has_index = False
+            for key in db.keys():
+                if key.startswith(b"user:"):
+                    has_index = True
+                else:
+                    records[key] = json.loads(db[key])
+            for key, data in records.items():
+                if "client_secret" in data:
+                    data["client_secret_hash"] = hash_secret(data.pop("client_secret"))
+                    db[key] = json.dumps(data)
+            if not has_index:
+                index = {}
+                for data in records.values():
+                    index.setdefault(data["user_id"], []).append(data["client_id"])
+                for user_id, client_ids in index.items():
+                    db[user_index_key(user_id)] = json.dumps(client_ids)
+
+
+class TokenRepository:
+    """Interface for OAuth2 token storage."""
+
+    blocking = False  # whether calls do I/O, see common.concurrency
+
+    def get(self, access_token):
+        raise NotImplementedError
+
+    def get_by_refresh_token(self, refresh_token):
+        raise NotImplementedError
+
+    def for_client(self, client_id):
+        """The client's tokens, oldest first."""
+        raise NotImplementedError
+
+    def add(self, token):
+        raise NotImplementedError
+
+    def remove(self, token):
+        raise NotImplementedError
+
+    def share(self, token):
+        """Mark the stored token as shared, see OAuth2Token.create_for_client."""
+        raise NotImplementedError
+
+    def reap(self, limit, now=None):
+        raise NotImplementedError
+
+
+class MemoryTokenRepository(TokenRepository):
+    """Process-local token storage.
+
+    Alongside the access and refresh token lookups, tokens are kept in a heap ordered
+    on access_token_expires_at so that reap can evict expired tokens without looking
+    at the live ones. Tokens removed by other means are left in the heap and skipped
+    when they come up.
+
+    Evicting a token also drops its refresh token, so refresh tokens are kept for
+    grace_seconds beyond the expiry of their access token.
+
+    Tokens are also indexed by client, in the order they were added, for reusing and
+    capping each client's tokens.
+    """
+
+    def __init__(self, grace_seconds=0):
+        self.grace = datetime.timedelta(seconds=grace_seconds)
+        self.access_tokens = {}
+        self.refresh_tokens = {}
+        self.client_tokens = {}  # client id -> {access token: token}
+        self.expiry_heap = []
+        self.evicted = 0
+        self.last_reap_seconds = 0.0
+        self.max_reap_seconds = 0.0
+
+    def get(self, access_token):
+        return self.access_tokens.get(access_token)
+
+    def get_by_refresh_token(self, refresh_token):
+        return self.refresh_tokens.get(refresh_token)
+
+    def for_client(self, client_id):
+        return list(self.client_tokens.get(client_id, {}).values())
+
+    def add(self, token):
+        self.access_tokens[token.access_token] = token
+        self.refresh_tokens[token.refresh_token] = token
+        self.client_tokens.setdefault(token.client_id, {})[token.access_token] = token
+        heapq.heappush(
+            self.expiry_heap, (token.access_token_expires_at, token.access_token)
+        )
+
+    def remove(self, token):
+        self.access_tokens.pop(token.access_token, None)
+        self.refresh_tokens.pop(token.refresh_token, None)
+        tokens = self.client_tokens.get(token.client_id)
+        if tokens is not None:
+            tokens.pop(token.access_token, None)
+            if not tokens:
+                del self.client_tokens[token.client_id]
+
+    def share(self, token):
+        stored = self.access_tokens.get(token.access_token)
+        if stored is not None:
+            stored.shared = True
+
+    def reap(self, limit, now=None):
+        """Evict at most limit expired tokens. Returns the number of heap entries
+        processed, which is less than limit once there is nothing left to evict.
+        """
+        started = time.perf_counter()
+        if now is None:
+            now = datetime.datetime.utcnow()
+        cutoff = now - self.grace
+        heap = self.expiry_heap
+        processed = 0
+        while heap and processed < limit and heap[0][0] <= cutoff:
+            _, access_token = heapq.heappop(heap)
+            processed += 1
+            token = self.access_tokens.get(access_token)
+            if token is not None and token.access_token_expires_at <= cutoff:
+                self.remove(token)
+                self.evicted += 1
+        self.last_reap_seconds = time.perf_counter() - started
+        self.max_reap_seconds = max(self.max_reap_seconds, self.last_reap_seconds)
+        return processed
+
+    @property
+    def stats(self):
+        return {
+            "access_tokens": len(self.access_tokens),
+            "refresh_tokens": len(self.refresh_tokens),
+            "clients": len(self.client_tokens),
+            "expiry_heap": len(self.expiry_heap),
+            "container_bytes": sys.getsizeof(self.access_tokens)
+            + sys.getsizeof(self.refresh_tokens)
+            + sys.getsizeof(self.expiry_heap),
+            "evicted": self.evicted,
+            "last_reap_seconds": self.last_reap_seconds,
+            "max_reap_seconds": self.max_reap_seconds,
+        }
+
+
+class DeniedTokenRepository:
+    """Interface for shared storage of the signed token deny-list, see common.tokens.
+    Token ids are held along with the expiry of their token, a UTC timestamp, and
+    numbered in the order they were added.
+    """
+
+    blocking = False  # whether calls do I/O, see common.concurrency
+
+    def add(self, jti, expires_at):
+        raise NotImplementedError
+
+    def since(self, seq):
+        """The (seq, jti, expires_at) of the entries added after seq, in order."""
+        raise NotImplementedError
+
+    def purge(self, now):
+        """Drop the entries of tokens that have expired by now. Returns how many."""
+        raise NotImplementedError
+
+
+class SessionRepository:
+    """Interface for server-side session storage, see common.sessions. Sessions are
+    stored as JSON strings, with their expiry time in seconds since the epoch.
+    """
+
+    blocking = False  # whether calls do I/O, see common.concurrency
+
+    def get(self, session_id):
+        """The session's (data, expires_at), or None if there is none that is
+        unexpired.
+        """
+        raise NotImplementedError
+
+    def save(self, session_id, data, expires_at):
+        raise NotImplementedError
+
+    def remove(self, session_id):
+        raise NotImplementedError
+
+    def reap(self, limit, now=None):
+        raise NotImplementedError
+
+
+class MemorySessionRepository(SessionRepository):
+    """Process-local session storage, bounded to maxsize sessions.
+
+    Sessions are kept in the order they were last saved. As every session has the
+    same lifetime, that is also the order they expire in, so expired sessions are
+    found at the front, and so are the least recently saved if there are too many.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.sessions = OrderedDict()  # session id -> (data, expires_at)
+        self.evicted = 0
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or session[1] <= time.time():
+            return None
+        return session
+
+    def save(self, session_id, data, expires_at):
+        self.sessions.pop(session_id, None)
+        self.sessions[session_id] = (data, expires_at)
+        while len(self.sessions) > self.maxsize:
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+
+    def remove(self, session_id):
+        self.sessions.pop(session_id, None)
+
+    def reap(self, limit, now=None):
+        """Evict at most limit expired sessions. Returns the number evicted."""
+        if now is None:
+            now = time.time()
+        sessions = self.sessions
+        reaped = 0
+        while sessions and reaped < limit:
+            session_id, (_, expires_at) = next(iter(sessions.items()))
+            if expires_at > now:
+                break
+            del sessions[session_id]
+            reaped += 1
+        self.evicted += reaped
+        return reaped
+
+    @property
+    def stats(self):
+        return {"sessions": len(self.sessions), "evicted": self.evicted}
@@ -0,0 +1,109 @@
+"""
+Server-side sessions. Enabled by setting SESSION_BACKEND=server.
+
+Starlette's SessionMiddleware keeps the whole session in the cookie, signed, so the
+cookie grows with the session, e.g. with queued console messages, and is decoded and
+verified on every browser request to the api. ServerSessionMiddleware instead puts a
+random session id in the cookie and keeps the session in storage, as Session: in
+the SQLite database, in the broker, or, with memory storage, in SQLite at
+SQLITE_PATH, so that the console and the api share them.
+
+A session is only written back when it has changed, or when it is half way to
+expiring, so that active sessions last SESSION_EXPIRE_SECONDS from their last use as
+cookie sessions do. The session id changes when the user does, e.g. on login.
+"""
+import json
+import secrets
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import HTTPConnection
+from common.config import settings
+from common.models import Session
+
+
+class ServerSessionMiddleware:
+    """A replacement for starlette's SessionMiddleware, taking the same options
+    except for the secret key, which an unguessable session id has no need of.
+    """
+
+    def __init__(
+        self,
+        app,
+        session_cookie="session",
+        max_age=14 * 24 * 60 * 60,
+        path="/",
+        same_site="lax",
+        https_only=False,
+    ):
+        self.app = app
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        stored = None
+        if session_id:
+            stored = await Session.aget(session_id)
+        if stored is None:
+            loaded, expires_at = None, 0
+            scope["session"] = {}
+        else:
+            loaded, expires_at = stored
+            scope["session"] = json.loads(loaded)
+        user_id = scope["session"].get("user_id")
+
+        async def send_wrapper(message):
+            nonlocal session_id
+            if message["type"] == "http.response.start":
+                session = scope["session"]
+                now = time.time()
+                if session:
+                    data = json.dumps(session)
+                    stale = expires_at - now < self.max_age / 2
+                    if data != loaded or stale:
+                        if loaded is None or session.get("user_id") != user_id:
+                            if loaded is not None:
+                                await Session.aremove(session_id)
+                            session_id = secrets.token_urlsafe(32)
+                        await Session.asave(session_id, data, now + self.max_age)
+                        self.set_cookie(message, session_id, f"Max-Age={self.max_age}")
+                elif loaded is not None:
+                    await Session.aremove(session_id)
+                    self.set_cookie(
+                        message, "null", "expires=Thu, 01 Jan 1970 00:00:00 GMT"
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def set_cookie(self, message, value, expiry):
+        MutableHeaders(scope=message).append(
+            "Set-Cookie",
+            f"{self.session_cookie}={value}; path={self.path}; {expiry}; "
+            f"{self.security_flags}",
+        )
+
+
+def session_middleware() -> Middleware:
+    """The session middleware for SESSION_BACKEND, as configured for both apps."""
+    options = {
+        "session_cookie": settings.SESSION_COOKIE,
+        "max_age": settings.SESSION_EXPIRE_SECONDS,
+        "same_site": settings.SESSION_SAME_SITE,
+        "https_only": False,
+    }
+    if settings.SESSION_BACKEND == "server":
+        return Middleware(ServerSessionMiddleware, **options)
+    if settings.SESSION_BACKEND == "cookie":
+        return Middleware(SessionMiddleware, secret_key=settings.SECRET_KEY, **options)
+    raise ValueError(f"Unknown SESSION_BACKEND: {settings.SESSION_BACKEND}")
@@ -0,0 +1,617 @@
+"""
+SQLite storage backend. Enabled by setting STORAGE_BACKEND=sqlite.
+
+Unlike the default in-memory backend, state lives in a database file that can be
+shared by the console, the api and multiple worker processes of each. The database
+runs in WAL mode so that readers do not block on writers.
+
+Repositories here implement the interfaces in common.repositories. Queries are
+constant, parameterized SQL strings so that sqlite3's per-connection statement
+cache reuses the prepared statements.
+"""
+import datetime
+import json
+import queue
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from common.repositories import (
+    ClientRepository,
+    DeniedTokenRepository,
+    SessionRepository,
+    TaskRepository,
+    TokenRepository,
+    UserRepository,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    superuser INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_user_id ON tasks (user_id, seq);
+CREATE TABLE IF NOT EXISTS clients (
+    client_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    client_secret_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clients_user_id ON clients (user_id);
+CREATE TABLE IF NOT EXISTS tokens (
+    access_token TEXT PRIMARY KEY,
+    refresh_token TEXT NOT NULL UNIQUE,
+    client_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    revoked INTEGER NOT NULL DEFAULT 0,
+    shared INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tokens_client_id ON tokens (client_id);
+CREATE INDEX IF NOT EXISTS tokens_expires_at ON tokens (expires_at);
+CREATE TABLE IF NOT EXISTS denied_tokens (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT NOT NULL UNIQUE,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS denied_tokens_expires_at ON denied_tokens (expires_at);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Columns added since their table was first created, for databases that predate them.
+MIGRATIONS = [
+    (
+        "tasks",
+        "version",
+        "ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+    ),
+    (
+        "tasks",
+        "revision",
+        "ALTER TABLE tasks ADD COLUMN revision INTEGER NOT NULL DEFAULT 0",
+    ),
+    (
+        "tokens",
+        "shared",
+        "ALTER TABLE tokens ADD COLUMN shared INTEGER NOT NULL DEFAULT 0",
+    ),
+]
+
+# Indexes on migrated columns, created after the migrations.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS tasks_user_revision ON tasks (user_id, revision);
+"""
+
+
+def to_timestamp(dt):
+    """Stored datetimes are naive UTC, as returned by datetime.utcnow."""
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def from_timestamp(ts):
+    return datetime.datetime.utcfromtimestamp(ts)
+
+
+class SQLiteDatabase:
+    """A database file with a small pool of connections.
+
+    Connections are created as needed, up to pool_size, and are shared across
+    threads one at a time. Callers block until a connection is free.
+    """
+
+    def __init__(self, path, pool_size=5, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        self.available = pool_size
+        self.lock = threading.Lock()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            self.migrate(conn)
+
+    def migrate(self, conn):
+        for table, column, sql in MIGRATIONS:
+            columns = [
+                row["name"] for row in conn.execute(f"PRAGMA table_info({table})")
+            ]
+            if column not in columns:
+                conn.execute(sql)
+        conn.executescript(INDEXES)
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.available > 0
+                if create:
+                    self.available -= 1
+            if create:
+                conn = self.connect()
+            else:
+                conn = self.pool.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def fetchone(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+
+class SQLiteUserRepository(UserRepository):
+    blocking = True
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def load(self, row):
+        if row is None:
+            return None
+        return self.model(
+            id=row["id"],
+            username=row["username"],
+            password=row["password"],
+            active=bool(row["active"]),
+            superuser=bool(row["superuser"]),
+        )
+
+    def get(self, user_id):
+        return self.load(
+            self.db.fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+        )
+
+    def get_by_username(self, username):
+        return self.load(
+            self.db.fetchone("SELECT * FROM users WHERE username = ?", (username,))
+        )
+
+    def add(self, user):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO users (id, username, password, active, superuser) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user.id, user.username, user.password, user.active, user.superuser),
+            )
+
+    def add_many(self, users):
+        """Usernames are checked for uniqueness row by row, so a batch in which e.g.
+        two users swap usernames fails at first. It is then tried again with the
+        usernames of the users being replaced first moved out of the way, to a
+        placeholder that can't be a username.
+        """
+        try:
+            self.upsert(users)
+        except sqlite3.IntegrityError:
+            try:
+                self.upsert(users, clear_usernames=True)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(str(e))
+
+    def upsert(self, users, clear_usernames=False):
+        with self.db.transaction() as conn:
+            if clear_usernames:
+                conn.executemany(
+                    "UPDATE users SET username = char(0) || id WHERE id = ?",
+                    [(u.id,) for u in users],
+                )
+            conn.executemany(
+                "INSERT INTO users (id, username, password, active, superuser) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "username = excluded.username, password = excluded.password, "
+                "active = excluded.active, superuser = excluded.superuser",
+                [(u.id, u.username, u.password, u.active, u.superuser) for u in users],
+            )
+
+    def all(self):
+        return [self.load(row) for row in self.db.fetchall("SELECT * FROM users")]
+
+
+class SQLiteTaskRepository(TaskRepository):
+    """Tasks are ordered by an autoincrement sequence, which with the
+    (user_id, seq) index makes paging through a user's tasks an index walk.
+
+    Revisions are assigned within each INSERT or UPDATE statement, which holds the
+    write lock, so concurrent writers in other processes can't take the same one. The
+    Task objects written are not updated with them. Likewise, an UPDATE only matches
+    the version of the task that was changed, so of two concurrent saves of a task,
+    the second saves nothing.
+    """
+
+    blocking = True
+    chunk_size = 500
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+        self._epoch = None
+
+    def load(self, row):
+        if row is None:
+            return None
+        return self.model(
+            id=row["id"],
+            user_id=row["user_id"],
+            description=row["description"],
+            done=bool(row["done"]),
+            version=row["version"],
+            revision=row["revision"],
+        )
+
+    def get(self, task_id):
+        return self.load(
+            self.db.fetchone("SELECT * FROM tasks WHERE id = ?", (task_id,))
+        )
+
+    def get_many(self, task_ids):
+        """The ids are passed as a single JSON array parameter so that the statement
+        does not vary with the number of ids.
+        """
+        rows = self.db.fetchall(
+            "SELECT * FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(task_ids)),),
+        )
+        return {row["id"]: self.load(row) for row in rows}
+
+    def add(self, task):
+        self.add_many([task])
+
+    def add_many(self, tasks):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (id, user_id, description, done, version, revision) "
+                "VALUES (?1, ?2, ?3, ?4, ?5, (SELECT coalesce(max(revision), 0) + 1 "
+                "FROM tasks WHERE user_id = ?2))",
+                [
+                    (task.id, task.user_id, task.description, task.done, task.version)
+                    for task in tasks
+                ],
+            )
+
+    def save(self, task):
+        return self.save_many([task])
+
+    def save_many(self, tasks):
+        with self.db.transaction() as conn:
+            saved = conn.executemany(
+                "UPDATE tasks SET description = ?2, done = ?3, version = version + 1, "
+                "revision = (SELECT coalesce(max(revision), 0) + 1 "
+                "FROM tasks WHERE user_id = ?1) WHERE id = ?4 AND version = ?5",
+                [
+                    (
+                        task.user_id,
+                        task.description,
+                        task.done,
+                        task.id,
+                        task.version - 1,
+                    )
+                    for task in tasks
+                ],
+            ).rowcount
+            if saved != len(tasks):
+                conn.rollback()
+        return saved == len(tasks)
+
+    def for_user(self, user_id, after=0, limit=None):
+        return self.page_for_user(user_id, after, limit)[0]
+
+    def page_for_user(self, user_id, after=0, limit=None):
+        """A position is the seq of the task before it, so that the (user_id, seq)
+        index finds the page directly. One more row than the limit is fetched to
+        tell whether there is a next page.
+        """
+        rows = self.db.fetchall(
+            "SELECT * FROM tasks WHERE user_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (user_id, after, -1 if limit is None else limit + 1),
+        )
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            return [self.load(row) for row in rows], rows[-1]["seq"]
+        return [self.load(row) for row in rows], None
+
+    def iter_for_user(self, user_id, after=0, limit=None):
+        """Fetches in chunks so that a connection is not held for the duration of
+        the iteration.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = (
+                self.chunk_size
+                if remaining is None
+                else min(remaining, self.chunk_size)
+            )
+            tasks, after = self.page_for_user(user_id, after, size)
+            yield from tasks
+            if after is None:
+                return
+            if remaining is not None:
+                remaining -= size
+
+    def epoch(self):
+        """Made up when the database is created, and kept in it, so that it is the
+        same for every process using the file.
+        """
+        if self._epoch is None:
+            with self.db.transaction() as conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                    (secrets.token_hex(8),),
+                )
+                self._epoch = conn.execute(
+                    "SELECT value FROM meta WHERE key = 'epoch'"
+                ).fetchone()[0]
+        return self._epoch
+
+    def latest_revision(self, user_id):
+        return self.db.fetchone(
+            "SELECT coalesce(max(revision), 0) FROM tasks WHERE user_id = ?",
+            (user_id,),
+        )[0]
+
+    def changed_since(self, user_id, revision):
+        rows = self.db.fetchall(
+            "SELECT * FROM tasks WHERE user_id = ? AND revision > ? ORDER BY seq",
+            (user_id, revision),
+        )
+        return [self.load(row) for row in rows]
+
+
+class SQLiteClientRepository(ClientRepository):
+    blocking = True
+
+    def __init__(self, db, model, users):
+        self.db = db
+        self.model = model
+        self.users = users
+
+    def load(self, row, user=None):
+        if row is None:
+            return None
+        return self.model(
+            user=user or self.users.get(row["user_id"]),
+            client_id=row["client_id"],
+            client_secret_hash=row["client_secret_hash"],
+        )
+
+    def get(self, client_id):
+        return self.load(
+            self.db.fetchone("SELECT * FROM clients WHERE client_id = ?", (client_id,))
+        )
+
+    def for_user(self, user_id):
+        rows = self.db.fetchall("SELECT * FROM clients WHERE user_id = ?", (user_id,))
+        user = self.users.get(user_id)
+        return [self.load(row, user) for row in rows]
+
+    def add(self, client):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO clients (client_id, user_id, client_secret_hash) "
+                "VALUES (?, ?, ?)",
+                (client.client_id, client.user.id, client.client_secret_hash),
+            )
+
+
+class SQLiteTokenRepository(TokenRepository):
+    """Tokens keyed on access token, with indexes on refresh token, client id and
+    expiry. Reaping deletes expired rows in batches via the expiry index.
+    """
+
+    blocking = True
+
+    def __init__(self, db, model, grace_seconds=0):
+        self.db = db
+        self.model = model
+        self.grace = grace_seconds
+        self.evicted = 0
+        self.last_reap_seconds = 0.0
+        self.max_reap_seconds = 0.0
+
+    def load(self, row):
+        if row is None:
+            return None
+        return self.model(
+            client_id=sys.intern(row["client_id"]),
+            access_token=row["access_token"],
+            refresh_token=row["refresh_token"],
+            access_token_expires_at=from_timestamp(row["expires_at"]),
+            revoked=bool(row["revoked"]),
+            shared=bool(row["shared"]),
+        )
+
+    def get(self, access_token):
+        return self.load(
+            self.db.fetchone(
+                "SELECT * FROM tokens WHERE access_token = ?", (access_token,)
+            )
+        )
+
+    def get_by_refresh_token(self, refresh_token):
+        return self.load(
+            self.db.fetchone(
+                "SELECT * FROM tokens WHERE refresh_token = ?", (refresh_token,)
+            )
+        )
+
+    def for_client(self, client_id):
+        rows = self.db.fetchall(
+            "SELECT * FROM tokens WHERE client_id = ? ORDER BY expires_at",
+            (client_id,),
+        )
+        return [self.load(row) for row in rows]
+
+    def add(self, token):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO tokens "
+                "(access_token, refresh_token, client_id, expires_at, revoked, shared) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    token.access_token,
+                    token.refresh_token,
+                    token.client_id,
+                    to_timestamp(token.access_token_expires_at),
+                    token.revoked,
+                    token.shared,
+                ),
+            )
+
+    def remove(self, token):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "DELETE FROM tokens WHERE access_token = ?", (token.access_token,)
+            )
+
+    def share(self, token):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE tokens SET shared = 1 WHERE access_token = ?",
+                (token.access_token,),
+            )
+
+    def reap(self, limit, now=None):
+        started = time.perf_counter()
+        if now is None:
+            now = datetime.datetime.utcnow()
+        cutoff = to_timestamp(now) - self.grace
+        with self.db.transaction() as conn:
+            processed = conn.execute(
+                "DELETE FROM tokens WHERE access_token IN "
+                "(SELECT access_token FROM tokens WHERE expires_at <= ? LIMIT ?)",
+                (cutoff, limit),
+            ).rowcount
+        self.evicted += processed
+        self.last_reap_seconds = time.perf_counter() - started
+        self.max_reap_seconds = max(self.max_reap_seconds, self.last_reap_seconds)
+        return processed
+
+    @property
+    def stats(self):
+        count = self.db.fetchone("SELECT count(*) FROM tokens")[0]
+        return {
+            "access_tokens": count,
+            "refresh_tokens": count,
+            "evicted": self.evicted,
+            "last_reap_seconds": self.last_reap_seconds,
+            "max_reap_seconds": self.max_reap_seconds,
+        }
+
+
+class SQLiteDeniedTokenRepository(DeniedTokenRepository):
+    """The AUTOINCREMENT sequence is never reused, so entries added after those a
+    process has seen always have a later seq, even once older entries are purged.
+    """
+
+    blocking = True
+
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, jti, expires_at):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO denied_tokens (jti, expires_at) VALUES (?, ?)",
+                (jti, expires_at),
+            )
+
+    def since(self, seq):
+        rows = self.db.fetchall(
+            "SELECT seq, jti, expires_at FROM denied_tokens WHERE seq > ? ORDER BY seq",
+            (seq,),
+        )
+        return [tuple(row) for row in rows]
+
+    def purge(self, now):
+        with self.db.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM denied_tokens WHERE expires_at <= ?", (now,)
+            ).rowcount
+
+
+class SQLiteSessionRepository(SessionRepository):
+    blocking = True
+
+    def __init__(self, db):
+        self.db = db
+        self.evicted = 0
+
+    def get(self, session_id):
+        row = self.db.fetchone(
+            "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+            (session_id, time.time()),
+        )
+        return None if row is None else (row["data"], row["expires_at"])
+
+    def save(self, session_id, data, expires_at):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, data, expires_at),
+            )
+
+    def remove(self, session_id):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def reap(self, limit, now=None):
+        if now is None:
+            now = time.time()
+        with self.db.transaction() as conn:
+            reaped = conn.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?)",
+                (now, limit),
+            ).rowcount
+        self.evicted += reaped
+        return reaped
+
+    @property
+    def stats(self):
+        count = self.db.fetchone("SELECT count(*) FROM sessions")[0]
+        return {"sessions": count, "evicted": self.evicted}
@@ -0,0 +1,117 @@
+"""
+Self-contained signed access tokens, used when ACCESS_TOKEN_FORMAT is "signed".
+
+A signed token is the base64url encoded JSON claims and an HMAC-SHA256 signature of
+them, joined by a ".". The claims carry the client id (cid), user id (uid), scope,
+expiry (exp, a UTC timestamp) and a token id (jti). Verifying a token is then a CPU
+check that needs no token store, so tokens remain valid across restarts and worker
+processes.
+
+Tokens revoked before they expire are recorded in a deny-list of token id -> expiry,
+which only needs to hold entries until the tokens would have expired anyway. The
+deny-list is checked in process. With the broker, revocations are relayed to every
+worker. With SQLite, they are written to the database, from which every worker picks
+them up within DENY_LIST_SYNC_SECONDS.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from common.config import settings
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def signing_key() -> bytes:
+    return (settings.TOKEN_SIGNING_KEY or settings.SECRET_KEY).encode()
+
+
+def signature(body: str) -> str:
+    return b64encode(hmac.new(signing_key(), body.encode(), hashlib.sha256).digest())
+
+
+def sign_access_token(client, expires: datetime.datetime, scope: str = "api") -> str:
+    claims = {
+        "jti": secrets.token_urlsafe(12),
+        "cid": client.client_id,
+        "uid": client.user.id,
+        "scope": scope,
+        "exp": int(expires.replace(tzinfo=datetime.timezone.utc).timestamp()),
+    }
+    body = b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{body}.{signature(body)}"
+
+
+def read_access_token(token: str) -> dict | None:
+    """Get the claims of a validly signed token, regardless of expiry."""
+    body, _, sig = token.partition(".")
+    if not hmac.compare_digest(sig.encode(), signature(body).encode()):
+        return None
+    try:
+        return json.loads(b64decode(body))
+    except ValueError:
+        return None
+
+
+def verify_access_token(token: str) -> dict | None:
+    """Get the claims of a valid, unexpired and unrevoked token, or None."""
+    claims = read_access_token(token)
+    if claims is None or claims["exp"] <= time.time() or claims["jti"] in denied:
+        return None
+    return claims
+
+
+class DenyList:
+    """Revoked token ids, held until the tokens expire. If repository is set, entries
+    are also added to it, and sync adds those added by other processes.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.relay = None  # adds via a broker instead, see common.broker
+        self.repository = None  # see common.repositories.DeniedTokenRepository
+        self.synced = 0
+
+    def add(self, jti: str, exp: float):
+        self.entries[jti] = exp
+        if self.repository is not None:
+            self.repository.add(jti, exp)
+
+    def sync(self):
+        for seq, jti, exp in self.repository.since(self.synced):
+            self.entries[jti] = exp
+            self.synced = seq
+
+    def __contains__(self, jti):
+        return jti in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def purge(self, now=None):
+        now = now or time.time()
+        expired = [jti for jti, exp in list(self.entries.items()) if exp <= now]
+        for jti in expired:
+            del self.entries[jti]
+        return len(expired)
+
+
+denied = DenyList()
+
+
+def deny_access_token(token: str):
+    claims = read_access_token(token)
+    if claims is not None and claims["exp"] > time.time():
+        if denied.relay is not None:
+            denied.relay(claims["jti"], claims["exp"])
+        else:
+            denied.add(claims["jti"], claims["exp"])
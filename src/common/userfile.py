@@ -0,0 +1,39 @@
+"""
+Reading a user directory for bulk loading, see User.load_file. Users are read from
+either a JSON Lines file, with one object per line with the fields of User, or from
+the users table of an SQLite database with the same columns, e.g. one exported from
+another deployment.
+"""
+import json
+import sqlite3
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+COLUMNS = ("id", "username", "password", "active", "superuser")
+
+
+def read_users(path):
+    """Yields a dict of User fields for each user in the file."""
+    if str(path).endswith(SQLITE_SUFFIXES):
+        yield from read_sqlite(path)
+    else:
+        yield from read_jsonl(path)
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_sqlite(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for row in conn.execute(f"SELECT {', '.join(COLUMNS)} FROM users"):
+            user = dict(zip(COLUMNS, row))
+            user["active"] = bool(user["active"])
+            user["superuser"] = bool(user["superuser"])
+            yield user
+    finally:
+        conn.close()
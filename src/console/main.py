@@ -2,27 +2,29 @@ from asgi_csrf import asgi_csrf
 from starlette.applications import Starlette
 from starlette.authentication import requires
 from starlette.middleware.authentication import AuthenticationMiddleware
-from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import RedirectResponse
+from starlette.responses import PlainTextResponse, RedirectResponse
 from starlette.requests import Request
 from starlette.routing import Route
 from common.backends import SessionAuthBackend
+from common.concurrency import offload
 from common.config import settings
-from common.models import OAuth2Client
+from common.metrics import HandlerLabelMiddleware, MetricsMiddleware, registry
+from common.models import OAuth2Client, Task, User
+from common.sessions import session_middleware
 from .forms import LoginForm
-from .templating import render
+from .templating import render, templates
 from . import messages
 
 
 async def homepage(request: Request):
-    return render("home.html", {})
+    return render(request, "home.html", {})
 
 
 async def login(request):
     data = await request.form()
     form = LoginForm(request, formdata=data, meta={"csrf_context": request.session})
     if request.method == "POST":
-        user = form.validate()
+        user = await offload(User.repository, form.validate)
         print("validated user:", user)
         if user:
             request.session["username"] = user.username
@@ -31,6 +33,7 @@ async def login(request):
             next = request.query_params.get("next", "/")
             return RedirectResponse(url=next, status_code=302)
     return render(
+        request,
         "login.html",
         {
             "form": form,
@@ -51,24 +54,56 @@ def logout(request):
 @requires("app_auth")
 def app_clients(request):
     # TODO: We might consider fetching the clients via API
+    new_client = None
+    if request.method == "POST":
+        client, secret = OAuth2Client.create(request.user)
+        new_client = {"client_id": client.client_id, "client_secret": secret}
     clients = OAuth2Client.get_for_user(request.user)
-    return render("apps.html", {"clients": clients})
+    return render(request, "apps.html", {"clients": clients, "new_client": new_client})
 
 
 @requires("app_auth")
-def tasks(request):
-    return render("tasks.html", {})
+async def tasks(request):
+    """The task list is rendered here, rather than fetched from the api by the page,
+    so that it shows without waiting on a second request. The revision it was read
+    at is passed to the page, which asks the api for anything changed since.
+
+    That needs storage shared with the api. Memory storage isn't, so then the page
+    fetches the tasks from the api itself.
+    """
+    if settings.STORAGE_BACKEND == "memory":
+        return render(request, "tasks.html", {"tasks": [], "bootstrap": None})
+    revision = await Task.alatest_revision(request.user)
+    tasks = await Task.afor_user(request.user)
+    bootstrap = {
+        "tasks": [
+            {"id": task.id, "description": task.description, "done": task.done}
+            for task in tasks
+        ],
+        "revision": revision,
+    }
+    return render(request, "tasks.html", {"tasks": tasks, "bootstrap": bootstrap})
+
+
+async def metrics(request):
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 routes = [
     Route("/", homepage, name="home", methods=["GET", "POST"]),
-    Route("/apps", app_clients, name="apps", methods=["GET"]),
+    Route("/apps", app_clients, name="apps", methods=["GET", "POST"]),
     Route("/login", login, name="login", methods=["GET", "POST"]),
     Route("/logout", logout, name="logout", methods=["GET"]),
     Route("/tasks", tasks, name="tasks", methods=["GET"]),
 ]
 
-app = Starlette(debug=True, routes=routes)
+if settings.METRICS_ENABLED:
+    routes.append(Route("/metrics", metrics, name="metrics", methods=["GET"]))
+
+app = Starlette(debug=True, routes=routes, on_startup=[templates.precompile])
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(HandlerLabelMiddleware)
 
 app.add_middleware(asgi_csrf, signing_secret=settings.CSRF_KEY, always_set_cookie=True)
 
@@ -76,11 +111,9 @@ app.add_middleware(asgi_csrf, signing_secret=settings.CSRF_KEY, always_set_cooki
 app.add_middleware(AuthenticationMiddleware, backend=SessionAuthBackend())
 
 
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=settings.SECRET_KEY,
-    session_cookie=settings.SESSION_COOKIE,
-    max_age=settings.SESSION_EXPIRE_SECONDS,
-    same_site=settings.SESSION_SAME_SITE,
-    https_only=False,
-)
+sessions = session_middleware()
+app.add_middleware(sessions.cls, **sessions.options)
+
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, name="console")
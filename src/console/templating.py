@@ -1,41 +1,38 @@
 """
-Custom template renderer that injects the request object into the context and
-sets a clear_messages function on the request for session message handling.
+Template rendering for the console. Handlers pass the request to render explicitly,
+and templates can call clear_messages() for session message handling.
+
+Compiled templates are kept in a Jinja bytecode cache on disk, in TEMPLATE_CACHE_DIR,
+so that they are compiled once rather than by every worker on every start. All the
+templates are loaded on startup, so that no request waits for one to be.
 """
-import inspect
-import types
 import jinja2
 from starlette.requests import Request
 from starlette.templating import Jinja2Templates
-from .messages import clear_messages
+from common.config import settings
+from . import messages
+
+
+@jinja2.pass_context
+def clear_messages(context, key=None):
+    return messages.clear_messages(context["request"], key)
 
 
 class Templates(Jinja2Templates):
     """Custom Template handler."""
 
-    def TemplateResponse(self, name: str, context: dict, **kwargs):
-        """Render a template response.
-
-        If it exists and is not already set in the context, injects the
-        request object from the calling scope into the template context.
-
-        Adds a clear_request method to the request instance.
-        """
-        if "request" in context:
-            req = context["request"]
-            if isinstance(req, Request):
-                req.clear_messages = types.MethodType(clear_messages, req)
-        else:
-            frame = inspect.currentframe()
-            try:
-                _locals = frame.f_back.f_locals
-                req = _locals.get("request")
-                if req is not None and isinstance(req, Request):
-                    context["request"] = req
-                    req.clear_messages = types.MethodType(clear_messages, req)
-            finally:
-                del frame
-        return super().TemplateResponse(name, context, **kwargs)
-
-
-render = Templates(directory="templates").TemplateResponse
+    def precompile(self):
+        for name in self.env.list_templates():
+            self.env.get_template(name)
+
+
+templates = Templates(
+    "templates",
+    bytecode_cache=jinja2.FileSystemBytecodeCache(settings.TEMPLATE_CACHE_DIR),
+)
+templates.env.globals["clear_messages"] = clear_messages
+
+
+def render(request: Request, name: str, context: dict, **kwargs):
+    """Render a template response, with the request in the template context."""
+    return templates.TemplateResponse(name, dict(context, request=request), **kwargs)
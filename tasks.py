@@ -1,19 +1,21 @@
+import asyncio
 import base64
 import dbm
+import functools
+import http.cookiejar
 import json
 import logging
 import os
 import sys
+import time
 import urllib
 import urllib.parse
-import oauthlib
-import requests
+from typing import List
 import typer
 from pathlib import Path
-from cryptography.fernet import Fernet
-from requests_oauthlib import OAuth2Session
-from oauthlib.oauth2 import BackendApplicationClient
-from oauthlib.oauth2.rfc6749.errors import MissingTokenError
+
+# requests, oauthlib, cryptography and httpx are imported where they are used, so
+# that commands like --help, which never make a request, don't wait on them.
 
 
 logger = logging.getLogger("apifirstexample")
@@ -35,6 +37,60 @@ class MissingToken(Exception):
 KEY_DB = Path(__file__).parent / ".key"
 
 
+@functools.lru_cache(maxsize=None)
+def fernet(key: str) -> "Fernet":
+    from cryptography.fernet import Fernet
+    key = key + "=" * (len(key) % 4)
+    _key = base64.urlsafe_b64encode(base64.urlsafe_b64decode(key))
+    return Fernet(_key)
+
+
+def missing_token_errors() -> tuple:
+    from oauthlib.oauth2.rfc6749.errors import MissingTokenError
+    return (MissingTokenError, MissingToken)
+
+
+class SavedToken:
+    """A client's token, kept in the .key file between runs, encrypted with the
+    client's secret. APIClient and AsyncAPIClient share it this way.
+    """
+
+    def __init__(self, app_id: str, app_secret: str):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.token = None  # as last loaded or saved, to skip saving it unchanged
+
+    def encrypt(self, data: str) -> bytes:
+        return fernet(self.app_secret).encrypt(data.encode())
+
+    def decrypt(self, data: bytes) -> bytes:
+        return fernet(self.app_secret).decrypt(data)
+
+    def save(self, token: dict) -> None:
+        if token == self.token:
+            return
+        logger.debug("SAVING TOKEN: %s" % str(token))
+        data = json.dumps(token)
+        _t = self.encrypt(data)
+        with dbm.open(KEY_DB.as_posix(), "c") as db:
+            db[self.app_id] = _t
+        self.token = token
+
+    def load(self) -> dict:
+        """Raises KeyError if there is no saved token."""
+        with dbm.open(KEY_DB.as_posix(), "c") as db:
+            _token = db[self.app_id]
+        token = json.loads(self.decrypt(_token))
+        self.token = token
+        return token
+
+    def clear(self) -> None:
+        with dbm.open(KEY_DB.as_posix(), "c") as db:
+            if self.app_id in db:
+                del db[self.app_id]
+        self.token = None
+
+
 class APIClient:
 
     API_ROOT = os.environ.get("API_ROOT", "http://localhost:5000")  # localhost for development purposes. Requires
@@ -46,6 +102,7 @@ class APIClient:
     def __init__(self, app_id: str, app_secret: str):
         self.app_id = app_id
         self.app_secret = app_secret
+        self.saved_token = SavedToken(app_id, app_secret)
         try:
             token = self.load_saved_token()
         except KeyError:
@@ -53,7 +110,8 @@ class APIClient:
             self.token_saver(token)
         self.client = self.create_client_for_token(token)
 
-    def create_client_for_token(self, token: dict) -> OAuth2Session:
+    def create_client_for_token(self, token: dict) -> "OAuth2Session":
+        from requests_oauthlib import OAuth2Session
         return OAuth2Session(
             self.app_id,
             token=token,
@@ -62,31 +120,25 @@ class APIClient:
             token_updater=self.token_saver,
         )
 
-    def fernet(self, key: str) -> Fernet:
-        key = key + "=" * (len(key) % 4)
-        _key = base64.urlsafe_b64encode(base64.urlsafe_b64decode(key))
-        return Fernet(_key)
+    def fernet(self, key: str) -> "Fernet":
+        return fernet(key)
 
     def encrypt(self, data: str) -> bytes:
-        return self.fernet(self.app_secret).encrypt(data.encode())
+        return self.saved_token.encrypt(data)
 
     def decrypt(self, data: bytes) -> bytes:
-        return self.fernet(self.app_secret).decrypt(data)
+        return self.saved_token.decrypt(data)
 
     def token_saver(self, token: dict) -> None:
-        logger.debug("SAVING TOKEN: %s" % str(token))
-        data = json.dumps(token)
-        _t = self.encrypt(data)
-        with dbm.open(KEY_DB.as_posix(), "c") as db:
-            db[self.app_id] = _t
+        self.saved_token.save(token)
 
     def load_saved_token(self) -> dict:
-        with dbm.open(KEY_DB.as_posix(), "c") as db:
-            _token = db[self.app_id]
-        token = json.loads(self.decrypt(_token))
-        return token
+        return self.saved_token.load()
 
     def fetch_api_token(self) -> dict:
+        from oauthlib.oauth2 import BackendApplicationClient
+        from oauthlib.oauth2.rfc6749.errors import MissingTokenError
+        from requests_oauthlib import OAuth2Session
         backend = BackendApplicationClient(client_id=self.app_id)
         oauth = OAuth2Session(client=backend)
         try:
@@ -103,9 +155,7 @@ class APIClient:
         return token
 
     def clear_saved_token(self) -> None:
-        with dbm.open(KEY_DB.as_posix(), "c") as db:
-            if self.app_id in db:
-                del db[self.app_id]
+        self.saved_token.clear()
 
     def reset(self):
         self.clear_saved_token()
@@ -115,7 +165,7 @@ class APIClient:
 
     ### Dispatch methods ###
 
-    def get(self, path:str, **query) -> requests.Response:
+    def get(self, path:str, **query) -> "requests.Response":
         url = f"{self.API_ROOT}{path}"
         if query:
             querystr = urllib.parse.urlencode(query)
@@ -123,87 +173,448 @@ class APIClient:
         logger.debug(f"GETing URL {url}")
         try:
             return self.client.get(url)
-        except (oauthlib.oauth2.rfc6749.errors.MissingTokenError, MissingToken):
+        except missing_token_errors():
             self.reset()
             return self.client.get(url)
 
-    def post(self, path:str, data:dict) -> requests.Response:
+    def post(self, path:str, data:dict) -> "requests.Response":
         url = f"{self.API_ROOT}{path}"
         logger.debug(f"POSTing URL {url}")
         try:
             resp = self.client.post(url, json=data)
             return resp
-        except (oauthlib.oauth2.rfc6749.errors.MissingTokenError, MissingToken):
+        except missing_token_errors():
             self.reset()
             resp = self.client.post(url, json=data)
             return resp
 
-    def put(self, path:str, data:dict) -> requests.Response:
+    def put(self, path:str, data:dict) -> "requests.Response":
         url = f"{self.API_ROOT}{path}"
         logger.debug(f"PUTing URL {url}")
         try:
             resp = self.client.put(url, json=data)
             return resp
-        except (oauthlib.oauth2.rfc6749.errors.MissingTokenError, MissingToken):
+        except missing_token_errors():
             self.reset()
             resp = self.client.post(url, json=data)
             return resp
 
+    def patch(self, path:str, data:dict) -> "requests.Response":
+        url = f"{self.API_ROOT}{path}"
+        logger.debug(f"PATCHing URL {url}")
+        try:
+            resp = self.client.patch(url, json=data)
+            return resp
+        except missing_token_errors():
+            self.reset()
+            resp = self.client.patch(url, json=data)
+            return resp
+
+
+class AsyncAPIClient:
+    """An asyncio version of APIClient for scripts that make many calls, e.g.
+
+        async with AsyncAPIClient(client_id, client_secret) as api:
+            await asyncio.gather(*[ api.post("/tasks", task) for task in tasks ])
+
+    Requests go over a pool of up to max_connections keep-alive connections, and at
+    most concurrency of them are in flight at once, so a large gather like the one
+    above queues rather than opening a connection per call.
+
+    Tokens are shared with APIClient via the .key file. When the token expires, or
+    requests fail with a 401 or 403, the first request to notice refreshes it and the
+    others wait for that refresh rather than making their own.
+
+    Cookies are refused, since the API would otherwise treat requests as coming
+    from a browser and apply session and CSRF handling to them.
+    """
+
+    API_ROOT = APIClient.API_ROOT
+    TOKEN_URL = APIClient.TOKEN_URL
+    REFRESH_URL = APIClient.REFRESH_URL
+    EXPIRY_LEEWAY_SECONDS = 10
+
+    def __init__(self, app_id: str, app_secret: str, max_connections: int = 20,
+            concurrency: int = 20):
+        import httpx
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.saved_token = SavedToken(app_id, app_secret)
+        self.http = httpx.AsyncClient(
+            base_url=self.API_ROOT,
+            cookies=http.cookiejar.CookieJar(
+                http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30,
+            ),
+        )
+        self.slots = asyncio.Semaphore(concurrency)
+        self.token_lock = asyncio.Lock()
+        try:
+            self.token = self.saved_token.load()
+        except KeyError:
+            self.token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def request_token(self, url: str, data: dict) -> dict | None:
+        resp = await self.http.post(url, data=data)
+        if resp.status_code != 200:
+            return None
+        token = resp.json()
+        token["expires_at"] = time.time() + token["expires_in"]
+        return token
+
+    async def fetch_api_token(self) -> dict:
+        token = await self.request_token(self.TOKEN_URL, {
+            "grant_type": "client_credentials",
+            "client_id": self.app_id,
+            "client_secret": self.app_secret,
+        })
+        if token is None:
+            print("Something went wrong, please check your client credentials.")
+            raise Unauthorized(self.app_id)
+        return token
+
+    async def renew_token(self, stale: dict | None) -> None:
+        """Replace the stale token, unless another request already has."""
+        async with self.token_lock:
+            if self.token is not stale:
+                return
+            token = None
+            if stale is not None:
+                token = await self.request_token(self.REFRESH_URL, {
+                    "grant_type": "refresh_token",
+                    "refresh_token": stale["refresh_token"],
+                })
+            if token is None:
+                token = await self.fetch_api_token()
+            self.saved_token.save(token)
+            self.token = token
+
+    async def reset(self):
+        self.saved_token.clear()
+        async with self.token_lock:
+            self.token = await self.fetch_api_token()
+            self.saved_token.save(self.token)
+
+    def expired(self, token: dict | None) -> bool:
+        return (token is None
+            or token.get("expires_at", 0) < time.time() + self.EXPIRY_LEEWAY_SECONDS)
+
+    async def request(self, method: str, path: str, **kwargs) -> "httpx.Response":
+        async with self.slots:
+            token = self.token
+            if self.expired(token):
+                await self.renew_token(token)
+                token = self.token
+            headers = { "Authorization": f"Bearer {token['access_token']}" }
+            resp = await self.http.request(method, path, headers=headers, **kwargs)
+            if resp.status_code in (401, 403):
+                await self.renew_token(token)
+                headers = { "Authorization": f"Bearer {self.token['access_token']}" }
+                resp = await self.http.request(method, path, headers=headers, **kwargs)
+            return resp
+
+    ### Dispatch methods ###
+
+    async def get(self, path:str, **query) -> "httpx.Response":
+        logger.debug(f"GETing URL {path}")
+        return await self.request("GET", path, params=query)
+
+    async def post(self, path:str, data:dict) -> "httpx.Response":
+        logger.debug(f"POSTing URL {path}")
+        return await self.request("POST", path, json=data)
+
+    async def put(self, path:str, data:dict) -> "httpx.Response":
+        logger.debug(f"PUTing URL {path}")
+        return await self.request("PUT", path, json=data)
+
+    async def patch(self, path:str, data:dict) -> "httpx.Response":
+        logger.debug(f"PATCHing URL {path}")
+        return await self.request("PATCH", path, json=data)
+
+class TaskCache:
+    """The user's tasks as of the last sync, and the changes made to them locally
+    since, in an SQLite database next to the .key file. Commands read and change the
+    cache, and sync sends the changes and fetches what changed on the server.
+
+    Rows are numbered by position, which follows the server's creation order for
+    synced tasks. A pending row is a change yet to be sent: a new task if it has no
+    id yet, otherwise a change to its done status.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        position INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id TEXT NOT NULL,
+        id TEXT,
+        description TEXT NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0,
+        pending INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (client_id, id)
+    );
+    CREATE TABLE IF NOT EXISTS sync (
+        client_id TEXT PRIMARY KEY,
+        revision TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path: Path, client_id: str):
+        import sqlite3
+        self.client_id = client_id
+        self.db = sqlite3.connect(path.as_posix())
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(self.SCHEMA)
+
+    def tasks(self) -> list:
+        return self.db.execute(
+            "SELECT * FROM tasks WHERE client_id = ? ORDER BY position",
+            (self.client_id,)).fetchall()
+
+    @property
+    def revision(self) -> str | None:
+        """The server's task revision as of the last sync, or None if never synced.
+        Revisions saved before they had an epoch, plain numbers, count as never synced.
+        """
+        row = self.db.execute("SELECT revision FROM sync WHERE client_id = ?",
+            (self.client_id,)).fetchone()
+        if row is None or ":" not in str(row["revision"]):
+            return None
+        return row["revision"]
+
+    def add(self, descriptions: List[str]) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO tasks (client_id, description, pending) VALUES (?, ?, 1)",
+                [ (self.client_id, d) for d in descriptions ])
+
+    def set_done(self, numbers: List[int], done: bool) -> dict:
+        """Returns the changed tasks by number."""
+        wanted = set(numbers)
+        tasks = { i: row for i, row in enumerate(self.tasks(), start=1) if i in wanted }
+        with self.db:
+            self.db.executemany(
+                "UPDATE tasks SET done = ?, pending = 1 WHERE position = ?",
+                [ (done, row["position"]) for row in tasks.values() ])
+        return tasks
+
+    def pending_creates(self) -> list:
+        return self.db.execute(
+            "SELECT * FROM tasks WHERE client_id = ? AND pending AND id IS NULL "
+            "ORDER BY position", (self.client_id,)).fetchall()
+
+    def pending_updates(self) -> list:
+        return self.db.execute(
+            "SELECT * FROM tasks WHERE client_id = ? AND pending AND id IS NOT NULL "
+            "ORDER BY position", (self.client_id,)).fetchall()
+
+    def created(self, rows: list, ids: List[str]) -> None:
+        """Record the ids of newly created tasks. Those marked done locally remain
+        pending, as they were created undone.
+        """
+        with self.db:
+            self.db.executemany(
+                "UPDATE tasks SET id = ?, pending = done WHERE position = ?",
+                [ (_id, row["position"]) for row, _id in zip(rows, ids) ])
+
+    def sent(self, rows: list) -> None:
+        with self.db:
+            self.db.executemany("UPDATE tasks SET pending = 0 WHERE position = ?",
+                [ (row["position"],) for row in rows ])
+
+    def discard(self, ids: set) -> None:
+        with self.db:
+            self.db.executemany("DELETE FROM tasks WHERE client_id = ? AND id = ?",
+                [ (self.client_id, _id) for _id in ids ])
+
+    def apply(self, tasks: List[dict], revision: str, replace: bool = False) -> None:
+        """Store tasks from the server, new ones at the end, and the revision they are
+        as of. With replace, they are all of the user's tasks, and any others are
+        dropped along with any pending changes to them.
+        """
+        with self.db:
+            if replace:
+                self.db.execute(
+                    "DELETE FROM tasks WHERE client_id = ? AND id IS NOT NULL",
+                    (self.client_id,))
+            self.db.executemany(
+                "INSERT INTO tasks (client_id, id, description, done) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (client_id, id) DO UPDATE SET "
+                "description = excluded.description, done = excluded.done "
+                "WHERE NOT pending",
+                [ (self.client_id, t["id"], t["description"], t["done"]) for t in tasks ])
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync (client_id, revision) VALUES (?, ?)",
+                (self.client_id, revision))
+
+
 ### CLI app
 
-client_id = os.environ["CLIENT_ID"]
-client_secret = os.environ["CLIENT_SECRET"]
-client = APIClient(client_id, client_secret)
+@functools.lru_cache(maxsize=None)
+def api() -> APIClient:
+    """The client, created on first use, so that --help needs no credentials and
+    reads no token.
+    """
+    return APIClient(os.environ["CLIENT_ID"], os.environ["CLIENT_SECRET"])
+
+
+@functools.lru_cache(maxsize=None)
+def cache() -> TaskCache:
+    return TaskCache(TASK_DB, os.environ["CLIENT_ID"])
+
+
 app = typer.Typer()
 
 
+PAGE_SIZE = 100
+BATCH_SIZE = 1000 # the API's limit on items per batch request
+TASK_DB = Path(__file__).parent / ".tasks.db"
+
+
+def fetch_all_tasks() -> tuple:
+    """Get all of the user's tasks, fetching pages by following cursors, and the
+    revision they are as of.
+    """
+    query = { "limit": PAGE_SIZE }
+    tasks = []
+    revision = None
+    while True:
+        r = api().get("/tasks", **query)
+        if r.status_code != 200:
+            raise InvalidRequest(r.json())
+        data = r.json()
+        tasks.extend(data["tasks"])
+        if revision is None:
+            revision = data["revision"]  # the first page's, which is the earliest
+        if not data.get("next_cursor"):
+            return tasks, revision
+        query["cursor"] = data["next_cursor"]
+
+
+def push():
+    """Send the changes made locally, in batches."""
+    rows = cache().pending_creates()
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = rows[i:i + BATCH_SIZE]
+        r = api().post("/tasks/batch", { "tasks": [ { "description": row["description"] } for row in batch ] })
+        if r.status_code != 201:
+            raise InvalidRequest(r.json())
+        cache().created(batch, [ result["id"] for result in r.json()["results"] ])
+    rows = cache().pending_updates()
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = rows[i:i + BATCH_SIZE]
+        while batch:
+            patches = [ { "id": row["id"], "done": bool(row["done"]) } for row in batch ]
+            r = api().patch("/tasks/batch", { "tasks": patches })
+            if r.status_code == 404:  # gone from the server, so drop them and retry
+                missing = { result["id"] for result in r.json()["results"] if result["status"] == 404 }
+                cache().discard(missing)
+                batch = [ row for row in batch if row["id"] not in missing ]
+                continue
+            if r.status_code != 200:
+                raise InvalidRequest(r.json())
+            cache().sent(batch)
+            break
+
+
+def pull():
+    """Fetch the tasks that changed since the last sync, or all of them the first
+    time, or if the server's tasks have been replaced since (a 410).
+    """
+    since = cache().revision
+    if since is not None:
+        r = api().get("/tasks", since=since)
+        if r.status_code == 200:
+            data = r.json()
+            cache().apply(data["tasks"], data["revision"])
+            return
+        if r.status_code != 410:
+            raise InvalidRequest(r.json())
+    tasks, revision = fetch_all_tasks()
+    cache().apply(tasks, revision, replace=True)
+
+
+def sync() -> bool:
+    """Send local changes and fetch remote ones. Returns False if that failed, e.g.
+    because the API could not be reached, in which case local changes are kept to
+    send next time.
+    """
+    import requests
+    try:
+        push()
+        pull()
+    except requests.exceptions.ConnectionError:
+        print("Working offline, changes will be sent next time.")
+        return False
+    except InvalidRequest as e:
+        print(e.args[0])
+        return False
+    return True
+
+
+def set_done(numbers: List[int], done: bool):
+    """Update the done status of the numbered tasks, sending the changes in a single
+    batch request.
+    """
+    tasks = cache().set_done(numbers, done)
+    for number in numbers:
+        if number not in tasks:
+            print(f"Task #{number} does not exist.")
+    if not tasks:
+        return
+    sync()
+    for number, task in tasks.items():
+        print("☑" if done else "☐", f"{number}.", task["description"])
+
+
 @app.command()
 def list():
-    """List tasks."""
-    r = client.get("/tasks")
-    if r.status_code == 200:
-        for i, task in enumerate(r.json()["tasks"], start=1):
-            done = "☑" if task["done"] else "☐"
-            print(done, f"{i}.", task["description"])
-    else:
-        print(r.json())
+    """List tasks. Those marked * have changes that are yet to be sent."""
+    sync()
+    for i, task in enumerate(cache().tasks(), start=1):
+        done = "☑" if task["done"] else "☐"
+        pending = " *" if task["pending"] else ""
+        print(done, f"{i}.", task["description"] + pending)
 
 
 @app.command()
 def new(description: str):
     """Create a new task."""
-    r = client.post("/tasks", { "description": description })
-    print(r.json())
+    cache().add([description])
+    sync()
+    print(f"Created task #{len(cache().tasks())}.")
+
+
+@app.command("import")
+def import_tasks(file: Path):
+    """Create a task for each non-blank line of FILE."""
+    with file.open() as f:
+        descriptions = [ line.strip() for line in f if line.strip() ]
+    cache().add(descriptions)
+    sync()
+    print(f"Imported {len(descriptions)} tasks.")
 
 
 @app.command()
-def do(number: int):
-    """Mark a task as done."""
-    r = client.get("/tasks")
-    tasks = { i:task for i, task in enumerate(r.json()["tasks"], start=1) }
-    try:
-        task = tasks[number]
-    except KeyError:
-        print(f"Task #{number} does not exist.")
-        return
-    task["done"] = True
-    r = client.put(f"/tasks/{task['id']}", task)
-    print(r.json())
+def do(numbers: List[int]):
+    """Mark tasks as done, e.g. do 1 3 7"""
+    set_done(numbers, True)
     
 
 @app.command()
-def undo(number: int):
-    """Mark a task as not done."""
-    r = client.get("/tasks")
-    tasks = { i:task for i, task in enumerate(r.json()["tasks"], start=1) }
-    try:
-        task = tasks[number]
-    except KeyError:
-        print(f"Task #{number} does not exist.")
-        return
-    task["done"] = False
-    r = client.put(f"/tasks/{task['id']}", task)
-    print(r.json())
+def undo(numbers: List[int]):
+    """Mark tasks as not done."""
+    set_done(numbers, False)
 
 
 @app.command()
@@ -211,7 +622,7 @@ def reset():
     """Clear out the existing access token. Normally should not be needed, but can
     be useful for development if the access tokens are not stable on the server.
     """
-    client.reset()
+    api().reset()
     
     
     
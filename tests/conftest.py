@@ -0,0 +1,33 @@
+"""
+The tests import the app modules from src, as the apps run there, with in-memory
+storage. Files the storage creates, e.g. the client credentials store, go in a
+temporary directory.
+"""
+import base64
+import json
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+os.environ.setdefault("CSRF_KEY", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ["STORAGE_BACKEND"] = "memory"
+os.chdir(tempfile.mkdtemp())
+
+
+@pytest.fixture
+def session_cookie():
+    """Makes a cookie session as starlette's SessionMiddleware signs them, to make
+    requests as a user logged in to the console.
+    """
+    from itsdangerous import TimestampSigner
+    from common.config import settings
+
+    def make(session):
+        data = base64.b64encode(json.dumps(session).encode())
+        value = TimestampSigner(str(settings.SECRET_KEY)).sign(data).decode()
+        return {settings.SESSION_COOKIE: value}
+
+    return make
@@ -0,0 +1,25 @@
+from starlette.testclient import TestClient
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, User
+
+
+def test_clients_lists_only_client_ids(session_cookie):
+    user = User.get(2)
+    client, _ = OAuth2Client.create(user)
+    with TestClient(app) as http:
+        r = http.get("/clients", cookies=session_cookie({"user_id": user.id}))
+    assert r.status_code == 200
+    clients = r.json()["clients"]
+    assert {"client_id": client.client_id} in clients
+    assert all(list(c) == ["client_id"] for c in clients)
+
+
+def test_clients_needs_a_console_session():
+    """Client credentials are not listed to holders of an access token, see the
+    app_auth scope on /clients.
+    """
+    client, _ = OAuth2Client.create(User.get(2))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    with TestClient(app) as http:
+        http.headers["Authorization"] = f"Bearer {token.access_token}"
+        assert http.get("/clients").status_code == 403
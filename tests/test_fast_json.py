@@ -0,0 +1,70 @@
+import pytest
+from starlette.testclient import TestClient
+from api.main import app
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from common.repositories import MemoryTaskRepository
+
+
+@pytest.fixture
+def http(monkeypatch):
+    monkeypatch.setattr(Task, "repository", MemoryTaskRepository())
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    with TestClient(app) as http:
+        http.headers["Authorization"] = f"Bearer {token.access_token}"
+        yield http
+
+
+def both_ways(monkeypatch, request):
+    """The responses to request with FAST_JSON_ENABLED off and then on."""
+    responses = []
+    for enabled in (False, True):
+        monkeypatch.setattr(settings, "FAST_JSON_ENABLED", enabled)
+        responses.append(request())
+    return responses
+
+
+def assert_same(validated, fast):
+    assert fast.status_code == validated.status_code
+    assert fast.headers.get("ETag") == validated.headers.get("ETag")
+    assert fast.content == validated.content
+
+
+def test_task_list_pages_are_the_same(http, monkeypatch):
+    user = User.get(1)
+    Task.create_many(user, ["one", "twö", 'with "quotes"'])
+    first = both_ways(monkeypatch, lambda: http.get("/tasks", params={"limit": 2}))
+    assert_same(*first)
+    body = first[0].json()
+    assert body["next_cursor"] is not None and ":" in body["revision"]
+    cursor = body["next_cursor"]
+    assert_same(
+        *both_ways(
+            monkeypatch,
+            lambda: http.get("/tasks", params={"limit": 2, "cursor": cursor}),
+        )
+    )
+    assert_same(*both_ways(monkeypatch, lambda: http.get("/tasks")))
+    since = body["revision"]
+    Task.create(user, "three")
+    assert_same(
+        *both_ways(monkeypatch, lambda: http.get("/tasks", params={"since": since}))
+    )
+
+
+def test_single_task_responses_are_the_same(http, monkeypatch):
+    validated, fast = both_ways(
+        monkeypatch, lambda: http.post("/tasks", json={"description": "new"})
+    )
+    assert validated.status_code == 201
+    assert list(fast.json()) == list(validated.json())
+    assert fast.json()["description"] == validated.json()["description"]
+    task = Task.create(User.get(1), "to change")
+    validated, fast = both_ways(
+        monkeypatch,
+        lambda: http.patch(f"/tasks/{task.id}", json={"done": True}),
+    )
+    assert validated.json() == {"id": task.id, "description": "to change", "done": True}
+    assert fast.json() == validated.json()
+    assert fast.headers["ETag"] == f'"{task.id}-2"'
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from starlette.middleware import Middleware
+from starlette.testclient import TestClient
+from api.frontdoor import BearerFastPath
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, User
+
+
+class Marker:
+    """Browser middleware that marks the scope, to tell which way a request went."""
+
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+
+    async def __call__(self, scope, receive, send):
+        scope.setdefault("browser", []).append(self.name)
+        await self.app(scope, receive, send)
+
+
+def route(headers, type="http"):
+    """The browser middleware a request with headers went through, in order."""
+    seen = []
+
+    async def inner(scope, receive, send):
+        seen.append(scope.get("browser", []))
+
+    front = BearerFastPath(
+        inner,
+        browser_middleware=[
+            Middleware(Marker, name="sessions"),
+            Middleware(Marker, name="csrf"),
+        ],
+    )
+    scope = {"type": type, "headers": headers}
+    asyncio.run(front(scope, None, None))
+    return seen[0]
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        [(b"authorization", b"Bearer abc")],
+        [(b"authorization", b"bearer abc")],
+        [(b"accept", b"*/*"), (b"authorization", b"BEARER abc")],
+    ],
+)
+def test_bearer_only_requests_skip_the_browser_middleware(headers):
+    assert route(headers) == []
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [
+        [(b"authorization", b"Bearer abc"), (b"cookie", b"session=x")],
+        [(b"cookie", b"session=x"), (b"authorization", b"Bearer abc")],
+        [(b"cookie", b"session=x")],
+        [(b"authorization", b"Basic abc")],
+        [(b"authorization", b"Bearer")],
+    ],
+)
+def test_other_requests_go_through_the_browser_middleware(headers):
+    assert route(headers) == ["sessions", "csrf"]
+
+
+def test_requests_without_credentials_go_the_browser_way():
+    assert route([]) == ["sessions", "csrf"]
+    assert route([(b"authorization", b"Bearer abc")], type="websocket") == [
+        "sessions",
+        "csrf",
+    ]
+
+
+def test_the_api_sets_csrf_cookies_only_for_browsers():
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    with TestClient(app) as http:
+        r = http.get(
+            "/tasks", headers={"Authorization": f"Bearer {token.access_token}"}
+        )
+        assert r.status_code == 200
+        assert "set-cookie" not in r.headers
+        r = http.get("/")
+        assert "csrftoken" in r.headers["set-cookie"]
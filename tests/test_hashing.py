@@ -0,0 +1,45 @@
+import asyncio
+from common import hashing
+from common.hashing import averify_client_secret, hash_secret, verify_secret
+from common.models import OAuth2Client, User
+
+
+def test_hash_secret_verifies_only_the_secret():
+    encoded = hash_secret("s3cret", iterations=1000)
+    assert encoded.startswith("pbkdf2_sha256$1000$")
+    assert verify_secret("s3cret", encoded)
+    assert not verify_secret("s3cret!", encoded)
+    assert not verify_secret("", encoded)
+
+
+def test_hashes_are_salted():
+    assert hash_secret("s3cret", iterations=1000) != hash_secret(
+        "s3cret", iterations=1000
+    )
+
+
+def test_malformed_hashes_do_not_verify():
+    encoded = hash_secret("s3cret", iterations=1000)
+    assert not verify_secret("s3cret", "s3cret")
+    assert not verify_secret("s3cret", encoded.replace("pbkdf2_sha256", "md5"))
+
+
+def test_averify_caches_only_successful_verifications():
+    hashing.verified.clear()
+    encoded = hash_secret("s3cret", iterations=1000)
+    assert not asyncio.run(averify_client_secret("client", "wrong", encoded))
+    assert len(hashing.verified) == 0
+    assert asyncio.run(averify_client_secret("client", "s3cret", encoded))
+    assert len(hashing.verified) == 1
+    assert asyncio.run(averify_client_secret("client", "s3cret", encoded))
+    other = hash_secret("s3cret", iterations=1000)
+    assert asyncio.run(averify_client_secret("client", "s3cret", other))
+    assert len(hashing.verified) == 2
+
+
+def test_clients_store_only_the_hash_of_their_secret():
+    client, secret = OAuth2Client.create(User.get(1))
+    stored = OAuth2Client.repository.get(client.client_id)
+    assert secret not in stored.client_secret_hash
+    assert stored.verify_secret(secret)
+    assert not stored.verify_secret(secret[:-1])
@@ -0,0 +1,25 @@
+import sys
+import threading
+from common.metrics import Registry
+
+
+def test_concurrent_increments_are_all_counted():
+    registry = Registry()
+    registry.counter("calls_total", "Calls.", ("kind",))
+
+    def increment():
+        for _ in range(20_000):
+            registry.increment("calls_total", ("a",))
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads often, to interleave the updates
+    try:
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert registry.counters["calls_total"][("a",)] == 8 * 20_000
+    assert 'calls_total{kind="a"} 160000' in registry.render()
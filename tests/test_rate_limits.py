@@ -0,0 +1,51 @@
+from starlette.middleware.cors import CORSMiddleware
+from starlette.testclient import TestClient
+from api.main import app
+from common import ratelimit
+from common.config import settings
+from common.models import OAuth2Client, OAuth2Token, User
+
+
+def test_token_requests_for_unknown_clients_are_limited(monkeypatch):
+    lookups = []
+    aget = OAuth2Client.aget
+
+    async def counted_aget(client_id):
+        lookups.append(client_id)
+        return await aget(client_id)
+
+    monkeypatch.setattr(OAuth2Client, "aget", counted_aget)
+    form = {
+        "grant_type": "client_credentials",
+        "client_id": "made-up",
+        "client_secret": "guess",
+    }
+    statuses = []
+    with TestClient(app) as client:
+        for _ in range(settings.TOKEN_RATE_LIMIT_BURST + 5):
+            client.cookies.clear()
+            statuses.append(client.post("/token", data=form).status_code)
+    ratelimit.token_requests.buckets.clear()
+    assert statuses.count(401) == settings.TOKEN_RATE_LIMIT_BURST
+    assert statuses.count(429) == 5
+    assert len(lookups) == settings.TOKEN_RATE_LIMIT_BURST
+
+
+def test_limited_requests_carry_cors_headers(monkeypatch):
+    origin = "https://tasks.example"
+    layer = app.middleware_stack
+    while not isinstance(layer, CORSMiddleware):
+        layer = layer.app
+    monkeypatch.setattr(layer, "allow_origins", [origin])
+    monkeypatch.setattr(ratelimit, "clients", ratelimit.TokenBuckets(0.001, 1, 10))
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    headers = {"Authorization": f"Bearer {token.access_token}", "Origin": origin}
+    with TestClient(app) as http:
+        statuses = []
+        for _ in range(2):
+            r = http.get("/tasks", headers=headers)
+            statuses.append(r.status_code)
+            assert r.headers["Access-Control-Allow-Origin"] == origin
+    assert statuses == [200, 429]
+    assert "Retry-After" in r.headers
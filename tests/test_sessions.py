@@ -0,0 +1,114 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.authentication import AuthenticationMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from common.backends import SessionAuthBackend
+from common.models import Session
+from common.repositories import MemorySessionRepository
+from common.sessions import ServerSessionMiddleware
+from console.main import login, logout
+
+
+class CountingSessionRepository(MemorySessionRepository):
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.saves = 0
+
+    def save(self, session_id, data, expires_at):
+        self.saves += 1
+        super().save(session_id, data, expires_at)
+
+
+class FakeCSRF:
+    """Stands in for asgi_csrf, which the login form takes its token from."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        scope["csrftoken"] = lambda: "token"
+        await self.app(scope, receive, send)
+
+
+async def whoami(request):
+    return PlainTextResponse(request.session.get("username", ""))
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    repository = CountingSessionRepository(100)
+    monkeypatch.setattr(Session, "repository", repository, raising=False)
+    return repository
+
+
+@pytest.fixture
+def console(sessions):
+    """The console's login and logout, with server-side sessions."""
+    app = Starlette(
+        routes=[
+            Route("/login", login, methods=["POST"]),
+            Route("/logout", logout),
+            Route("/whoami", whoami),
+        ],
+        middleware=[
+            Middleware(ServerSessionMiddleware, session_cookie="session"),
+            Middleware(FakeCSRF),
+            Middleware(AuthenticationMiddleware, backend=SessionAuthBackend()),
+        ],
+    )
+    with TestClient(app) as http:
+        yield http
+
+
+def use_session(http, session_id):
+    http.cookies.set("session", session_id, domain="testserver.local", path="/")
+
+
+def log_in(http):
+    r = http.post(
+        "/login",
+        data={"username": "bobby", "password": "bobby2"},
+        allow_redirects=False,
+    )
+    assert r.status_code == 302
+    return http.cookies["session"]
+
+
+def test_logging_in_and_out_changes_the_session_id(console, sessions):
+    use_session(console, "unknown")
+    logged_in = log_in(console)
+    assert console.get("/whoami").text == "bobby"
+    r = console.get("/logout", allow_redirects=False)
+    assert r.status_code == 307
+    logged_out = console.cookies["session"]
+    assert logged_out != logged_in
+    assert sessions.get(logged_in) is None
+    assert sessions.get(logged_out) is not None  # it holds the logged out message
+
+
+def test_an_old_session_id_is_not_logged_in(console):
+    logged_in = log_in(console)
+    console.get("/logout")
+    use_session(console, logged_in)
+    assert console.get("/whoami").text == ""
+
+
+def test_a_session_id_from_before_login_is_not_logged_in(console, sessions):
+    sessions.save("before", '{"next": "/"}', 2e9)
+    use_session(console, "before")
+    logged_in = log_in(console)
+    assert logged_in != "before"
+    assert sessions.get("before") is None
+
+
+def test_an_unchanged_session_is_not_saved(console, sessions):
+    log_in(console)
+    saves = sessions.saves
+    for _ in range(3):
+        r = console.get("/whoami")
+        assert r.text == "bobby"
+        assert "set-cookie" not in r.headers
+    assert sessions.saves == saves
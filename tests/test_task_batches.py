@@ -0,0 +1,103 @@
+from dataclasses import replace
+import pytest
+from starlette.testclient import TestClient
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from common.repositories import MemoryTaskRepository
+from common.sqlite import SQLiteDatabase, SQLiteTaskRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repository(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        repository = MemoryTaskRepository()
+    else:
+        repository = SQLiteTaskRepository(SQLiteDatabase(str(tmp_path / "db")), Task)
+    monkeypatch.setattr(Task, "repository", repository)
+    return repository
+
+
+@pytest.fixture
+def http():
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    with TestClient(app) as http:
+        http.headers["Authorization"] = f"Bearer {token.access_token}"
+        yield http
+
+
+def stored(tasks):
+    return [
+        (task.description, task.done, task.version)
+        for task in (Task.get(task.id) for task in tasks)
+    ]
+
+
+def test_a_missing_task_fails_the_whole_batch(repository, http):
+    tasks = Task.create_many(User.get(1), ["one", "two"])
+    before = stored(tasks)
+    patches = [{"id": task.id, "done": True} for task in tasks]
+    patches.insert(1, {"id": "nope", "done": True})
+    r = http.patch("/tasks/batch", json={"tasks": patches})
+    assert r.status_code == 404
+    assert [result["status"] for result in r.json()["results"]] == [424, 404, 424]
+    assert stored(tasks) == before
+
+
+def test_another_users_task_fails_the_whole_batch(repository, http):
+    mine = Task.create(User.get(1), "mine")
+    theirs = Task.create(User.get(2), "theirs")
+    patches = [{"id": mine.id, "done": True}, {"id": theirs.id, "done": True}]
+    r = http.patch("/tasks/batch", json={"tasks": patches})
+    assert r.status_code == 404
+    assert [result["status"] for result in r.json()["results"]] == [424, 404]
+    assert stored([mine, theirs]) == [("mine", False, 0), ("theirs", False, 0)]
+
+
+def test_a_stale_task_saves_none_of_the_batch(repository):
+    first, second = Task.create_many(User.get(1), ["one", "two"])
+    Task.get(second.id).update(description="changed elsewhere")
+    fresh = replace(first, version=1, done=True)
+    stale = replace(second, version=1, done=True)
+    assert repository.save_many([fresh, stale]) is False
+    assert stored([first, second]) == [
+        ("one", False, 0),
+        ("changed elsewhere", False, 1),
+    ]
+
+
+def test_a_batch_is_applied_again_after_a_conflicting_save(
+    repository, http, monkeypatch
+):
+    first, second = Task.create_many(User.get(1), ["one", "two"])
+    get_many = repository.get_many
+    reads = []
+
+    def get_many_then_change(task_ids):
+        tasks = get_many(task_ids)
+        if not reads:  # as if saved by another request between reading and saving
+            Task.get(second.id).update(description="changed elsewhere")
+        reads.append(task_ids)
+        return tasks
+
+    monkeypatch.setattr(repository, "get_many", get_many_then_change)
+    patches = [{"id": first.id, "done": True}, {"id": second.id, "done": True}]
+    r = http.patch("/tasks/batch", json={"tasks": patches})
+    assert r.status_code == 200
+    assert len(reads) == 2
+    assert [result["status"] for result in r.json()["results"]] == [200, 200]
+    assert stored([first, second]) == [
+        ("one", True, 1),
+        ("changed elsewhere", True, 2),
+    ]
+
+
+def test_a_batch_is_created_whole(repository, http):
+    r = http.post(
+        "/tasks/batch", json={"tasks": [{"description": "one"}, {"description": 2}]}
+    )
+    assert r.status_code == 201
+    r = http.post("/tasks/batch", json={"tasks": [{"description": "three"}, {}]})
+    assert r.status_code == 422
+    descriptions = [task.description for task in Task.for_user(User.get(1))]
+    assert descriptions == ["one", "2"]
@@ -0,0 +1,108 @@
+import asyncio
+from api.main import app, task_event_stream
+from common.events import TaskEventHub, hub
+from common.models import OAuth2Client, OAuth2Token, User
+
+
+def test_resuming_within_history_replays_the_missed_events():
+    events = TaskEventHub(history_size=10, queue_size=10)
+    for i in range(5):
+        events.publish(1, "created", {"id": str(i)})
+    events.publish(2, "created", {"id": "other"})
+
+    async def resume():
+        return events.subscribe(1, f"{events.epoch}:2")
+
+    _, missed = asyncio.run(resume())
+    assert [(e.seq, e.kind, e.task["id"]) for e in missed] == [
+        (3, "created", "2"),
+        (4, "created", "3"),
+        (5, "created", "4"),
+    ]
+
+
+def test_resuming_from_another_epoch_resets():
+    events = TaskEventHub(history_size=10, queue_size=10)
+    events.publish(1, "created", {"id": "1"})
+
+    async def resume():
+        return events.subscribe(1, "0123abcd:1")
+
+    _, missed = asyncio.run(resume())
+    assert [(e.seq, e.kind) for e in missed] == [(1, "reset")]
+
+
+def test_resuming_from_before_the_history_resets():
+    events = TaskEventHub(history_size=3, queue_size=10)
+    for i in range(6):
+        events.publish(1, "created", {"id": str(i)})
+
+    async def resume(last_event_id):
+        return events.subscribe(1, last_event_id)
+
+    _, missed = asyncio.run(resume(f"{events.epoch}:1"))
+    assert [(e.seq, e.kind) for e in missed] == [(6, "reset")]
+    _, missed = asyncio.run(resume(f"{events.epoch}:3"))
+    assert [e.seq for e in missed] == [4, 5, 6]
+
+
+def test_a_subscriber_that_falls_behind_is_dropped():
+    events = TaskEventHub(history_size=10, queue_size=2)
+
+    async def fall_behind():
+        subscription, _ = events.subscribe(1)
+        for i in range(3):
+            events.publish(1, "created", {"id": str(i)})
+        return await subscription.get(1)
+
+    assert asyncio.run(fall_behind()) is None
+    assert events.stats == {"subscribers": 0, "published": 3, "dropped": 1}
+
+
+def test_a_client_gone_before_the_stream_starts_leaves_no_subscription():
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/tasks/events",
+        "raw_path": b"/tasks/events",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"authorization", f"Bearer {token.access_token}".encode())],
+        "client": ("127.0.0.1", 1),
+        "server": ("testserver", 80),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("the client has gone")
+
+    async def request():
+        try:
+            await app(scope, receive, send)
+        except OSError:
+            pass
+
+    asyncio.run(request())
+    assert hub.stats["subscribers"] == 0
+
+
+def test_a_stream_unsubscribes_when_closed():
+    async def close_started():
+        stream = task_event_stream(1, "unknown:0")  # starts with a reset event
+        first = await stream.__anext__()
+        subscribers = hub.stats["subscribers"]
+        await stream.aclose()
+        return first, subscribers
+
+    first, subscribers = asyncio.run(close_started())
+    assert "event: reset" in first
+    assert subscribers == 1
+    assert hub.stats["subscribers"] == 0
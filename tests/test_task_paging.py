@@ -0,0 +1,63 @@
+import json
+import pytest
+from starlette.testclient import TestClient
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from common.repositories import MemoryTaskRepository
+from common.sqlite import SQLiteDatabase, SQLiteTaskRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repository(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        repository = MemoryTaskRepository()
+    else:
+        repository = SQLiteTaskRepository(SQLiteDatabase(str(tmp_path / "db")), Task)
+        monkeypatch.setattr(repository, "chunk_size", 3)
+    monkeypatch.setattr(Task, "repository", repository)
+    return repository
+
+
+@pytest.fixture
+def http():
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    with TestClient(app) as http:
+        http.headers["Authorization"] = f"Bearer {token.access_token}"
+        yield http
+
+
+def test_pages_follow_on_from_each_other(repository, http):
+    user, other = User.get(1), User.get(2)
+    created = []
+    for i in range(7):
+        created.append(Task.create(user, f"task {i}").id)
+        Task.create(other, f"other {i}")  # interleaved, so seq skips over them
+    seen, query = [], {"limit": 3}
+    while True:
+        data = http.get("/tasks", params=query).json()
+        seen.extend(task["id"] for task in data["tasks"])
+        if data["next_cursor"] is None:
+            break
+        query["cursor"] = data["next_cursor"]
+    assert seen == created
+    assert len(data["tasks"]) == 1
+
+
+def test_a_full_last_page_has_no_next_cursor(repository, http):
+    Task.create_many(User.get(1), ["one", "two"])
+    data = http.get("/tasks", params={"limit": 2}).json()
+    assert len(data["tasks"]) == 2
+    assert data["next_cursor"] is None
+
+
+def test_ndjson_streams_from_a_cursor(repository, http):
+    user = User.get(1)
+    created = [task.id for task in Task.create_many(user, [str(i) for i in range(8)])]
+    cursor = http.get("/tasks", params={"limit": 2}).json()["next_cursor"]
+    r = http.get("/tasks", params={"cursor": cursor, "format": "ndjson"})
+    assert [json.loads(line)["id"] for line in r.text.splitlines()] == created[2:]
+
+
+def test_invalid_cursor_is_refused(repository, http):
+    assert http.get("/tasks", params={"cursor": "garbage"}).status_code == 400
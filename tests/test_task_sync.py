@@ -0,0 +1,63 @@
+from starlette.testclient import TestClient
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from common.repositories import MemoryTaskRepository
+from common.sqlite import SQLiteDatabase, SQLiteTaskRepository
+
+
+def api_client(user):
+    client, _ = OAuth2Client.create(user)
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    http = TestClient(app)
+    http.headers["Authorization"] = f"Bearer {token.access_token}"
+    return http
+
+
+def test_since_returns_only_later_changes(monkeypatch):
+    monkeypatch.setattr(Task, "repository", MemoryTaskRepository())
+    user = User.get(1)
+    first = Task.create(user, "one")
+    with api_client(user) as http:
+        since = http.get("/tasks").json()["revision"]
+        first.update(done=True)
+        second = Task.create(user, "two")
+        data = http.get("/tasks", params={"since": since}).json()
+        assert [task["id"] for task in data["tasks"]] == [first.id, second.id]
+        data = http.get("/tasks", params={"since": data["revision"]}).json()
+        assert data["tasks"] == []
+
+
+def test_since_from_a_replaced_store_is_gone(monkeypatch):
+    """As when the api restarts with in-memory storage, and the user's tasks are
+    written again past the revision the client last saw before it syncs.
+    """
+    monkeypatch.setattr(Task, "repository", MemoryTaskRepository())
+    user = User.get(1)
+    Task.create(user, "one")
+    with api_client(user) as http:
+        since = http.get("/tasks").json()["revision"]
+        monkeypatch.setattr(Task, "repository", MemoryTaskRepository())
+        Task.create_many(user, ["two", "three"])
+        assert http.get("/tasks", params={"since": since}).status_code == 410
+        assert http.get("/tasks", params={"since": "0123abcd:5"}).status_code == 410
+
+
+def test_since_that_is_not_a_revision_is_invalid(monkeypatch):
+    monkeypatch.setattr(Task, "repository", MemoryTaskRepository())
+    user = User.get(1)
+    Task.create(user, "one")
+    with api_client(user) as http:
+        epoch = http.get("/tasks").json()["revision"].partition(":")[0]
+        for since in ["garbage", "5", ":5", f"{epoch}:", f"{epoch}:x", f"{epoch}:²"]:
+            r = http.get("/tasks", params={"since": since})
+            assert r.status_code == 400, since
+            assert r.json() == {"detail": "Invalid revision"}
+        assert http.get("/tasks", params={"since": f"{epoch}:0"}).status_code == 200
+
+
+def test_sqlite_epoch_is_kept_in_the_database(tmp_path):
+    path = str(tmp_path / "db")
+    epoch = SQLiteTaskRepository(SQLiteDatabase(path), Task).epoch()
+    assert SQLiteTaskRepository(SQLiteDatabase(path), Task).epoch() == epoch
+    other = str(tmp_path / "other")
+    assert SQLiteTaskRepository(SQLiteDatabase(other), Task).epoch() != epoch
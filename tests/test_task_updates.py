@@ -0,0 +1,77 @@
+import pytest
+from starlette.testclient import TestClient
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, Task, User
+from common.repositories import MemoryTaskRepository
+from common.sqlite import SQLiteDatabase, SQLiteTaskRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repository(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        repository = MemoryTaskRepository()
+    else:
+        repository = SQLiteTaskRepository(SQLiteDatabase(str(tmp_path / "db")), Task)
+    monkeypatch.setattr(Task, "repository", repository)
+    return repository
+
+
+def test_update_saves_a_new_version(repository):
+    task = Task.create(User.get(1), "write tests")
+    updated = task.update(done=True)
+    assert updated.version == 1
+    stored = Task.get(task.id)
+    assert (stored.version, stored.done) == (1, True)
+
+
+def test_concurrent_updates_of_the_same_version_save_only_one(repository):
+    task = Task.create(User.get(1), "write tests")
+    read_by_a, read_by_b = Task.get(task.id), Task.get(task.id)
+    assert read_by_a.update(description="from A") is not None
+    assert read_by_b.update(description="from B") is None
+    stored = Task.get(task.id)
+    assert (stored.version, stored.description) == (1, "from A")
+
+
+def test_update_many_is_all_or_nothing_and_rereads_on_conflict(repository):
+    user = User.get(1)
+    first, second = Task.create_many(user, ["one", "two"])
+    stale = Task.get(first.id)
+    Task.get(first.id).update(description="changed")
+    tasks, missing = Task.update_many(user, [(first.id, {"done": True})])
+    assert not missing
+    assert (tasks[0].version, tasks[0].description, tasks[0].done) == (
+        2,
+        "changed",
+        True,
+    )
+    assert stale.update(done=False) is None
+    tasks, missing = Task.update_many(
+        user, [(second.id, {"done": True}), ("nope", {"done": True})]
+    )
+    assert missing == {"nope"}
+    assert Task.get(second.id).version == 0
+
+
+def test_stale_if_match_is_refused():
+    user = User.get(1)
+    client, _ = OAuth2Client.create(user)
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    task = Task.create(user, "write tests")
+    with TestClient(app) as http:
+        http.headers["Authorization"] = f"Bearer {token.access_token}"
+        r = http.patch(f"/tasks/{task.id}", json={"done": True})
+        assert r.headers["ETag"] == f'"{task.id}-1"'
+        r = http.patch(
+            f"/tasks/{task.id}",
+            json={"done": False},
+            headers={"If-Match": f'"{task.id}-0"'},
+        )
+        assert r.status_code == 412
+        r = http.patch(
+            f"/tasks/{task.id}",
+            json={"done": False},
+            headers={"If-Match": f'"{task.id}-1"'},
+        )
+        assert r.status_code == 200
+        assert r.json()["done"] is False
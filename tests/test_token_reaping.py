@@ -0,0 +1,71 @@
+import datetime
+import secrets
+import pytest
+from common.models import OAuth2Token
+from common.repositories import MemoryTokenRepository
+
+
+START = datetime.datetime(2022, 1, 1)
+
+
+def token(expires_at, client_id="client"):
+    return OAuth2Token(
+        client_id=client_id,
+        access_token=secrets.token_urlsafe(32),
+        refresh_token=secrets.token_urlsafe(32),
+        access_token_expires_at=expires_at,
+    )
+
+
+def test_reap_keeps_refresh_tokens_for_the_grace_period():
+    store = MemoryTokenRepository(grace_seconds=60)
+    expired = token(START)
+    store.add(expired)
+    store.reap(100, now=START + datetime.timedelta(seconds=30))
+    assert store.get_by_refresh_token(expired.refresh_token) is expired
+    store.reap(100, now=START + datetime.timedelta(seconds=60))
+    assert store.get(expired.access_token) is None
+    assert store.get_by_refresh_token(expired.refresh_token) is None
+    assert store.for_client("client") == []
+
+
+def test_reap_evicts_at_most_limit_tokens_and_skips_removed_ones():
+    store = MemoryTokenRepository()
+    tokens = [token(START) for _ in range(10)]
+    for t in tokens:
+        store.add(t)
+    store.remove(tokens[0])
+    assert store.reap(4, now=START) == 4
+    assert store.reap(100, now=START) == 6
+    assert store.evicted == 9
+    assert store.stats["expiry_heap"] == 0
+
+
+def test_churn_leaves_nothing_behind():
+    """Churn tokens for several clients on a simulated clock, at 1000 a second with a
+    minute to live and a minute of grace, reaping every 5 seconds as the api's
+    reaper would, and removing some early as refreshes do. The store holds at most
+    about two minutes' worth, and once the clock passes the last expiry and its
+    grace, every index is empty again.
+    """
+    store = MemoryTokenRepository(grace_seconds=60)
+    timeout = datetime.timedelta(seconds=60)
+    most = 0
+    for i in range(1, 200_001):
+        now = START + datetime.timedelta(milliseconds=i)
+        added = token(now + timeout, client_id=f"client {i % 7}")
+        store.add(added)
+        if i % 3 == 0:
+            store.remove(added)
+        if i % 5000 == 0:
+            while store.reap(1000, now=now) == 1000:
+                pass
+            most = max(most, store.stats["expiry_heap"])
+    assert most <= 125_000
+    store.reap(1_000_000, now=now + 2 * timeout)
+    stats = store.stats
+    assert stats["access_tokens"] == 0
+    assert stats["refresh_tokens"] == 0
+    assert stats["clients"] == 0
+    assert stats["expiry_heap"] == 0
+    assert store.client_tokens == {}
@@ -0,0 +1,66 @@
+import pytest
+from starlette.testclient import TestClient
+from api.main import app
+from common.models import OAuth2Client, OAuth2Token, User
+from common.repositories import MemoryTokenRepository
+from common.sqlite import SQLiteDatabase, SQLiteTokenRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def repository(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        repository = MemoryTokenRepository()
+    else:
+        db = SQLiteDatabase(str(tmp_path / "db"))
+        repository = SQLiteTokenRepository(db, OAuth2Token)
+    monkeypatch.setattr(OAuth2Token, "repository", repository)
+    return repository
+
+
+def test_refreshing_an_unshared_token_revokes_it(repository):
+    client, _ = OAuth2Client.create(User.get(1))
+    token = OAuth2Token.create_for_client(client, "client_credentials")
+    refreshed = OAuth2Token.refresh(token.refresh_token)
+    assert refreshed.access_token != token.access_token
+    assert OAuth2Token.get(token.access_token) is None
+    with pytest.raises(KeyError):
+        OAuth2Token.refresh(token.refresh_token)
+
+
+def test_refreshing_a_shared_token_leaves_it_for_its_other_holders(repository):
+    client, _ = OAuth2Client.create(User.get(1))
+    first = OAuth2Token.create_for_client(client, "client_credentials")
+    second = OAuth2Token.create_for_client(client, "client_credentials")
+    assert second.access_token == first.access_token
+    assert OAuth2Token.get(first.access_token).shared
+    OAuth2Token.refresh(first.refresh_token)
+    assert OAuth2Token.get(first.access_token) is not None
+    OAuth2Token.refresh(second.refresh_token)
+
+
+def test_holders_of_a_shared_token_can_each_refresh_it():
+    client, secret = OAuth2Client.create(User.get(1))
+    form = {
+        "grant_type": "client_credentials",
+        "client_id": client.client_id,
+        "client_secret": secret,
+    }
+    with TestClient(app) as http:
+        a = http.post("/token", data=form).json()
+        http.cookies.clear()
+        b = http.post("/token", data=form).json()
+        assert a == b
+        http.cookies.clear()
+        r = http.post(
+            "/token-refresh",
+            data={"grant_type": "refresh_token", "refresh_token": a["refresh_token"]},
+        )
+        assert r.status_code == 200
+        http.cookies.clear()
+        r = http.get("/tasks", headers={"Authorization": f"Bearer {b['access_token']}"})
+        assert r.status_code == 200
+        r = http.post(
+            "/token-refresh",
+            data={"grant_type": "refresh_token", "refresh_token": b["refresh_token"]},
+        )
+        assert r.status_code == 200
@@ -0,0 +1,97 @@
+import datetime
+import time
+import pytest
+from starlette.testclient import TestClient
+from api.main import app
+from common.config import settings
+from common.models import OAuth2Client, User
+from common.sqlite import SQLiteDatabase, SQLiteDeniedTokenRepository
+from common.tokens import (
+    DenyList,
+    denied,
+    deny_access_token,
+    sign_access_token,
+    verify_access_token,
+)
+
+
+@pytest.fixture(autouse=True)
+def deny_list(monkeypatch):
+    """deny_access_token adds to the module's deny-list, which the api checks too,
+    so each test starts with an empty one and the list is restored after it.
+    """
+    monkeypatch.setattr(denied, "entries", {})
+    monkeypatch.setattr(denied, "repository", None)
+    monkeypatch.setattr(denied, "synced", 0)
+    return denied
+
+
+CLIENT = OAuth2Client(
+    user=User(id=1, username="ronnie", password=""),
+    client_id="client",
+    client_secret_hash="",
+)
+
+
+def signed_token(seconds=60):
+    expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)
+    return sign_access_token(CLIENT, expires)
+
+
+def test_signed_tokens_carry_their_claims():
+    claims = verify_access_token(signed_token())
+    assert claims["cid"] == "client"
+    assert claims["uid"] == 1
+    assert claims["scope"] == "api"
+
+
+def test_tampered_and_malformed_tokens_are_refused():
+    body, _, sig = signed_token().partition(".")
+    other_body = signed_token().partition(".")[0]
+    assert verify_access_token(f"{other_body}.{sig}") is None
+    assert verify_access_token(f"{body}.{sig[:-1]}") is None
+    assert verify_access_token(body) is None
+    assert verify_access_token("") is None
+    assert verify_access_token("abc.d\xe9f") is None
+    assert verify_access_token(f"{body}.{sig[:-1]}\xe9") is None
+
+
+def test_expired_tokens_are_refused():
+    assert verify_access_token(signed_token(seconds=-1)) is None
+
+
+def test_denied_tokens_are_refused(deny_list):
+    token = signed_token()
+    deny_access_token(token)
+    assert len(deny_list) == 1
+    assert verify_access_token(token) is None
+    assert verify_access_token(signed_token()) is not None
+
+
+def test_sqlite_deny_list_is_synced_between_processes(tmp_path):
+    path = str(tmp_path / "tokens.db")
+    workers = [DenyList(), DenyList()]
+    for worker in workers:
+        worker.repository = SQLiteDeniedTokenRepository(SQLiteDatabase(path))
+    now = time.time()
+    workers[0].add("revoked", now + 60)
+    workers[0].add("expired", now - 1)
+    assert "revoked" in workers[0]
+    assert "revoked" not in workers[1]
+    workers[1].sync()
+    assert "revoked" in workers[1]
+    assert workers[0].repository.purge(now) == 1
+    workers[0].add("later", now + 60)
+    workers[1].sync()
+    assert "later" in workers[1]
+    fresh = DenyList()
+    fresh.repository = workers[0].repository
+    fresh.sync()
+    assert set(fresh.entries) == {"revoked", "later"}
+
+
+def test_non_ascii_bearer_tokens_are_refused_by_the_api(monkeypatch):
+    monkeypatch.setattr(settings, "ACCESS_TOKEN_FORMAT", "signed")
+    with TestClient(app) as client:
+        r = client.get("/tasks", headers={"Authorization": "Bearer abc.d\xe9f"})
+    assert r.status_code == 403
@@ -0,0 +1,70 @@
+import pytest
+from common.models import User
+from common.repositories import MemoryUserRepository
+from common.sqlite import SQLiteDatabase, SQLiteUserRepository
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def users(request, tmp_path):
+    if request.param == "memory":
+        repository = MemoryUserRepository()
+    else:
+        repository = SQLiteUserRepository(SQLiteDatabase(str(tmp_path / "db")), User)
+    repository.add_many([User(id=1, username="alice", password="a")])
+    return repository
+
+
+def usernames(users):
+    return {user.id: user.username for user in users.all()}
+
+
+def test_a_username_repeated_in_a_batch_fails_all_of_it(users):
+    with pytest.raises(ValueError):
+        users.add_many(
+            [
+                User(id=2, username="bob", password="b"),
+                User(id=3, username="carol", password="c"),
+                User(id=4, username="bob", password="d"),
+            ]
+        )
+    assert usernames(users) == {1: "alice"}
+    assert users.get_by_username("bob") is None
+
+
+def test_a_stored_username_fails_all_of_the_batch(users):
+    with pytest.raises(ValueError):
+        users.add_many(
+            [
+                User(id=2, username="bob", password="b"),
+                User(id=3, username="alice", password="c"),
+            ]
+        )
+    assert usernames(users) == {1: "alice"}
+    assert users.get_by_username("alice").id == 1
+
+
+def test_users_are_replaced_by_id(users):
+    users.add_many(
+        [
+            User(id=1, username="alice", password="new"),
+            User(id=2, username="bob", password="b"),
+        ]
+    )
+    assert users.get_by_username("alice").password == "new"
+    users.add_many([User(id=1, username="alicia", password="new")])
+    assert usernames(users) == {1: "alicia", 2: "bob"}
+    assert users.get_by_username("alice") is None
+    users.add_many([User(id=3, username="alice", password="c")])
+    assert users.get_by_username("alice").id == 3
+
+
+def test_users_can_swap_usernames_in_a_batch(users):
+    users.add_many([User(id=2, username="bob", password="b")])
+    users.add_many(
+        [
+            User(id=1, username="bob", password="a"),
+            User(id=2, username="alice", password="b"),
+        ]
+    )
+    assert usernames(users) == {1: "bob", 2: "alice"}
+    assert users.get_by_username("bob").id == 1